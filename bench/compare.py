@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Compare two sets of results from bench/microbench.py.
+#
+# For each benchmark present in both files, print the old and new times and
+# their ratio, and flag those that got slower by more than the threshold.  The
+# exit status is 1 if there's any such regression, so this can gate a commit:
+#
+#     bench/microbench.py --output old.json   # on the old commit
+#     bench/microbench.py --output new.json   # on the new one
+#     bench/compare.py old.json new.json
+#
+# Usage: bench/compare.py [--threshold FRACTION] [--stat min|median] OLD NEW
+
+import argparse
+import json
+import sys
+
+def compare(old, new, threshold=0.1, stat='median'):
+    """Compare two result dictionaries, as saved by microbench.py.
+
+    Returns a list of (name, old time, new time, ratio, regressed?), for the
+    benchmarks in both.
+
+    >>> old = {'results': {'a': {'median': 1.0}, 'b': {'median': 2.0}}}
+    >>> new = {'results': {'a': {'median': 1.5}, 'b': {'median': 2.1}}}
+    >>> [(name, ratio, regressed) for name, o, n, ratio, regressed
+    ...  in compare(old, new)]
+    [('a', 1.5, True), ('b', 1.05, False)]
+    """
+
+    rows = []
+    for name, old_result in old['results'].items():
+        if name not in new['results']:
+            continue
+        old_time = old_result[stat]
+        new_time = new['results'][name][stat]
+        ratio = new_time / old_time
+        rows.append((name, old_time, new_time, ratio, ratio > 1 + threshold))
+    return(rows)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two microbench.py results.')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='flag slowdowns larger than this fraction (default: 0.1)')
+    parser.add_argument('--stat', choices=('min', 'median'), default='median')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    if old.get('fixture_sha256') != new.get('fixture_sha256'):
+        print("Warning: the results are from different fixtures.")
+
+    print("%-24s %12s %12s %8s" % ('benchmark', 'old (ms)', 'new (ms)', 'ratio'))
+    regressions = 0
+    for name, old_time, new_time, ratio, regressed in compare(old, new,
+                                                              args.threshold,
+                                                              args.stat):
+        if regressed:
+            regressions += 1
+            flag = '  SLOWER'
+        else:
+            flag = ''
+        print("%-24s %12.3f %12.3f %8.2f%s"
+              % (name, old_time * 1000, new_time * 1000, ratio, flag))
+
+    if regressions:
+        print("%d benchmark(s) slower by more than %d%%."
+              % (regressions, args.threshold * 100))
+        sys.exit(1)
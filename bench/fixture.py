@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# Build a full-size fixture for the benchmarks.
+#
+# The benchmarks must run offline, without the Joyo PDF and pdfbox.  We have
+# the data itself in output/*.tsv, though; so we write it back in the format of
+# the pdfbox text of the table (本表 and 付表), one line per reading, which the
+# parser reads like the real thing.  The result has every kanji, reading and
+# example, but no notes (参考), page headers or other irregular lines; those
+# are covered by the small, hand-extracted fixtures/joyo_sample.txt.
+#
+# Usage: bench/fixture.py [output file]
+
+from collections import defaultdict
+import os
+import sys
+
+# "The parent dir of the directory of the full path of this file."
+basedir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(basedir)
+
+from joyodb import outputdir
+
+SAMPLE_FIXTURE = basedir + '/bench/fixtures/joyo_sample.txt'
+
+# The appendix lists these pairs as a single entry; in the text, they end up
+# glued together (see convert.parse_appendix_table()).
+APPENDIX_BUNDLES = {
+    '海女': '海士',
+    '河原': '川原',
+    '叔父': '伯父',
+    '叔母': '伯母',
+    '母屋': '母家',
+    '数寄屋': '数奇屋',
+    '二十': '二十歳',
+}
+
+# Hardcoded by the parser, since they don't come out in 4-field lines.
+APPENDIX_HARDCODED = ['しわす', 'しはす', 'はつか']
+
+def read_tsv(name, header=True):
+    with open(outputdir + '/' + name, 'rt') as f:
+        if header:
+            f.readline()
+        return([line.rstrip("\n").split("\t") for line in f])
+
+def main_table_lines():
+    "Generate the lines of the main table (本表)."
+
+    from joyodb.convert import is_examples, is_reading
+
+    old_kanji = {}
+    for kanji, old in read_tsv('old_kanji.tsv', header=False):
+        old_kanji.setdefault(kanji, []).append(old)
+
+    examples = defaultdict(list)
+    for kanji, reading, uncommon, variation, example, pos, literary in read_tsv('examples.tsv'):
+        if pos == 'Adverb':
+            example += '〔副〕'
+        elif pos == 'Conjunction':
+            example += '〔接〕'
+        elif pos == 'Suffix':
+            example = '……' + example
+        examples[(kanji, reading)].append(example)
+
+    readings = defaultdict(list)
+    for kanji, reading, romaji, kind, uncommon, variation, altort in read_tsv('readings.tsv'):
+        # Variations come from glossed examples of the main reading.
+        if not variation:
+            readings[kanji].append((reading, uncommon))
+
+    yield('本表')
+    yield('漢字\t音訓\t例\t備考')
+    for kanji, kanji_readings in readings.items():
+        first = True
+        for reading, uncommon in kanji_readings:
+            text = reading.replace('.', '')
+            if uncommon:
+                text = '　' + text
+            if not is_reading(text):
+                continue
+            example_str = '，'.join([e for e in examples[(kanji, reading)]
+                                    if is_examples(e)])
+            if first:
+                # Lines with old kanji but no examples have a different
+                # layout, which we don't reproduce.
+                old = old_kanji.get(kanji, [])
+                if len(old) == 1 and example_str:
+                    old = '（%s）' % old[0]
+                else:
+                    old = ''
+                yield('%s\t%s\t \t \t\t \t \t %s\t %s\t' % (kanji, old, text, example_str))
+                first = False
+            elif example_str:
+                yield('\t \t \t %s\t %s\t' % (text, example_str))
+
+def appendix_lines():
+    "Generate the lines of the appendix (付表), two entries per line."
+
+    entries = []
+    bundled = set(APPENDIX_BUNDLES.values())
+    for kana, orthography in read_tsv('compounds_by_reading.tsv'):
+        if kana in APPENDIX_HARDCODED or orthography in bundled:
+            continue
+        entries.append((kana, orthography + APPENDIX_BUNDLES.get(orthography, '')))
+
+    yield('付表')
+    for i in range(0, len(entries), 2):
+        pair = entries[i:i+2]
+        if len(pair) == 2:
+            yield('%s\t%s\t%s\t%s' % (pair[0] + pair[1]))
+
+def build_fixture(path):
+    "Write the full-size fixture into path."
+    with open(path, 'wt') as f:
+        for line in main_table_lines():
+            f.write(line + "\n")
+        for line in appendix_lines():
+            f.write(line + "\n")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    else:
+        path = 'joyo_full.txt'
+    build_fixture(path)
+    print(path)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# Measure how long it takes to import the joyodb modules.
+#
+# Each import is timed in a fresh interpreter, several times, and we report the
+# median.  Only the import itself is timed, not the interpreter startup.  With
+# --max-ms, exit with an error if importing joyodb takes longer than that, so
+# that this can be used to catch regressions.
+#
+# Usage: bench/import_time.py [--runs N] [--max-ms MS] [module...]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# "The parent dir of the directory of the full path of this file."
+basedir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+DEFAULT_MODULES = ['joyodb', 'joyodb.model', 'joyodb.lookup', 'joyodb.scan',
+                   'joyodb.convert']
+
+TIMER = """
+import sys, time
+sys.path.insert(0, %r)
+t = time.perf_counter()
+import %s
+print(time.perf_counter() - t)
+"""
+
+def import_time(module, runs=10):
+    "Return the median time, in seconds, to import module in a new Python."
+
+    times = []
+    for i in range(runs):
+        output = subprocess.check_output([sys.executable, '-c',
+                                          TIMER % (basedir, module)])
+        times.append(float(output))
+    return(statistics.median(times))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time imports of joyodb modules.')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-ms', type=float,
+                        help='fail if "import joyodb" takes longer than this')
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.modules:
+        results[module] = import_time(module, args.runs) * 1000
+        print("%-16s %7.2f ms" % (module, results[module]))
+
+    if args.max_ms is not None:
+        if 'joyodb' not in results:
+            results['joyodb'] = import_time('joyodb', args.runs) * 1000
+        elapsed = results['joyodb']
+        if elapsed > args.max_ms:
+            print("import joyodb took %.2f ms, more than %.2f ms"
+                  % (elapsed, args.max_ms))
+            sys.exit(1)
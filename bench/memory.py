@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# Measure the memory used by the loaded Joyo data.
+#
+# We restore loaded_data from a snapshot (parsing the table first, if needed)
+# while tracing allocations, so that the result is the size of the object
+# graph alone, without the parser's temporary data.
+
+import gc
+import os
+import sys
+import tracemalloc
+
+# "The parent dir of the directory of the full path of this file."
+basedir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(basedir)
+
+import joyodb
+import joyodb.snapshot
+
+def measure():
+    "Return (bytes, number of objects) taken by the loaded data."
+
+    joyodb.load()
+    path = joyodb.snapshot.snapshot_path()
+
+    joyodb.loaded_data.kanjis = None
+    joyodb.loaded_data.compound_readings = None
+    gc.collect()
+
+    tracemalloc.start()
+    joyodb.snapshot.load_snapshot(path)
+    gc.collect()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    objects = 0
+    for k in joyodb.loaded_data.kanjis:
+        objects += 1
+        for r in k.readings:
+            objects += 1 + len(r.examples)
+
+    return(size, objects)
+
+if __name__ == '__main__':
+    size, objects = measure()
+    print("Loaded data: %d bytes, %d Kanji/Reading/Example objects (%.1f bytes/object)"
+          % (size, objects, size / objects))
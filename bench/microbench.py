@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+# Microbenchmarks for the parser, the models and the exporters.
+#
+# Runs offline, over a fixture in the format of the Joyo text: by default, a
+# full-size one built from output/*.tsv (see bench/fixture.py); or any other
+# file given with --fixture, like fixtures/joyo_sample.txt or the real
+# cache/joyokanjihyo_20101130.txt.
+#
+# Each benchmark runs once to warm up, and then --repeat times; we report the
+# minimum and median times.  With --output, the results are saved as JSON, and
+# bench/compare.py can compare two such files (say, from two commits).
+#
+# Usage: bench/microbench.py [--fixture FILE] [--repeat N] [--output FILE]
+#                            [benchmark...]
+
+import argparse
+import datetime
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# "The parent dir of the directory of the full path of this file."
+basedir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(basedir)
+sys.path.append(basedir + '/bench')
+
+# (name, function, setup); see benchmark().
+BENCHMARKS = []
+
+def benchmark(name, setup=None):
+    """Register a benchmark.
+
+    The decorated function is timed; it gets the return value of setup()
+    (which is not timed, and runs before every repetition), and returns the
+    number of items processed.
+    """
+
+    def register(function):
+        BENCHMARKS.append((name, function, setup))
+        return(function)
+    return(register)
+
+# Filled by prepare().
+fixture_lines = []
+main_table_lines = []
+appendix_text = ''
+
+def prepare(fixture):
+    "Read the fixture, and parse it once for the benchmarks that need data."
+
+    global fixture_lines, main_table_lines, appendix_text
+    from joyodb.convert import is_empty, is_page_index, is_sound_index, is_appendix_start
+
+    with open(fixture, 'rt') as f:
+        fixture_lines = f.readlines()
+
+    main_table_lines = []
+    section = None
+    appendix = []
+    for line in fixture_lines:
+        if section is None:
+            if line.strip() == '本表':
+                section = 'header'
+        elif section == 'appendix':
+            appendix.append(line)
+        elif is_appendix_start(line):
+            section = 'appendix'
+        elif is_empty(line) or is_page_index(line) or is_sound_index(line):
+            continue
+        elif section == 'header':
+            section = 'main'
+        else:
+            main_table_lines.append(line)
+    appendix_text = ''.join(appendix)
+
+    joyodb.convert.parse()
+
+def all_readings():
+    return([r for k in joyodb.loaded_data.kanjis for r in k.readings])
+
+@benchmark('parse')
+def bench_parse(arg):
+    joyodb.convert.parse()
+    return(len(fixture_lines))
+
+@benchmark('split_main_table_row')
+def bench_split_main_table_row(arg):
+    split_main_table_row = joyodb.convert.split_main_table_row
+    for line in main_table_lines:
+        split_main_table_row(line)
+    return(len(main_table_lines))
+
+@benchmark('main_table_row_fields')
+def bench_main_table_row_fields(arg):
+    main_table_row_fields = joyodb.convert.main_table_row_fields
+    for line in main_table_lines:
+        main_table_row_fields(line)
+    return(len(main_table_lines))
+
+def setup_parse_appendix_table():
+    joyodb.loaded_data.joyotxt = io.StringIO(appendix_text)
+
+@benchmark('parse_appendix_table', setup_parse_appendix_table)
+def bench_parse_appendix_table(arg):
+    joyodb.convert.parse_appendix_table()
+    return(appendix_text.count("\n"))
+
+def setup_delimit_okurigana():
+    # Include the cost of building the matchers, as in a parse.
+    joyodb.okurigana.okurigana_matcher.cache_clear()
+    cases = []
+    for r in all_readings():
+        if r.kind == 'Kun':
+            for e in r.examples:
+                cases.append((r.kanji.kanji, r.reading.replace('.', ''), e.example))
+    return(cases)
+
+@benchmark('delimit_okurigana', setup_delimit_okurigana)
+def bench_delimit_okurigana(cases):
+    delimit_okurigana = joyodb.okurigana.delimit_okurigana
+    for kanji, reading, example in cases:
+        delimit_okurigana(kanji, reading, example)
+    return(len(cases))
+
+def setup_add_examples():
+    "Fresh Reading objects, each with the example fields of its table rows."
+
+    from joyodb.model import Kanji, Reading
+
+    main_table_row_fields = joyodb.convert.main_table_row_fields
+    cases = []
+    k = None
+    for line in main_table_lines:
+        fields = main_table_row_fields(line)
+        if 'kanji' in fields:
+            k = Kanji(fields['kanji'])
+        if 'reading' in fields:
+            cases.append((Reading(k, fields['reading']), []))
+        if 'examples' in fields and cases:
+            cases[-1][1].append(fields['examples'])
+    return(cases)
+
+@benchmark('Reading.add_examples', setup_add_examples)
+def bench_add_examples(cases):
+    for reading, examples in cases:
+        for examples_str in examples:
+            reading.add_examples(examples_str)
+    return(len(cases))
+
+@benchmark('popularize')
+def bench_popularize(arg):
+    text = ''.join(fixture_lines)
+    joyodb.popularize(text)
+    return(len(text))
+
+@benchmark('Reading.romaji', all_readings)
+def bench_romaji(readings):
+    for r in readings:
+        r.romaji()
+    return(len(readings))
+
+@benchmark('Reading.to_hiragana', all_readings)
+def bench_to_hiragana(readings):
+    for r in readings:
+        r.to_hiragana()
+    return(len(readings))
+
+def all_reading_strings():
+    return([r.reading for r in all_readings()])
+
+@benchmark('kana.to_romaji_many', all_reading_strings)
+def bench_kana_to_romaji_many(readings):
+    joyodb.kana.to_romaji_many(readings)
+    return(len(readings))
+
+@benchmark('kana.katakana_to_hiragana_many', all_reading_strings)
+def bench_kana_katakana_to_hiragana_many(readings):
+    joyodb.kana.katakana_to_hiragana_many(readings)
+    return(len(readings))
+
+@benchmark('KanaIndex')
+def bench_kana_index(arg):
+    joyodb.kanaindex.KanaIndex(joyodb.loaded_data.kanjis)
+    return(len(all_readings()))
+
+def setup_kana_index_queries():
+    "Every prefix of up to two kana."
+    index = joyodb.kanaindex.KanaIndex(joyodb.loaded_data.kanjis)
+    prefixes = sorted(set([key[:n] for key in index.keys for n in (1, 2)]))
+    return(index, prefixes)
+
+@benchmark('KanaIndex.top', setup_kana_index_queries)
+def bench_kana_index_top(arg):
+    index, prefixes = arg
+    for prefix in prefixes:
+        index.top(prefix, 10)
+    return(len(prefixes))
+
+def setup_furigana():
+    "A text made of all the examples, and an Annotator (built once)."
+    global annotator
+    if annotator is None:
+        annotator = joyodb.furigana.Annotator(joyodb.loaded_data.kanjis,
+                                              joyodb.loaded_data.compound_readings)
+    return('は'.join([e.example for r in all_readings() for e in r.examples]) + '。')
+
+annotator = None
+
+@benchmark('furigana.annotate', setup_furigana)
+def bench_furigana(text):
+    annotator.annotate(text)
+    return(len(text))
+
+# Opening the data, without parsing.
+
+def setup_load_snapshot():
+    path = scratchdir + '/snapshot.pickle'
+    if not os.path.exists(path):
+        joyodb.snapshot.save_snapshot(path)
+    return(path)
+
+@benchmark('load_snapshot', setup_load_snapshot)
+def bench_load_snapshot(path):
+    joyodb.snapshot.load_snapshot(path)
+    return(len(joyodb.loaded_data.kanjis))
+
+def setup_binary_database():
+    path = scratchdir + '/joyodb.bin'
+    if not os.path.exists(path):
+        joyodb.binary.write(path, joyodb.loaded_data.kanjis,
+                            joyodb.loaded_data.compound_readings)
+    return(path)
+
+@benchmark('binary.Database', setup_binary_database)
+def bench_binary_database(path):
+    db = joyodb.binary.Database(path)
+    db.get('国').readings[0].examples[0].example
+    db.close()
+    return(len(joyodb.loaded_data.kanjis))
+
+def setup_charclass():
+    "The furigana text, and a CharClass (built once)."
+    global charclass
+    if charclass is None:
+        charclass = joyodb.charclass.CharClass.from_kanjis(joyodb.loaded_data.kanjis)
+    return(setup_furigana())
+
+charclass = None
+
+@benchmark('CharClass.count', setup_charclass)
+def bench_charclass_count(text):
+    charclass.count(text)
+    return(len(text))
+
+@benchmark('charclass with a set, per character', setup_charclass)
+def bench_charclass_set(text):
+    joyo = set([k.kanji for k in joyodb.loaded_data.kanjis])
+    count = 0
+    for ch in text:
+        if ch in joyo:
+            count += 1
+    return(len(text))
+
+def setup_coverage():
+    "Each example as a document, and a Coverage (built once)."
+    global coverage
+    if coverage is None:
+        coverage = joyodb.coverage.Coverage(joyodb.loaded_data.kanjis)
+    return([e.example for r in all_readings() for e in r.examples])
+
+coverage = None
+
+@benchmark('Coverage.histograms', setup_coverage)
+def bench_coverage_histograms(documents):
+    coverage.histograms(documents)
+    return(len(documents))
+
+@benchmark('coverage.python_histogram', setup_coverage)
+def bench_coverage_python(documents):
+    categories = joyodb.coverage.character_categories(joyodb.loaded_data.kanjis)
+    for document in documents:
+        joyodb.coverage.python_histogram(document, categories)
+    return(len(documents))
+
+# What joyodb.kana replaced, for comparison.
+
+@benchmark('romkan.to_hepburn', all_reading_strings)
+def bench_romkan_to_hepburn(readings):
+    import romkan
+    for r in readings:
+        romkan.to_hepburn(r)
+    return(len(readings))
+
+@benchmark('romkan katakana to hiragana', all_reading_strings)
+def bench_romkan_to_hiragana(readings):
+    import romkan
+    for r in readings:
+        romkan.to_hiragana(romkan.to_roma(r))
+    return(len(readings))
+
+def exporter_benchmark(name):
+    "Register a benchmark for joyodb.convert.convert_to_<name>()."
+
+    def run(directory):
+        getattr(joyodb.convert, 'convert_to_' + name)(directory)
+        return(len(joyodb.loaded_data.kanjis))
+
+    def setup():
+        shutil.rmtree(scratchdir)
+        os.mkdir(scratchdir)
+        return(scratchdir)
+
+    benchmark('convert_to_' + name, setup)(run)
+
+for exporter in ('tsv', 'sql', 'json', 'ndjson', 'html', 'binary', 'charclass'):
+    exporter_benchmark(exporter)
+
+def run_benchmark(function, setup, repeat):
+    "Return the list of times, and the number of items."
+    times = []
+    for i in range(repeat + 1):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        items = function(arg)
+        elapsed = time.perf_counter() - start
+        if i > 0: # warm-up
+            times.append(elapsed)
+    return(times, items)
+
+def git_commit():
+    try:
+        return(subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=basedir,
+                                       stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return(None)
+
+def sha256_file(path):
+    with open(path, 'rb') as f:
+        return(hashlib.sha256(f.read()).hexdigest())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the joyodb microbenchmarks.')
+    parser.add_argument('--fixture',
+                        help='Joyo text to use (default: build one from output/*.tsv)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='save the results as JSON in this file')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (default: all)')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='joyodb-bench-')
+    scratchdir = tmpdir + '/output'
+    os.mkdir(scratchdir)
+    try:
+        if args.fixture:
+            fixture = os.path.abspath(args.fixture)
+        else:
+            fixture = tmpdir + '/joyo_full.txt'
+
+        # The parser reads the path of the Joyo text from the environment, when
+        # joyodb is first imported.
+        os.environ['JOYOHYO_TXT'] = fixture
+        if not args.fixture:
+            import fixture as fixture_module
+            fixture_module.build_fixture(fixture)
+
+        import joyodb
+        import joyodb.binary
+        import joyodb.charclass
+        import joyodb.convert
+        import joyodb.coverage
+        import joyodb.furigana
+        import joyodb.kana
+        import joyodb.kanaindex
+        import joyodb.okurigana
+        import joyodb.snapshot
+
+        prepare(fixture)
+        fixture_sha256 = sha256_file(fixture)
+
+        results = {}
+        for name, function, setup in BENCHMARKS:
+            if args.names and name not in args.names:
+                continue
+            times, items = run_benchmark(function, setup, args.repeat)
+            results[name] = {
+                'items': items,
+                'times': times,
+                'min': min(times),
+                'median': statistics.median(times),
+            }
+            print("%-24s %10.3f ms  (min %.3f ms, %d items)"
+                  % (name, results[name]['median'] * 1000, results[name]['min'] * 1000,
+                     items))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if args.output:
+        report = {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'fixture': os.path.basename(fixture),
+            'fixture_sha256': fixture_sha256,
+            'repeat': args.repeat,
+            'results': results,
+        }
+        with open(args.output, 'wt') as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
@@ -0,0 +1,218 @@
+# This file sets up file paths, and reserves space on memory to store things.
+#
+# Importing joyodb should be cheap, and have no side effects: we don't touch
+# the filesystem here.  Directories are created by whatever writes to them, the
+# data files are read the first time they're needed (see LazyTable), and
+# modules may import their heavier dependencies with lazy_import().
+from collections.abc import Mapping
+import importlib.util
+import os
+import sys
+
+from ostruct import OpenStruct
+# Here we store the data that we read from the Joyo table.
+loaded_data = OpenStruct()
+
+# "The parent dir of the directory of the full path of this file."
+basedir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Here we store data downloaded from the Internet, including the Joyo table
+# PDF.
+cachedir = basedir + '/cache'
+
+# Auxiliary data which comes bundled with this program.
+datadir = basedir + '/data'
+
+# Here we save the data converted to other formats.
+outputdir = basedir + '/output'
+
+# The text extracted from the Joyo table PDF (see the Makefile).  Can be
+# overridden with the JOYOHYO_TXT environment variable.
+JOYOHYO_TXT = os.environ.get('JOYOHYO_TXT',
+                             cachedir + '/joyokanjihyo_20101130.txt')
+
+def lazy_import(name):
+    """Import a module, deferring its execution until an attribute is used.
+
+    Use it like: re = lazy_import('regex').  If the module was already
+    imported, it's returned as is.
+    """
+
+    if name in sys.modules:
+        return(sys.modules[name])
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise(ImportError("No module named %r" % name, name=name))
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return(module)
+
+class LazyTable(Mapping):
+    """A read-only dictionary, filled by calling loader() on first access.
+
+    >>> t = LazyTable(lambda: {'a': 1})
+    >>> t.data is None
+    True
+    >>> t['a'], 'b' in t, len(t)
+    (1, False, 1)
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.data = None
+
+    def load(self):
+        "Return the underlying dictionary, loading it if needed."
+        if self.data is None:
+            self.data = self.loader()
+        return(self.data)
+
+    def __getitem__(self, key):
+        return(self.load()[key])
+
+    def __contains__(self, key):
+        return(key in self.load())
+
+    def __iter__(self):
+        return(iter(self.load()))
+
+    def __len__(self):
+        return(len(self.load()))
+
+def load(rebuild=False):
+    """Load the Joyo data into loaded_data, and return it.
+
+    The parsed data is cached as a snapshot in cachedir, so only the first call
+    (or the first one after the Joyo text, the data files or this program
+    change) needs to actually parse the table.  See joyodb.snapshot.
+    """
+
+    import joyodb.snapshot
+    return(joyodb.snapshot.load(rebuild=rebuild))
+
+# Read the alternative (通用字体) characters from datafile.
+#
+# These three kanji have multiple Unicode codepoints, with minor graphical
+# differences:
+#
+# - U+5861 塡   U+586B 填
+# - U+525D 剝   U+5265 剥
+# - U+9830 頰   U+982C 頬
+#
+# The PDF document uses the ones on the left, which are the default MEXT
+# recommendation.  However, the ones on the right were the only ones available
+# in JIS X 0208, and became widespread. Today most people use them, and they're
+# considered to be alternatives in "popular use" (通用字体).
+#
+# Because I expect most users will want the popular variants, this program
+# converts the data into them.
+#
+# - U+20B9F 𠮟   U+53F1 叱
+#
+# These look pretty much the same, but MEXT says they're technically different
+# characters (cf. 付 3.4 in the PDF).  According to the Joyo document, U+20B9F
+# is the actual Joyo kanji (SHITSU/shikaru "to scold"), and U+53F1 is a
+# separate one (apparently pronounced KA; cf.
+# https://hydrocul.github.io/wiki/blog/2014/1201-shikaru.html ).  The PDF table
+# uses U+20B9F.
+#
+# However, U+20B9F is a newer codepoint, outside the Basic Multilingual Plane;
+# and in fact Unicode's Unihan list SHITSU/shikaru for U+53F1. A search on
+# Google Books in July/2016 found ~56000 hits for 叱る encoded as U+53F1, and
+# only 1 hit for 𠮟る with U+20B9F.  And the PDF itself says that, given
+# current usage, U+53F1 is to be accepted as a variant character (異体字) for
+# SHITSU/shikaru.
+#
+# So in this, too, we'll favor the popular form.  The original MEXT codepoints
+# are available in Kanji.default_variant.
+def read_popular_alternatives():
+    popular_alternatives = {}
+    with open(datadir + '/popular_alternatives.tsv', 'rt') as f:
+        for line in f:
+            default, popular = line.strip().split("\t")
+            popular_alternatives[default] = popular
+    return(popular_alternatives)
+
+popular_alternatives = LazyTable(read_popular_alternatives)
+
+# All alternatives are single codepoints (including the astral U+20B9F), so
+# one translation table converts them all in a single pass over the string.
+popular_table = LazyTable(lambda: str.maketrans(popular_alternatives.load()))
+
+def popularize(s):
+    r"""Convert MEXT-style kanjis in string to popular alternatives.
+
+    >>> popularize('1: 塡 2: 剝 3: 頰 4: 𠮟')
+    '1: 填 2: 剥 3: 頬 4: 叱'
+
+    >>> s = "Innocuous string  漢字 \n"
+    >>> popularize(s) == s
+    True
+
+    """
+    return(s.translate(popular_table.load()))
+
+def popularize_stream(source, blocksize=1024*1024):
+    r"""Like popularize(), for a text file object or an iterable of strings.
+
+    Yields the converted text in chunks, so that arbitrarily large inputs can
+    be converted in constant memory; e.g.:
+
+        outfile.writelines(popularize_stream(infile))
+
+    Since each character is converted independently, chunk boundaries don't
+    matter.
+
+    >>> ''.join(popularize_stream(['𠮟る', '。', '頰']))
+    '叱る。頬'
+
+    >>> import io
+    >>> f = io.StringIO('塡剝' * 3)
+    >>> list(popularize_stream(f, blocksize=4))
+    ['填剥填剥', '填剥']
+    """
+
+    if hasattr(source, 'read'):
+        chunks = iter(lambda: source.read(blocksize), '')
+    else:
+        chunks = source
+    table = popular_table.load()
+    for chunk in chunks:
+        yield chunk.translate(table)
+
+
+# Read the variants from datafile.
+#
+# Five Jōyō kanji have alternate "accepted character forms" 許容字体, marked
+# with brackets [] in the PDF.  These can be represented by Unicode variation
+# sequences[1].  Sadly, at the moment of this writing (2016), very few software
+# support such sequences.  At any rate, I've hand-picked Unicode variations
+# that look like the reference images, because this is "forward-compatible" –
+# these sequences can be useful in the future, when Unicode support gets more
+# widespread.
+#
+# [1] https://en.wikipedia.org/wiki/Variant_form_(Unicode)
+def read_variants():
+    variants = {}
+    with open(datadir + '/variants.tsv', 'rt') as f:
+        # Throw away the header.
+        f.readline()
+        for line in f:
+            # - Base: the basic Unicode codepoint for that character.
+            # - Default: A variation sequence that's graphically equivalent to
+            #            the main reference image in the Joyo table.
+            # - Accepted: A variation sequence that's graphically equivalent to
+            #            the 'accepted variant' in the Joyo table.
+            #
+            # Contrary to what one would expect, often the 'accepted' variant
+            # is actually the one in current use, and the one that shows up for
+            # the base Unicode codepoint under most Japanese fonts.
+            base, default, accepted = line.rstrip("\n").split("\t")
+            variants[base] = (default, accepted)
+    return(variants)
+
+variants = LazyTable(read_variants)
@@ -0,0 +1,533 @@
+# A compact binary format for the Joyo data, read through mmap.
+#
+# Even from a snapshot, loading the data means unpickling some 50,000 Python
+# objects.  The binary file (output/joyodb.bin, written by
+# convert.convert_to_binary()) is laid out so that it can be used where it
+# lies: we mmap it, and only decode the parts that are actually looked at.
+# Opening it takes a few system calls, and processes that open the same file
+# share its pages through the OS page cache.
+#
+# All integers are unsigned 32-bit little-endian.  The file is:
+#
+#   - A header: MAGIC, FORMAT_VERSION, and then the offset and number of
+#     items of each section, in SECTIONS order.
+#   - kanji, readings, examples: tables of fixed-width records, in table
+#     order; the fields of each are listed in KANJI_FIELDS etc.
+#   - lists: a flat array of string numbers.  Lists of strings (notes, old
+#     forms...) are stored here, and records point to them as (start, count).
+#     Lists of pairs (compounds, placenames, the appendix) take two items per
+#     pair: the word, then its reading.
+#   - string_offsets: the (n + 1) offsets of the n strings in the pool; string
+#     i is pool[string_offsets[i]:string_offsets[i+1]].
+#   - pool: all distinct strings, in UTF-8, one after the other.
+#   - lookup: (string, kanji) pairs, sorted by the UTF-8 of the string, for
+#     finding kanji by character, standard character, old form or variation
+#     sequence (see lookup.Index.get()).
+#
+# Strings are referred to by number; NONE means None.  Records refer to each
+# other by index: a reading has the index of its kanji, and a kanji the index
+# of its first reading and how many readings it has (readings of the same
+# kanji are consecutive, and so are examples of the same reading).
+#
+# The Database class reads a file, and gives out view objects with the same
+# attributes as the model classes (Kanji, Reading, Example); so, for instance,
+# convert.kanji_to_dict() works on them as is.
+
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from joyodb import *
+
+MAGIC = b'JOYODB\x00\x01'
+FORMAT_VERSION = 1
+
+NONE = 0xffffffff
+
+SECTIONS = ('kanji', 'readings', 'examples', 'lists',
+            'string_offsets', 'pool', 'lookup', 'appendix')
+
+HEADER = struct.Struct('<8sI' + 'II' * len(SECTIONS))
+
+# Fields of each record; "(list)" fields take two numbers, start and count.
+KANJI_FIELDS = ('kanji', 'standard_character', 'standard_variant',
+                'accepted_variant', 'joyo_documentation',
+                'readings (list)', 'old_kanji (list)', 'notes (list)',
+                'compound_readings (list)', 'placename_readings (list)')
+READING_FIELDS = ('kanji', 'reading', 'romaji', 'kind', 'uncommon',
+                  'variation_of', 'examples (list)', 'notes (list)',
+                  'alternate_orthographies (list)')
+EXAMPLE_FIELDS = ('reading', 'example', 'pos', 'literary')
+
+def field_positions(fields):
+    """Map field names to their position in a record; return also its width.
+
+    >>> field_positions(('a', 'b (list)', 'c'))
+    ({'a': 0, 'b': 1, 'c': 3}, 4)
+    """
+    positions = {}
+    width = 0
+    for field in fields:
+        if field.endswith(' (list)'):
+            positions[field[:-7]] = width
+            width += 2
+        else:
+            positions[field] = width
+            width += 1
+    return(positions, width)
+
+KANJI, KANJI_WIDTH = field_positions(KANJI_FIELDS)
+READING, READING_WIDTH = field_positions(READING_FIELDS)
+EXAMPLE, EXAMPLE_WIDTH = field_positions(EXAMPLE_FIELDS)
+
+class Writer:
+    "Lays out the data for write()."
+
+    def __init__(self):
+        self.strings = {} # string -> number, in order
+        self.lists = []
+
+    def string(self, s):
+        if s is None:
+            return(NONE)
+        number = self.strings.get(s)
+        if number is None:
+            number = self.strings[s] = len(self.strings)
+        return(number)
+
+    def string_list(self, strings):
+        start = len(self.lists)
+        self.lists += [self.string(s) for s in strings]
+        return([start, len(strings)])
+
+    def pair_list(self, mapping):
+        start = len(self.lists)
+        for word, reading in mapping.items():
+            self.lists += [self.string(word), self.string(reading)]
+        return([start, len(mapping)])
+
+def pack(numbers):
+    return(struct.pack('<%dI' % len(numbers), *numbers))
+
+def write(path, kanjis, compound_readings):
+    "Write kanjis and compound_readings (the appendix) to a binary file."
+
+    from joyodb.lookup import Index
+
+    w = Writer()
+    kanji_records = []
+    reading_records = []
+    example_records = []
+
+    for kanji_number, k in enumerate(kanjis):
+        if type(k.old_kanji) is list:
+            old_kanji = k.old_kanji
+        elif k.old_kanji:
+            old_kanji = [k.old_kanji]
+        else:
+            old_kanji = []
+
+        kanji_records += ([w.string(k.kanji),
+                           w.string(k.standard_character),
+                           w.string(k.standard_variant),
+                           w.string(k.accepted_variant),
+                           w.string(k.joyo_documentation),
+                           len(reading_records) // READING_WIDTH, len(k.readings)]
+                          + w.string_list(old_kanji)
+                          + w.string_list(k.notes)
+                          + w.pair_list(k.compound_readings)
+                          + w.pair_list(k.placename_readings))
+
+        for r in k.readings:
+            reading_number = len(reading_records) // READING_WIDTH
+            reading_records += ([kanji_number,
+                                 w.string(r.reading),
+                                 w.string(r.romaji()),
+                                 w.string(r.kind),
+                                 int(r.uncommon),
+                                 w.string(r.variation_of),
+                                 len(example_records) // EXAMPLE_WIDTH, len(r.examples)]
+                                + w.string_list(r.notes)
+                                + w.string_list(r.alternate_orthographies))
+            for e in r.examples:
+                example_records += [reading_number,
+                                    w.string(e.example),
+                                    w.string(e.pos),
+                                    int(e.literary)]
+
+    # (as in convert_to_json(), sorted)
+    appendix = []
+    for gloss in sorted(compound_readings.keys()):
+        for orthography in sorted(compound_readings[gloss]):
+            appendix += [w.string(orthography), w.string(gloss)]
+
+    number = {id(k): n for n, k in enumerate(kanjis)}
+    lookup = []
+    for string, k in sorted(Index(kanjis).by_any.items(),
+                            key=lambda item: item[0].encode('utf-8')):
+        lookup += [w.string(string), number[id(k)]]
+
+    pool = []
+    string_offsets = [0]
+    for string in w.strings:
+        encoded = string.encode('utf-8')
+        pool.append(encoded)
+        string_offsets.append(string_offsets[-1] + len(encoded))
+
+    sections = [
+        (pack(kanji_records), len(kanjis)),
+        (pack(reading_records), len(reading_records) // READING_WIDTH),
+        (pack(example_records), len(example_records) // EXAMPLE_WIDTH),
+        (pack(w.lists), len(w.lists)),
+        (pack(string_offsets), len(w.strings)),
+        (b''.join(pool), string_offsets[-1]),
+        (pack(lookup), len(lookup) // 2),
+        (pack(appendix), len(appendix) // 2),
+    ]
+
+    # Sections start at multiples of 4 bytes.
+    header = [MAGIC, FORMAT_VERSION]
+    offset = HEADER.size
+    for data, count in sections:
+        header += [offset, count]
+        offset += len(data) + (-len(data) % 4)
+
+    # Written to a temporary file, and then moved in place: processes that
+    # have the old file mapped keep reading it, instead of crashing (SIGBUS)
+    # when it's truncated under them.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                    prefix='.joyodb-', suffix='.bin')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(*header))
+            for data, count in sections:
+                f.write(data)
+                f.write(b'\0' * (-len(data) % 4))
+
+        # mkstemp() creates private files; this one is for everybody to read.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+class Database:
+    """A binary file written by write(), mapped in memory.
+
+    kanjis is a sequence of KanjiView objects; compound_readings is the
+    appendix, as in loaded_data.
+
+    >>> import os, tempfile
+    >>> from joyodb.model import Kanji
+    >>> koku = Kanji('国')
+    >>> koku.add_old_kanji('國')
+    >>> koku.add_reading('コク')
+    >>> koku.add_examples('国語，〔副〕国々')
+    >>> koku.add_reading('くに')
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     write(directory + '/joyodb.bin', [koku], {'あす': ['明日']})
+    ...     db = Database(directory + '/joyodb.bin')
+    >>> len(db.kanjis), db.kanjis[0].kanji, db.kanjis[0].old_kanji
+    (1, '国', '國')
+    >>> r = db.get('國').readings[0]
+    >>> r.reading, r.romaji(), r.kind, [e.example for e in r.examples]
+    ('コク', 'KOKU', 'On', ['国語', '国々'])
+    >>> r.examples[1].pos, r.examples[1].reading.kanji.kanji
+    ('Adverb', '国')
+    >>> db.compound_readings
+    {'あす': ['明日']}
+    >>> db.close()
+    """
+
+    def __init__(self, path=outputdir + '/joyodb.bin'):
+        if sys.byteorder != 'little':
+            raise(RuntimeError("joyodb.binary can only read files on little-endian machines"))
+
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.mmap)
+
+        header = HEADER.unpack_from(view)
+        if header[0] != MAGIC:
+            view.release()
+            self.mmap.close()
+            raise(ValueError("%s: not a joyodb binary file" % path))
+        if header[1] != FORMAT_VERSION:
+            view.release()
+            self.mmap.close()
+            raise(ValueError("%s: joyodb binary file of version %d (we read version %d)"
+                             % (path, header[1], FORMAT_VERSION)))
+        self.sections = {}
+        for i, name in enumerate(SECTIONS):
+            self.sections[name] = (header[2 + i*2], header[3 + i*2])
+
+        # Arrays of numbers, straight out of the mapped file.
+        self.kanji_records = self.numbers('kanji', KANJI_WIDTH)
+        self.reading_records = self.numbers('readings', READING_WIDTH)
+        self.example_records = self.numbers('examples', EXAMPLE_WIDTH)
+        self.lists = self.numbers('lists', 1)
+        self.lookup_pairs = self.numbers('lookup', 2)
+        self.appendix_pairs = self.numbers('appendix', 2)
+        offset, count = self.sections['string_offsets']
+        self.string_offsets = view[offset:offset + (count + 1) * 4].cast('I')
+        offset, size = self.sections['pool']
+        self.pool = view[offset:offset + size]
+
+        self.kanjis = KanjiSequence(self)
+        self.appendix = None
+
+    def numbers(self, section, width):
+        offset, count = self.sections[section]
+        return(memoryview(self.mmap)[offset:offset + count * width * 4].cast('I'))
+
+    def close(self):
+        # (the memoryviews must go before the mmap)
+        for name in ('kanji_records', 'reading_records', 'example_records',
+                     'lists', 'lookup_pairs', 'appendix_pairs',
+                     'string_offsets', 'pool'):
+            getattr(self, name).release()
+        self.mmap.close()
+
+    def string(self, number):
+        if number == NONE:
+            return(None)
+        offsets = self.string_offsets
+        return(str(self.pool[offsets[number]:offsets[number + 1]], 'utf-8'))
+
+    def string_list(self, start, count):
+        return([self.string(n) for n in self.lists[start:start + count]])
+
+    def pair_dict(self, start, count):
+        numbers = self.lists[start:start + count * 2]
+        return({self.string(numbers[i]): self.string(numbers[i + 1])
+                for i in range(0, len(numbers), 2)})
+
+    @property
+    def compound_readings(self):
+        "The appendix, as in loaded_data: reading -> list of orthographies."
+        if self.appendix is None:
+            self.appendix = {}
+            numbers = self.appendix_pairs
+            for i in range(0, len(numbers), 2):
+                self.appendix.setdefault(self.string(numbers[i + 1]), []).append(
+                    self.string(numbers[i]))
+        return(self.appendix)
+
+    def get(self, string):
+        """The KanjiView for string, like lookup.get(), or None.
+
+        A binary search over the file; nothing is loaded in advance.
+        """
+
+        key = string.encode('utf-8')
+        pairs = self.lookup_pairs
+        offsets = self.string_offsets
+        pool = self.pool
+        low = 0
+        high = len(pairs) // 2
+        while low < high:
+            middle = (low + high) // 2
+            number = pairs[middle * 2]
+            found = pool[offsets[number]:offsets[number + 1]].tobytes()
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return(KanjiView(self, pairs[middle * 2 + 1]))
+        return(None)
+
+class KanjiSequence:
+    "Database.kanjis: a list-like sequence of KanjiView."
+
+    def __init__(self, db):
+        self.db = db
+        self.count = db.sections['kanji'][1]
+
+    def __len__(self):
+        return(self.count)
+
+    def __getitem__(self, i):
+        if type(i) is slice:
+            return([self[j] for j in range(*i.indices(self.count))])
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise(IndexError("kanji index out of range"))
+        return(KanjiView(self.db, i))
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield(KanjiView(self.db, i))
+
+# The views hold just the database and a record number; every attribute is
+# read from the file when asked for.
+
+class KanjiView:
+    __slots__ = ('db', 'index')
+
+    def __init__(self, db, index):
+        self.db = db
+        self.index = index
+
+    def __eq__(self, other):
+        return(type(other) is KanjiView and other.db is self.db and other.index == self.index)
+
+    def __hash__(self):
+        return(hash((id(self.db), self.index)))
+
+    def field(self, name):
+        return(self.db.kanji_records[self.index * KANJI_WIDTH + KANJI[name]])
+
+    def list_field(self, name):
+        start = self.index * KANJI_WIDTH + KANJI[name]
+        return(self.db.kanji_records[start:start + 2])
+
+    def __str__(self):
+        return(self.kanji)
+
+    def __repr__(self):
+        return('<KanjiView %s>' % self.kanji)
+
+    @property
+    def kanji(self):
+        return(self.db.string(self.field('kanji')))
+
+    @property
+    def standard_character(self):
+        return(self.db.string(self.field('standard_character')))
+
+    @property
+    def standard_variant(self):
+        return(self.db.string(self.field('standard_variant')))
+
+    @property
+    def accepted_variant(self):
+        return(self.db.string(self.field('accepted_variant')))
+
+    @property
+    def joyo_documentation(self):
+        return(self.db.string(self.field('joyo_documentation')))
+
+    @property
+    def old_kanji(self):
+        "As in the Kanji class: None, a string, or a list of strings."
+        old = self.db.string_list(*self.list_field('old_kanji'))
+        if not old:
+            return(None)
+        elif len(old) == 1:
+            return(old[0])
+        return(old)
+
+    @property
+    def notes(self):
+        return(self.db.string_list(*self.list_field('notes')))
+
+    @property
+    def compound_readings(self):
+        return(self.db.pair_dict(*self.list_field('compound_readings')))
+
+    @property
+    def placename_readings(self):
+        return(self.db.pair_dict(*self.list_field('placename_readings')))
+
+    @property
+    def readings(self):
+        start, count = self.list_field('readings')
+        return([ReadingView(self.db, i) for i in range(start, start + count)])
+
+class ReadingView:
+    __slots__ = ('db', 'index')
+
+    def __init__(self, db, index):
+        self.db = db
+        self.index = index
+
+    def field(self, name):
+        return(self.db.reading_records[self.index * READING_WIDTH + READING[name]])
+
+    def list_field(self, name):
+        start = self.index * READING_WIDTH + READING[name]
+        return(self.db.reading_records[start:start + 2])
+
+    def __repr__(self):
+        return('<ReadingView %s [%s]>' % (self.kanji.kanji, self.reading))
+
+    @property
+    def kanji(self):
+        return(KanjiView(self.db, self.field('kanji')))
+
+    @property
+    def reading(self):
+        return(self.db.string(self.field('reading')))
+
+    def romaji(self):
+        return(self.db.string(self.field('romaji')))
+
+    @property
+    def kind(self):
+        return(self.db.string(self.field('kind')))
+
+    @property
+    def uncommon(self):
+        return(bool(self.field('uncommon')))
+
+    @property
+    def variation_of(self):
+        return(self.db.string(self.field('variation_of')))
+
+    @property
+    def notes(self):
+        return(self.db.string_list(*self.list_field('notes')))
+
+    @property
+    def alternate_orthographies(self):
+        return(self.db.string_list(*self.list_field('alternate_orthographies')))
+
+    @property
+    def examples(self):
+        start, count = self.list_field('examples')
+        return([ExampleView(self.db, i) for i in range(start, start + count)])
+
+class ExampleView:
+    __slots__ = ('db', 'index')
+
+    def __init__(self, db, index):
+        self.db = db
+        self.index = index
+
+    def field(self, name):
+        return(self.db.example_records[self.index * EXAMPLE_WIDTH + EXAMPLE[name]])
+
+    def __repr__(self):
+        return('<ExampleView %s>' % self.example)
+
+    @property
+    def reading(self):
+        return(ReadingView(self.db, self.field('reading')))
+
+    @property
+    def example(self):
+        return(self.db.string(self.field('example')))
+
+    @property
+    def pos(self):
+        return(self.db.string(self.field('pos')))
+
+    @property
+    def literary(self):
+        return(bool(self.field('literary')))
+
+current_database = None
+def database(path=outputdir + '/joyodb.bin'):
+    "Return a Database for path, opening it on first use."
+    global current_database
+    if (current_database is None or current_database.mmap.closed
+        or current_database.path != path):
+        current_database = Database(path)
+    return(current_database)
@@ -0,0 +1,321 @@
+# Character classes: is this character a Joyo kanji, an old form, or a popular
+# alternative?
+#
+# Tokenizers, search analyzers and input validators need only this much of the
+# table, and shouldn't have to parse it, or load all of it.  So
+# convert.convert_to_charclass() writes the classes out in three ready-made
+# forms:
+#
+#   - joyo_charclass.bin: a bitmap per class, over the CJK blocks
+#     (BITMAP_START to BITMAP_END), plus a list of the few characters outside
+#     them; see write_bitmap() for the layout.
+#   - joyo_charclass.json: for each class, its codepoints as sorted, merged
+#     ranges, and as a character class for regular expressions (regex, re, and
+#     most other engines).
+#
+# The classes are:
+#
+#   - joyo: the kanji of the table (Kanji.kanji), and their standard
+#     characters where those differ (𠮟 for 叱).
+#   - old: the old forms (旧字体) listed in the table.
+#   - popular: the popular alternatives (通用字体) of data/popular_alternatives.tsv,
+#     which are also in joyo.
+#
+# Only single codepoints go in; variation sequences can't be told apart by
+# codepoint.
+#
+# CharClass reads the bitmap file (or builds the same thing from loaded data),
+# and classifies whole strings at once: the bitmaps become a byte table indexed
+# by codepoint, which str.translate() applies to the string in C, and the
+# result is checked with bytes methods.
+
+import json
+import struct
+
+from joyodb import *
+
+# Class flags, as in CharClass.flags().
+JOYO = 1
+OLD = 2
+POPULAR = 4
+
+CLASSES = (('joyo', JOYO), ('old', OLD), ('popular', POPULAR))
+
+# The bitmap covers CJK Unified Ideographs Extension A, CJK Unified
+# Ideographs, and CJK Compatibility Ideographs (and whatever is in between).
+BITMAP_START = 0x3400
+BITMAP_END = 0xfb00
+
+BITMAP_MAGIC = b'JOYOCCL\x01'
+BITMAP_HEADER = struct.Struct('<8sIIII')
+
+def codepoint_classes(kanjis):
+    """Return {class name: set of codepoints}, from a list of Kanji.
+
+    >>> from joyodb.model import Kanji
+    >>> koku = Kanji('国')
+    >>> koku.add_old_kanji('國')
+    >>> sorted(chr(c) for c in codepoint_classes([koku, Kanji('𠮟')])['joyo'])
+    ['叱', '国', '𠮟']
+    """
+
+    classes = {'joyo': set(), 'old': set(), 'popular': set()}
+    for k in kanjis:
+        for ch in (k.kanji, k.standard_character):
+            if ch and len(ch) == 1:
+                classes['joyo'].add(ord(ch))
+        if type(k.old_kanji) is list:
+            old_forms = k.old_kanji
+        elif k.old_kanji:
+            old_forms = [k.old_kanji]
+        else:
+            old_forms = []
+        for old in old_forms:
+            if len(old) == 1:
+                classes['old'].add(ord(old))
+    for popular in popular_alternatives.values():
+        classes['popular'].add(ord(popular))
+    return(classes)
+
+def merge_ranges(codepoints):
+    """Sorted, merged, inclusive (first, last) ranges covering codepoints.
+
+    >>> merge_ranges([5, 1, 2, 3, 7, 8])
+    [(1, 3), (5, 5), (7, 8)]
+    """
+
+    ranges = []
+    for c in sorted(codepoints):
+        if ranges and ranges[-1][1] == c - 1:
+            ranges[-1] = (ranges[-1][0], c)
+        else:
+            ranges.append((c, c))
+    return(ranges)
+
+def escape_codepoint(c):
+    if c > 0xffff:
+        return('\\U%08x' % c)
+    return('\\u%04x' % c)
+
+def regex_class(ranges):
+    """A regular expression character class matching ranges.
+
+    >>> regex_class([(0x4e00, 0x4e03), (0x4e08, 0x4e09), (0x20b9f, 0x20b9f)])
+    '[\\\\u4e00-\\\\u4e03\\\\u4e08\\\\u4e09\\\\U00020b9f]'
+    """
+
+    parts = []
+    for first, last in ranges:
+        if first == last:
+            parts.append(escape_codepoint(first))
+        elif first + 1 == last:
+            parts.append(escape_codepoint(first) + escape_codepoint(last))
+        else:
+            parts.append(escape_codepoint(first) + '-' + escape_codepoint(last))
+    return('[' + ''.join(parts) + ']')
+
+def write_json(path, classes):
+    "Write the ranges and regex class of each class, as JSON."
+
+    document = {}
+    for name, flag in CLASSES:
+        ranges = merge_ranges(classes[name])
+        document[name] = {
+            'count': len(classes[name]),
+            'ranges': [list(r) for r in ranges],
+            'regex': regex_class(ranges),
+        }
+    with open(path, 'wt') as f:
+        json.dump(document, f)
+        f.write('\n')
+
+def make_bitmaps(classes):
+    """The bitmap of each class, in CLASSES order, as bytes; and a dictionary
+    from the codepoints outside the bitmaps to their flags."""
+
+    size = (BITMAP_END - BITMAP_START + 7) // 8
+    bitmaps = []
+    outside = {}
+    for name, flag in CLASSES:
+        bitmap = bytearray(size)
+        for c in classes[name]:
+            if BITMAP_START <= c < BITMAP_END:
+                i = c - BITMAP_START
+                bitmap[i >> 3] |= 1 << (i & 7)
+            else:
+                outside[c] = outside.get(c, 0) | flag
+        bitmaps.append(bytes(bitmap))
+    return(bitmaps, outside)
+
+def write_bitmap(path, classes):
+    """Write the classes as bitmaps.
+
+    The file is (all integers being unsigned 32-bit little-endian):
+
+      - A header: BITMAP_MAGIC, BITMAP_START, BITMAP_END, the number of
+        classes, and the number of codepoints outside the bitmap.
+      - For each class, in CLASSES order: a bitmap of (BITMAP_END -
+        BITMAP_START) bits, least significant bit first; bit i of byte j is
+        codepoint BITMAP_START + 8*j + i.
+      - For each codepoint outside the bitmap, in order: the codepoint, and its
+        flags (JOYO, OLD, POPULAR).
+    """
+
+    bitmaps, outside = make_bitmaps(classes)
+
+    with open(path, 'wb') as f:
+        f.write(BITMAP_HEADER.pack(BITMAP_MAGIC, BITMAP_START, BITMAP_END,
+                                   len(CLASSES), len(outside)))
+        for bitmap in bitmaps:
+            f.write(bitmap)
+        for c in sorted(outside):
+            f.write(struct.pack('<II', c, outside[c]))
+
+def read_bitmap(path):
+    "Read a file from write_bitmap(); return (start, end, bitmaps, outside)."
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, start, end, count, outside_count = BITMAP_HEADER.unpack_from(data)
+    if magic != BITMAP_MAGIC:
+        raise(ValueError("%s: not a joyodb character class file" % path))
+    size = (end - start + 7) // 8
+    offset = BITMAP_HEADER.size
+    bitmaps = []
+    for i in range(count):
+        bitmaps.append(data[offset:offset + size])
+        offset += size
+    outside = {}
+    for i in range(outside_count):
+        c, flags = struct.unpack_from('<II', data, offset)
+        outside[c] = flags
+        offset += 8
+    return((start, end, bitmaps, outside))
+
+# Size of the Basic Multilingual Plane; CharClass has a table for all of it.
+BMP_SIZE = 0x10000
+
+class AstralFlags(dict):
+    "Codepoint -> flags, defaulting to 0; for str.translate()."
+    def __missing__(self, c):
+        return(0)
+
+class CharClass:
+    """Classifies characters, or whole strings, by their flags.
+
+    >>> from joyodb.model import Kanji
+    >>> koku = Kanji('国')
+    >>> koku.add_old_kanji('國')
+    >>> cc = CharClass.from_kanjis([koku, Kanji('𠮟')])
+    >>> cc.flags('国と國と叱𠮟')
+    b'\\x01\\x00\\x02\\x00\\x05\\x01'
+    >>> cc.is_joyo('国'), cc.is_old('国'), cc.is_popular('叱')
+    (True, False, True)
+    >>> cc.all_in('国叱𠮟'), cc.all_in('国と'), cc.all_in('国と國', JOYO | OLD)
+    (True, False, False)
+    >>> cc.first_outside('国叱國')
+    2
+    >>> cc.count('国と國と叱𠮟')
+    {'joyo': 3, 'old': 1, 'popular': 1}
+    """
+
+    def __init__(self, start, end, bitmaps, outside):
+        """Build the tables from bitmaps, as read_bitmap() returns them.
+
+        outside maps codepoints beyond the bitmaps to their flags.
+        """
+
+        # (the list of Kanji, if built by from_kanjis())
+        self.kanjis = None
+
+        # codepoint -> flags, for the whole BMP (a byte each; 64K).
+        table = bytearray(BMP_SIZE)
+        for (name, flag), bitmap in zip(CLASSES, bitmaps):
+            for j, byte in enumerate(bitmap):
+                if byte:
+                    for i in range(8):
+                        if byte & (1 << i):
+                            table[start + 8*j + i] |= flag
+        for c, flags in outside.items():
+            if c < BMP_SIZE:
+                table[c] = flags
+        self.table = bytes(table)
+
+        # For the rest: flags (as codepoints) map to themselves, and everything
+        # else to 0.
+        self.astral = AstralFlags([(c, flags) for c, flags in outside.items()
+                                   if c >= BMP_SIZE])
+        for flags in range(8):
+            self.astral[flags] = flags
+
+        # For all_in() and first_outside(): flag bytes that pass each mask.
+        self.passing = {}
+        for mask in range(1, 8):
+            self.passing[mask] = bytes([flags for flags in range(8) if flags & mask])
+        # (maps the passing flags to 0, and everything else to 1)
+        self.failing_table = {}
+        for mask in range(1, 8):
+            self.failing_table[mask] = bytes([0 if flags & mask else 1 for flags in range(256)])
+
+    @classmethod
+    def from_kanjis(cls, kanjis):
+        "Build a CharClass straight from a list of Kanji."
+        instance = cls(BITMAP_START, BITMAP_END,
+                       *make_bitmaps(codepoint_classes(kanjis)))
+        instance.kanjis = kanjis
+        return(instance)
+
+    @classmethod
+    def read(cls, path=outputdir + '/joyo_charclass.bin'):
+        "Load a CharClass from a file written by write_bitmap()."
+        return(cls(*read_bitmap(path)))
+
+    def codepoint_flags(self, c):
+        if c < BMP_SIZE:
+            return(self.table[c])
+        return(self.astral[c])
+
+    def flags(self, string):
+        """The flags of each character of string, as bytes.
+
+        str.translate() looks each character up in the table, in C; only
+        characters outside the BMP (left as they are) need another pass.
+        """
+
+        flags = string.translate(self.table)
+        if not flags.isascii():
+            flags = flags.translate(self.astral)
+        return(flags.encode('ascii'))
+
+    def is_joyo(self, ch):
+        return(bool(self.codepoint_flags(ord(ch)) & JOYO))
+
+    def is_old(self, ch):
+        return(bool(self.codepoint_flags(ord(ch)) & OLD))
+
+    def is_popular(self, ch):
+        return(bool(self.codepoint_flags(ord(ch)) & POPULAR))
+
+    def all_in(self, string, mask=JOYO):
+        "Whether every character of string is in one of the classes in mask."
+        return(not self.flags(string).translate(None, self.passing[mask]))
+
+    def first_outside(self, string, mask=JOYO):
+        "The index of the first character not in the classes in mask, or -1."
+        return(self.flags(string).translate(self.failing_table[mask]).find(1))
+
+    def count(self, string):
+        "How many characters of string are in each class."
+        flags = self.flags(string)
+        counts = {}
+        for name, flag in CLASSES:
+            counts[name] = sum([flags.count(f) for f in range(8) if f & flag])
+        return(counts)
+
+current_charclass = None
+def charclass():
+    "Return the CharClass for loaded_data.kanjis, building it if needed."
+    global current_charclass
+    if current_charclass is None or current_charclass.kanjis is not loaded_data.kanjis:
+        current_charclass = CharClass.from_kanjis(loaded_data.kanjis)
+    return(current_charclass)
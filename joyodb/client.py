@@ -0,0 +1,160 @@
+# A client for the lookup server (joyodb/server.py).
+#
+# This doesn't need the Joyo data, or anything but the standard library; it
+# just talks to a running server.  A Client keeps a pool of open connections,
+# which threads borrow one request (or batch of requests) at a time:
+#
+#   client = Client()
+#   client.kanji('國')[0]['kanji']        # '国'
+#   client.annotate_many(['明日', '日光'])  # many requests, one round trip
+#
+# The *_many() methods send all their requests before reading any response, so
+# that they arrive within the server's batching window.
+
+from contextlib import contextmanager
+import json
+import queue
+import socket
+import threading
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 2136
+
+class Connection:
+    "A connection to the server, and a buffered reader on it."
+
+    def __init__(self, host, port, path, timeout):
+        if path:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
+            self.socket.connect(path)
+        else:
+            self.socket = socket.create_connection((host, port), timeout)
+        self.reader = self.socket.makefile('rb')
+        self.next_id = 0
+
+    def request_many(self, op, queries):
+        "Send the requests, and return the results, in order."
+
+        first_id = self.next_id
+        self.next_id += len(queries)
+        lines = [json.dumps({'id': first_id + i, 'op': op, 'query': query},
+                            ensure_ascii=False) + '\n'
+                 for i, query in enumerate(queries)]
+        self.socket.sendall(''.join(lines).encode('utf-8'))
+
+        # (on error responses, we still read the rest, to keep in step)
+        results = []
+        error = None
+        for i in range(len(queries)):
+            line = self.reader.readline()
+            if not line:
+                raise(ConnectionError("server closed the connection"))
+            try:
+                response = json.loads(line)
+            except ValueError:
+                raise(ConnectionError("invalid response: %r" % line))
+            if type(response) is not dict or response.get('id') != first_id + i:
+                raise(ConnectionError("unexpected response: %r" % line))
+            if 'error' in response:
+                error = error or "%s: %r: %s" % (op, queries[i], response['error'])
+                results.append(None)
+            else:
+                results.append(response['result'])
+        if error:
+            raise(ValueError(error))
+        return(results)
+
+    def close(self):
+        self.reader.close()
+        self.socket.close()
+
+class Client:
+    """A thread-safe client, with a pool of up to pool_size connections.
+
+    Connect to host and port, or to the Unix socket at path.  Errors reported
+    by the server raise ValueError; broken connections, ConnectionError (or
+    OSError).
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None,
+                 pool_size=4, timeout=10):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+
+        self.idle = queue.LifoQueue()
+        # (taken when a connection is opened, released when it's closed)
+        self.slots = threading.BoundedSemaphore(pool_size)
+
+    @contextmanager
+    def connection(self):
+        "Borrow a connection from the pool, opening one if needed."
+
+        self.slots.acquire()
+        try:
+            c = self.idle.get_nowait()
+        except queue.Empty:
+            try:
+                c = Connection(self.host, self.port, self.path, self.timeout)
+            except:
+                self.slots.release()
+                raise
+
+        try:
+            yield(c)
+        except ValueError:
+            # (an error response; the connection is still good)
+            self.idle.put(c)
+            self.slots.release()
+            raise
+        except:
+            c.close()
+            self.slots.release()
+            raise
+        self.idle.put(c)
+        self.slots.release()
+
+    def request_many(self, op, queries):
+        with self.connection() as c:
+            return(c.request_many(op, list(queries)))
+
+    def request(self, op, query):
+        return(self.request_many(op, [query])[0])
+
+    def kanji(self, query):
+        "The Kanji (as dictionaries) for each character of query, or None."
+        return(self.request('kanji', query))
+
+    def kanji_many(self, queries):
+        return(self.request_many('kanji', queries))
+
+    def reading(self, query):
+        "The readings read as query."
+        return(self.request('reading', query))
+
+    def reading_many(self, queries):
+        return(self.request_many('reading', queries))
+
+    def example(self, query):
+        "What the table says about the word query."
+        return(self.request('example', query))
+
+    def example_many(self, queries):
+        return(self.request_many('example', queries))
+
+    def annotate(self, query):
+        "query with furigana, as [text, reading] pairs."
+        return(self.request('annotate', query))
+
+    def annotate_many(self, queries):
+        return(self.request_many('annotate', queries))
+
+    def close(self):
+        "Close the idle connections."
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
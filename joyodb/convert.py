@@ -1,31 +1,53 @@
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+import gzip
+from html import escape
+import io
+import json
+import os
 
 # as of this writing, we need the new regex library to get support for kanji and kana matching:
 # \p{Han}, \p{Hiragana}, \p{Katakana}
 import regex as re
 
 from joyodb import *
+from joyodb import stats
+from joyodb.images import variant_image_path
 from joyodb.model import *
 
 def convert():
     "Main function which converts the Joyo table to multiple formats."
-    parse()
-    convert_to_tsv()
-    convert_to_html()
-    convert_to_sql()
+    with stats.stage('parse'):
+        parse()
+    for exporter in (convert_to_tsv,
+                     convert_to_html,
+                     convert_to_sql,
+                     convert_to_json,
+                     convert_to_ndjson,
+                     convert_to_binary,
+                     convert_to_charclass):
+        with stats.stage(exporter.__name__):
+            exporter()
 
 def parse():
     "Main function to load data from the Joyo table."
-    open_joyo_txt_file()
-    find_main_table()
-    parse_main_table()
-    parse_appendix_table()
+    with stats.stage('parse: read file'):
+        open_joyo_txt_file()
+    with stats.stage('parse: find main table'):
+        find_main_table()
+    with stats.stage('parse: main table'):
+        parse_main_table()
+    with stats.stage('parse: appendix'):
+        parse_appendix_table()
 
 def open_joyo_txt_file():
-    "Open the Joyo .txt file, storing a pointer in loaded_data."
-    import os.path
+    """Read the Joyo .txt file, storing a file object for it in loaded_data.
 
-    loaded_data.joyotxt = open(JOYOHYO_TXT, 'rt')
+    The whole file is read at once (it's less than 1MB), so that parsing
+    proper doesn't wait on disk.
+    """
+
+    with open(JOYOHYO_TXT, 'rt') as f:
+        loaded_data.joyotxt = io.StringIO(f.read())
 
 def find_main_table():
     "Moves up in the Joyo file until the start of the main table (本表)."
@@ -147,7 +169,8 @@ def parse_main_table_row(line):
 
     Entry-point function; most of work is done by others.
     """
-    fields = main_table_row_fields(line)
+    with stats.stage('parse: row classification'):
+        fields = main_table_row_fields(line)
 
     if 'kanji' in fields.keys():
         add_kanji(fields['kanji'])
@@ -161,10 +184,12 @@ def parse_main_table_row(line):
         current.add_reading(fields['reading'])
 
     if 'examples' in fields.keys():
-        current.add_examples(fields['examples'])
+        with stats.stage('parse: examples'):
+            current.add_examples(fields['examples'])
 
     if 'notes' in fields.keys():
-        current.append_to_notes(fields['notes'])
+        with stats.stage('parse: notes'):
+            current.append_to_notes(fields['notes'], note_parser)
 
 
 def main_table_row_fields(line):
@@ -335,41 +360,50 @@ def main_table_row_fields(line):
     if len(fields) == 1:
         if fields[0] in ('瓣', '辯'):
             # Exception: old forms of 弁
+            stats.count('row shape', '1: old kanji')
             dfields['old_kanji'] = fields[0]
 
         elif is_examples(fields[0]):
             assert(fields[0][0] in ('極', '慌', '四'))
+            stats.count('row shape', '1: examples')
             dfields['examples'] = fields[0]
 
         else:
             # Everything else is notes
+            stats.count('row shape', '1: notes')
             dfields['notes'] = fields[0]
 
     elif len(fields) == 2:
         if is_kanji(fields[0]):
             # 2.a: kanji leads
+            stats.count('row shape', '2.a')
             dfields['kanji'] = fields[0]
             dfields['reading'] = fields[1]
         elif is_reading(fields[0]):
             # 2.b or 2.c: reading leads
             dfields['reading'] = fields[0]
             if is_examples(fields[1]):
+                stats.count('row shape', '2.b')
                 dfields['examples'] = fields[1]
             else:
+                stats.count('row shape', '2.c')
                 dfields['notes'] = fields[1]
         else:
             # 2.d
+            stats.count('row shape', '2.d')
             dfields['examples'] = fields[0]
             dfields['notes'] = fields[1]
 
     elif len(fields) == 3:
         if is_kanji(fields[0]):
             # 3.a: kanji leads
+            stats.count('row shape', '3.a')
             dfields['kanji'] = fields[0]
             dfields['reading'] = fields[1]
             dfields['examples'] = fields[2]
         else:
             # 3.b: reading leads
+            stats.count('row shape', '3.b')
             dfields['reading'] = fields[0]
             dfields['examples'] = fields[1]
             dfields['notes'] = fields[2]
@@ -379,6 +413,7 @@ def main_table_row_fields(line):
         old_kanji = extract_old_kanji(fields[1])
         if old_kanji:
             # 4.a: old_kanji line.
+            stats.count('row shape', '4.a')
             dfields['kanji'] = fields[0]
             dfields['old_kanji'] = old_kanji
             dfields['reading'] = fields[2]
@@ -391,12 +426,14 @@ def main_table_row_fields(line):
         elif is_kanji(fields[0]):
             if fields[0] == '弁':
                 # 4.d exception: old kanji without parenthesis.
+                stats.count('row shape', '4.d')
                 dfields['kanji'] = fields[0]
                 dfields['old_kanji'] = fields[1]
                 dfields['reading'] = fields[2]
                 dfields['examples'] = fields[3]
             else:
                 # 4.b.
+                stats.count('row shape', '4.b')
                 dfields['kanji'] = fields[0]
                 dfields['reading'] = fields[1]
                 dfields['examples'] = fields[2]
@@ -404,6 +441,7 @@ def main_table_row_fields(line):
         else:
             # must be 4.c exception.
             assert(fields[0] == '（餠）')
+            stats.count('row shape', '4.c')
             dfields['old_kanji'] = '餠'
             dfields['reading'] = fields[1]
             dfields['examples'] = fields[2]
@@ -413,6 +451,7 @@ def main_table_row_fields(line):
         old_kanji = extract_old_kanji(fields[1])
         if old_kanji:
             # 5.a: kanji with old form, examples, notes
+            stats.count('row shape', '5.a')
             dfields['kanji'] = fields[0]
             dfields['old_kanji'] = old_kanji
             dfields['reading'] = fields[2]
@@ -421,6 +460,7 @@ def main_table_row_fields(line):
 
         elif fields[0] == '亀':
             # 5.c: exception: unencoded old form
+            stats.count('row shape', '5.c')
             dfields['kanji'] = fields[0]
             dfields['old_kanji'] = '龜'
             dfields['reading'] = fields[3]
@@ -430,6 +470,7 @@ def main_table_row_fields(line):
             # must be type 5.b: kanji with variant
             match = re.match("［(.)］$", fields[1])
             assert(match)
+            stats.count('row shape', '5.b')
             dfields['kanji'] = fields[0]
 
             # throw away match[1]; it's bogus in the .txt, and will be
@@ -552,9 +593,20 @@ def is_notes(field):
            and not is_reading(field)
            and not is_examples(field))
 
+# A note in the notes (参考) column can be split among several lines of the
+# table.  While parsing, this tells whether the next note line should be
+# appended to the current note.  It's only meaningful during parsing, so we
+# don't keep it in the Kanji objects; it's passed to append_to_notes().
+class NoteParserState:
+    def __init__(self):
+        self.pending_note = False
+
+note_parser = NoteParserState()
+
 def add_kanji(string):
     "Add a kanji object to loaded_data."
     loaded_data.kanjis.append(Kanji(string))
+    note_parser.pending_note = False
 
 def current_kanji():
     "Access the kanji object currently under construction."
@@ -622,186 +674,236 @@ def parse_appendix_table():
     loaded_data.compound_readings = appendix
     loaded_data.joyotxt.close()
 
-def convert_to_tsv():
-    with open(outputdir + '/kanji_variants.tsv', 'wt') as f:
-        f.write(tsv_line('Kanji',
-                         'Codepoint',
-                         'Old',
-                         'Old codepoint',
-                         'Popular',
-                         'Popular codepoint',
-                         'Standard variation sequence',
-                         'Standard variation sequence codepoint',
-                         'Acceptable variation sequence',
-                         'Acceptable variation sequence codepoint',
-                         'Documentation'))
-
-        for k in loaded_data.kanjis:
-            if k.standard_character:
-                kanji = k.standard_character
-                kanji_cp = codepoint_str(kanji)
-                popular = k.kanji
-                popular_cp = codepoint_str(popular)
-            else:
-                kanji = k.kanji
-                kanji_cp = codepoint_str(kanji)
-                popular = popular_cp = ''
-
-            if k.old_kanji:
-                if type(k.old_kanji) ==  str:
-                    old = {k.old_kanji: codepoint_str(k.old_kanji)}
-                else:
-                    old={}
-                    for o in k.old_kanji:
-                        old[o] = codepoint_str(o)
-            else:
-                old = {}
-
-            if k.standard_variant:
-                sv = k.standard_variant
-                sv_cp = codepoint_str(sv)
-                av = k.accepted_variant
-                av_cp = codepoint_str(av)
-            else:
-                sv = sv_cp = av = av_cp = ''
-
-            doc = k.joyo_documentation or ''
-
-
-            if old:
-                for o, o_cp in sorted(old.items()):
-                    f.write(tsv_line(kanji,
-                                     kanji_cp,
-                                     o,
-                                     o_cp,
-                                     popular,
-                                     popular_cp,
-                                     sv,
-                                     sv_cp,
-                                     av,
-                                     av_cp,
-                                     doc))
-            elif not ('' == popular == popular_cp == sv == sv_cp == av == av_cp
-                      == doc):
-                    f.write(tsv_line(kanji,
-                                     kanji_cp,
-                                     '',
-                                     '',
-                                     popular,
-                                     popular_cp,
-                                     sv,
-                                     sv_cp,
-                                     av,
-                                     av_cp,
-                                     doc))
-
-
-    with open(outputdir + '/readings.tsv', 'wt') as f:
-        f.write("Kanji\tReading\tRomaji\tType\tUncommon?\tVariation of\tAlternative orthographies\n")
-        for k in loaded_data.kanjis:
-            for r in k.readings:
-
-                if r.uncommon:
-                    uncommon = 'Y'
-                else:
-                    uncommon = ''
-
-                if r.alternate_orthographies:
-                    altort = ','.join(r.alternate_orthographies)
-                else:
-                    altort = ''
-
-                f.write(tsv_line(
-                    k.kanji,
-                    r.reading,
-                    r.romaji(),
-                    r.kind,
-                    uncommon,
-                    r.variation_of or '',
-                    altort))
-
-    with open(outputdir + '/alternate_orthographies.tsv', 'wt') as f:
-        f.write("Kanji\tReading\tAlternative orthography\n")
-        for k in loaded_data.kanjis:
-            for r in k.readings:
-                for a in r.alternate_orthographies:
-                    f.write(tsv_line(k.kanji, r.reading, a))
-
-
-    with open(outputdir + '/old_kanji.tsv', 'wt') as f:
-        for k in loaded_data.kanjis:
-            if type(k.old_kanji) is list:
-                for old in k.old_kanji:
-                    f.write(tsv_line(k.kanji, old))
-            elif k.old_kanji:
-                f.write(tsv_line(k.kanji, k.old_kanji))
-
-    with open(outputdir + '/examples.tsv', 'wt') as f:
-        f.write("Kanji\tReading\tUncommon reading?\tVariation of\tExample\tPOS of example\tLiterary?\n")
-        for k in loaded_data.kanjis:
-            for r in k.readings:
-                if r.uncommon:
-                    uncommon = 'Y'
-                else:
-                    uncommon = ''
-
-                variation = r.variation_of or ''
+# convert_to_tsv() writes several files from the same data.  Rather than going
+# over loaded_data once per file, we go over it a single time, and hand each
+# kanji (and each of its readings) to every table; the tables add their rows to
+# a TsvSink, which writes them to its file in large blocks.
+#
+# Tables are registered in TSV_TABLES, as TsvTable tuples:
+#  - filename: name of the file in outputdir.
+#  - header: tuple of column names, or None for no header line.
+#  - on_kanji: function(sink, k), called for each Kanji, in table order.
+#  - on_reading: function(sink, k, r, uncommon, romaji), called for each
+#    Reading; uncommon is 'Y' or '', and romaji is r.romaji().
+#  - on_end: function(sink), called once after all kanji.
+#  - sorted: if true, the lines are sorted by their first field (stably)
+#    before writing.
+# Any of the functions may be None.
+TsvTable = namedtuple('TsvTable', 'filename header on_kanji on_reading on_end sorted')
+
+class TsvSink:
+    """Collects the lines of a TSV file, writing them in large blocks.
+
+    >>> import io
+    >>> sink = TsvSink(io.StringIO(), header=('Kanji', 'Reading'))
+    >>> sink.add('亜', 'ア')
+    >>> sink.close()
+    >>> sink.f.getvalue()
+    'Kanji\\tReading\\n亜\\tア\\n'
+
+    With sort, the lines are sorted by their first field; the header stays
+    first:
+
+    >>> sink = TsvSink(io.StringIO(), header=('字', '読み'), sort=True)
+    >>> sink.add('哀', 'アイ')
+    >>> sink.add('亜', 'ア')
+    >>> sink.close()
+    >>> sink.f.getvalue()
+    '字\\t読み\\n亜\\tア\\n哀\\tアイ\\n'
+    """
 
+    # flush after this many lines
+    blocksize = 8192
+
+    def __init__(self, f, header=None, sort=False):
+        self.f = f
+        self.lines = []
+        self.sort = sort
+        # (written on the first flush, apart from the lines to sort)
+        self.header = tsv_line(*header) if header else None
+
+    def add(self, *fields):
+        self.lines.append("\t".join(fields) + "\n")
+        if len(self.lines) >= self.blocksize and not self.sort:
+            self.flush()
+
+    def flush(self):
+        if self.header:
+            self.f.write(self.header)
+            self.header = None
+        self.f.write(''.join(self.lines))
+        self.lines = []
+
+    def close(self):
+        if self.sort:
+            self.lines.sort(key=lambda line: line[:line.index("\t")])
+        self.flush()
+
+def tsv_kanji_variants(sink, k):
+    if k.standard_character:
+        kanji = k.standard_character
+        kanji_cp = codepoint_str(kanji)
+        popular = k.kanji
+        popular_cp = codepoint_str(popular)
+    else:
+        kanji = k.kanji
+        kanji_cp = codepoint_str(kanji)
+        popular = popular_cp = ''
+
+    old = {}
+    for o in old_kanji_list(k):
+        old[o] = codepoint_str(o)
+
+    if k.standard_variant:
+        sv = k.standard_variant
+        sv_cp = codepoint_str(sv)
+        av = k.accepted_variant
+        av_cp = codepoint_str(av)
+    else:
+        sv = sv_cp = av = av_cp = ''
+
+    doc = k.joyo_documentation or ''
+
+    if old:
+        for o, o_cp in sorted(old.items()):
+            sink.add(kanji, kanji_cp, o, o_cp, popular, popular_cp,
+                     sv, sv_cp, av, av_cp, doc)
+    elif not ('' == popular == popular_cp == sv == sv_cp == av == av_cp
+              == doc):
+        sink.add(kanji, kanji_cp, '', '', popular, popular_cp,
+                 sv, sv_cp, av, av_cp, doc)
+
+def tsv_readings(sink, k, r, uncommon, romaji):
+    sink.add(k.kanji,
+             r.reading,
+             romaji,
+             r.kind,
+             uncommon,
+             r.variation_of or '',
+             ','.join(r.alternate_orthographies))
+
+def tsv_alternate_orthographies(sink, k, r, uncommon, romaji):
+    for a in r.alternate_orthographies:
+        sink.add(k.kanji, r.reading, a)
+
+def tsv_old_kanji(sink, k):
+    for old in old_kanji_list(k):
+        sink.add(k.kanji, old)
+
+def tsv_examples(sink, k, r, uncommon, romaji):
+    variation = r.variation_of or ''
+    for e in r.examples:
+        if e.literary:
+            lit = 'Y'
+        else:
+            lit = ''
+        sink.add(k.kanji, r.reading, uncommon, variation, e.example, e.pos or '', lit)
+
+def tsv_notes_for_kanjis(sink, k):
+    for n in k.notes:
+        sink.add(k.kanji, n)
+
+def tsv_notes_for_readings(sink, k, r, uncommon, romaji):
+    for n in r.notes:
+        sink.add(k.kanji, r.reading, uncommon, n)
+
+def tsv_compounds_by_reading(sink):
+    for kana in sorted(loaded_data.compound_readings.keys()):
+        for kanji in sorted(loaded_data.compound_readings[kana]):
+            sink.add(kana, kanji)
+
+def tsv_compounds_by_kanji(sink, k):
+    for ort, gloss in sorted(k.compound_readings.items()):
+        sink.add(k.kanji, ort, gloss)
+
+def tsv_placenames(sink, k):
+    for ort, gloss in k.placename_readings.items():
+        sink.add(k.kanji, ort, gloss)
+
+TSV_TABLES = [
+    TsvTable('kanji_variants.tsv',
+             ('Kanji',
+              'Codepoint',
+              'Old',
+              'Old codepoint',
+              'Popular',
+              'Popular codepoint',
+              'Standard variation sequence',
+              'Standard variation sequence codepoint',
+              'Acceptable variation sequence',
+              'Acceptable variation sequence codepoint',
+              'Documentation'),
+             tsv_kanji_variants, None, None, False),
+    TsvTable('readings.tsv',
+             ('Kanji', 'Reading', 'Romaji', 'Type', 'Uncommon?',
+              'Variation of', 'Alternative orthographies'),
+             None, tsv_readings, None, False),
+    TsvTable('alternate_orthographies.tsv',
+             ('Kanji', 'Reading', 'Alternative orthography'),
+             None, tsv_alternate_orthographies, None, False),
+    TsvTable('old_kanji.tsv',
+             None,
+             tsv_old_kanji, None, None, False),
+    TsvTable('examples.tsv',
+             ('Kanji', 'Reading', 'Uncommon reading?', 'Variation of',
+              'Example', 'POS of example', 'Literary?'),
+             None, tsv_examples, None, False),
+    TsvTable('notes_for_kanjis.tsv',
+             ('Kanji', 'Note'),
+             tsv_notes_for_kanjis, None, None, False),
+    TsvTable('notes_for_readings.tsv',
+             ('Kanji', 'Reading', 'Uncommon?', 'Note'),
+             None, tsv_notes_for_readings, None, False),
+    TsvTable('compounds_by_reading.tsv',
+             ('Reading', 'Orthography'),
+             None, None, tsv_compounds_by_reading, False),
+    TsvTable('compounds_by_kanji.tsv',
+             ('Kanji', 'Compound', 'Reading'),
+             tsv_compounds_by_kanji, None, None, True),
+    TsvTable('placenames.tsv',
+             ('Kanji', 'Placename', 'Reading'),
+             tsv_placenames, None, None, False),
+]
 
-                for e in r.examples:
-                    if e.pos:
-                        pos = e.pos
-                    else:
-                        pos = ''
+def convert_to_tsv(directory=outputdir, tables=TSV_TABLES):
+    "Export the data as TSV files, one for each of the tables (see TsvTable)."
 
-                    if e.literary:
-                        lit = 'Y'
-                    else:
-                        lit = ''
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    sinks = []
+    try:
+        for table in tables:
+            f = open(directory + '/' + table.filename, 'wt', buffering=1024*1024)
+            files.append(f)
+            sinks.append(TsvSink(f, table.header, table.sorted))
 
-                    f.write(tsv_line(k.kanji, r.reading, uncommon, variation, e.example, pos, lit))
+        kanji_sinks = [(sink, table.on_kanji)
+                       for sink, table in zip(sinks, tables) if table.on_kanji]
+        reading_sinks = [(sink, table.on_reading)
+                         for sink, table in zip(sinks, tables) if table.on_reading]
 
-    with open(outputdir + '/notes_for_kanjis.tsv', 'wt') as f:
-        f.write("Kanji\tNote\n")
         for k in loaded_data.kanjis:
-            if k.notes:
-                for n in k.notes:
-                    f.write(tsv_line(k.kanji, n))
+            for sink, on_kanji in kanji_sinks:
+                on_kanji(sink, k)
 
-    with open(outputdir + '/notes_for_readings.tsv', 'wt') as f:
-        f.write("Kanji\tReading\tUncommon?\tNote\n")
-        for k in loaded_data.kanjis:
-            for r in k.readings:
-                if r.uncommon:
-                    uncommon = 'Y'
-                else:
-                    uncommon = ''
-
-                if r.notes:
-                    for n in r.notes:
-                        f.write(tsv_line(
-                            k.kanji,
-                            r.reading,
-                            uncommon,
-                            n))
-
-    with open(outputdir + '/compounds_by_reading.tsv', 'wt') as f:
-        f.write("Reading\tOrthography\n")
-        for kana in sorted(loaded_data.compound_readings.keys()):
-            for kanji in sorted(loaded_data.compound_readings[kana]):
-                f.write(tsv_line(kana, kanji))
+            if reading_sinks:
+                for r in k.readings:
+                    if r.uncommon:
+                        uncommon = 'Y'
+                    else:
+                        uncommon = ''
+                    romaji = r.romaji()
 
-    with open(outputdir + '/compounds_by_kanji.tsv', 'wt') as f:
-        f.write("Kanji\tCompound\tReading\n")
-        for k in sorted(loaded_data.kanjis, key=lambda k: k.kanji):
-            for ort, gloss in sorted(k.compound_readings.items()):
-                f.write(tsv_line(k.kanji, ort, gloss))
+                    for sink, on_reading in reading_sinks:
+                        on_reading(sink, k, r, uncommon, romaji)
 
-    with open(outputdir + '/placenames.tsv', 'wt') as f:
-        f.write("Kanji\tPlacename\tReading\n")
-        for k in loaded_data.kanjis:
-            for ort, gloss in k.placename_readings.items():
-                f.write(tsv_line(k.kanji, ort, gloss))
+        for sink, table in zip(sinks, tables):
+            if table.on_end:
+                table.on_end(sink)
+            sink.close()
+    finally:
+        for f in files:
+            f.close()
 
 def tsv_line(*fields):
     return("\t".join(fields) + "\n")
@@ -825,10 +927,494 @@ def codepoint_str(string):
     return(','.join(['%04x' % ord(ch)
                      for ch in string]))
 
-def convert_to_sql():
-    pass
-def convert_to_html():
-    pass
+def old_kanji_list(k):
+    "Old forms of Kanji k, always as a list."
+    if type(k.old_kanji) is list:
+        return(k.old_kanji)
+    elif k.old_kanji:
+        return([k.old_kanji])
+    else:
+        return([])
+
+# Schema for convert_to_sql().  Rows are numbered in table order.
+SQL_SCHEMA = """
+CREATE TABLE kanji (
+    id INTEGER PRIMARY KEY,
+    kanji TEXT NOT NULL UNIQUE,
+    codepoint TEXT NOT NULL,
+    standard_character TEXT,
+    joyo_documentation TEXT
+);
+CREATE TABLE old_kanji (
+    kanji_id INTEGER NOT NULL REFERENCES kanji(id),
+    old_kanji TEXT NOT NULL,
+    codepoint TEXT NOT NULL
+);
+CREATE TABLE variants (
+    kanji_id INTEGER NOT NULL REFERENCES kanji(id),
+    standard_variant TEXT NOT NULL,
+    accepted_variant TEXT NOT NULL,
+    standard_variant_image BLOB,
+    accepted_variant_image BLOB
+);
+CREATE TABLE readings (
+    id INTEGER PRIMARY KEY,
+    kanji_id INTEGER NOT NULL REFERENCES kanji(id),
+    reading TEXT NOT NULL,
+    reading_without_dot TEXT NOT NULL,
+    romaji TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    uncommon INTEGER NOT NULL,
+    variation_of TEXT
+);
+CREATE TABLE alternate_orthographies (
+    reading_id INTEGER NOT NULL REFERENCES readings(id),
+    orthography TEXT NOT NULL
+);
+CREATE TABLE examples (
+    id INTEGER PRIMARY KEY,
+    reading_id INTEGER NOT NULL REFERENCES readings(id),
+    example TEXT NOT NULL,
+    pos TEXT,
+    literary INTEGER NOT NULL
+);
+CREATE TABLE kanji_notes (
+    kanji_id INTEGER NOT NULL REFERENCES kanji(id),
+    note TEXT NOT NULL
+);
+CREATE TABLE reading_notes (
+    reading_id INTEGER NOT NULL REFERENCES readings(id),
+    note TEXT NOT NULL
+);
+CREATE TABLE compounds (
+    reading TEXT NOT NULL,
+    orthography TEXT NOT NULL
+);
+CREATE TABLE kanji_compounds (
+    kanji_id INTEGER NOT NULL REFERENCES kanji(id),
+    compound TEXT NOT NULL,
+    reading TEXT NOT NULL
+);
+CREATE TABLE placenames (
+    kanji_id INTEGER NOT NULL REFERENCES kanji(id),
+    placename TEXT NOT NULL,
+    reading TEXT NOT NULL
+);
+
+CREATE INDEX kanji_standard_character ON kanji(standard_character);
+CREATE INDEX old_kanji_kanji_id ON old_kanji(kanji_id);
+CREATE INDEX old_kanji_old_kanji ON old_kanji(old_kanji);
+CREATE INDEX variants_kanji_id ON variants(kanji_id);
+CREATE INDEX readings_kanji_id ON readings(kanji_id);
+CREATE INDEX readings_reading ON readings(reading);
+CREATE INDEX readings_reading_without_dot ON readings(reading_without_dot);
+CREATE INDEX alternate_orthographies_reading_id ON alternate_orthographies(reading_id);
+CREATE INDEX examples_reading_id ON examples(reading_id);
+CREATE INDEX examples_example ON examples(example);
+CREATE INDEX kanji_notes_kanji_id ON kanji_notes(kanji_id);
+CREATE INDEX reading_notes_reading_id ON reading_notes(reading_id);
+CREATE INDEX compounds_reading ON compounds(reading);
+CREATE INDEX compounds_orthography ON compounds(orthography);
+CREATE INDEX kanji_compounds_kanji_id ON kanji_compounds(kanji_id);
+CREATE INDEX kanji_compounds_compound ON kanji_compounds(compound);
+CREATE INDEX placenames_kanji_id ON placenames(kanji_id);
+CREATE INDEX placenames_placename ON placenames(placename);
+"""
+
+def convert_to_sql(directory=outputdir):
+    """Export the data as an SQLite database, joyodb.sqlite3.
+
+    The database is normalized (see SQL_SCHEMA), and indexed on the usual
+    lookup columns.  It's written to a temporary file and then moved in place,
+    so readers never see a half-written database.  It's meant to be used
+    read-only, which can be done by many processes at once, e.g.:
+
+        sqlite3.connect('file:output/joyodb.sqlite3?mode=ro', uri=True)
+    """
+
+    import sqlite3
+    import tempfile
+
+    rows = defaultdict(list)
+    reading_id = 0
+    example_id = 0
+
+    for kanji_id, k in enumerate(loaded_data.kanjis, 1):
+        rows['kanji'].append((kanji_id,
+                              k.kanji,
+                              codepoint_str(k.kanji),
+                              k.standard_character,
+                              k.joyo_documentation))
+
+        for old in old_kanji_list(k):
+            rows['old_kanji'].append((kanji_id, old, codepoint_str(old)))
+
+        if k.standard_variant:
+            rows['variants'].append((kanji_id,
+                                     k.standard_variant,
+                                     k.accepted_variant,
+                                     k.standard_variant_image,
+                                     k.accepted_variant_image))
+
+        for n in k.notes:
+            rows['kanji_notes'].append((kanji_id, n))
+        for ort, gloss in k.compound_readings.items():
+            rows['kanji_compounds'].append((kanji_id, ort, gloss))
+        for ort, gloss in k.placename_readings.items():
+            rows['placenames'].append((kanji_id, ort, gloss))
+
+        for r in k.readings:
+            reading_id += 1
+            rows['readings'].append((reading_id,
+                                     kanji_id,
+                                     r.reading,
+                                     r.reading.replace('.', ''),
+                                     r.romaji(),
+                                     r.kind,
+                                     int(r.uncommon),
+                                     r.variation_of))
+            for a in r.alternate_orthographies:
+                rows['alternate_orthographies'].append((reading_id, a))
+            for n in r.notes:
+                rows['reading_notes'].append((reading_id, n))
+            for e in r.examples:
+                example_id += 1
+                rows['examples'].append((example_id,
+                                         reading_id,
+                                         e.example,
+                                         e.pos,
+                                         int(e.literary)))
+
+    for kana in sorted(loaded_data.compound_readings.keys()):
+        for kanji in sorted(loaded_data.compound_readings[kana]):
+            rows['compounds'].append((kana, kanji))
+
+    os.makedirs(directory, exist_ok=True)
+    path = directory + '/joyodb.sqlite3'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.joyodb-', suffix='.sqlite3')
+    os.close(fd)
+    try:
+        db = sqlite3.connect(tmp_path)
+        # (closed before the file is moved, or removed on errors)
+        try:
+            db.execute('PRAGMA foreign_keys = ON')
+            with db: # one transaction for everything
+                db.executescript(SQL_SCHEMA)
+                for table, table_rows in rows.items():
+                    if table_rows:
+                        placeholders = ','.join('?' * len(table_rows[0]))
+                        db.executemany('INSERT INTO %s VALUES (%s)' % (table, placeholders),
+                                       table_rows)
+            db.execute('ANALYZE')
+            db.execute('VACUUM')
+        finally:
+            db.close()
+
+        # mkstemp() creates private files; this one is for everybody to read.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+def kanji_to_dict(k):
+    """Kanji k as a dictionary of plain types, ready for JSON.
+
+    Readings, examples and notes are nested inside.
+
+    >>> k = Kanji('頼')
+    >>> k.add_reading('たよる')
+    >>> k.add_examples('頼る')
+    >>> d = kanji_to_dict(k)
+    >>> d['codepoint'], d['readings'][0]['reading'], d['readings'][0]['romaji']
+    ('983c', 'たよ.る', 'tayo.ru')
+    >>> d['readings'][0]['examples']
+    [{'example': '頼る', 'pos': None, 'literary': False}]
+    """
+
+    return({
+        'kanji': k.kanji,
+        'codepoint': codepoint_str(k.kanji),
+        'standard_character': k.standard_character,
+        'old_kanji': old_kanji_list(k),
+        'standard_variant': k.standard_variant,
+        'accepted_variant': k.accepted_variant,
+        'joyo_documentation': k.joyo_documentation,
+        'notes': k.notes,
+        'compound_readings': k.compound_readings,
+        'placename_readings': k.placename_readings,
+        'readings': [{
+            'reading': r.reading,
+            'romaji': r.romaji(),
+            'kind': r.kind,
+            'uncommon': r.uncommon,
+            'variation_of': r.variation_of,
+            'alternate_orthographies': r.alternate_orthographies,
+            'notes': r.notes,
+            'examples': [{
+                'example': e.example,
+                'pos': e.pos,
+                'literary': e.literary,
+            } for e in r.examples],
+        } for r in k.readings],
+    })
+
+def ndjson_lines(kanjis):
+    """Generate one line of JSON for each Kanji object, newline included.
+
+    >>> next(ndjson_lines([Kanji('漢')]))[:34]
+    '{"kanji": "漢", "codepoint": "6f22"'
+    """
+
+    for k in kanjis:
+        yield(json.dumps(kanji_to_dict(k), ensure_ascii=False) + "\n")
+
+def convert_to_json(directory=outputdir):
+    """Export the data as a single JSON document, joyodb.json.
+
+    The document is an object with two members: "kanjis", a list of kanji
+    objects as in kanji_to_dict(), in table order; and "compound_readings",
+    the appendix (付表), mapping each reading to its orthographies.
+
+    Each kanji is serialized and written in turn, so we never hold the whole
+    document in memory.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    with open(directory + '/joyodb.json', 'wt', buffering=1024*1024) as f:
+        f.write('{"kanjis": [\n')
+        separator = ''
+        for line in ndjson_lines(loaded_data.kanjis):
+            f.write(separator)
+            f.write(line[:-1])
+            separator = ',\n'
+        f.write('\n],\n"compound_readings": ')
+
+        compounds = {}
+        for kana in sorted(loaded_data.compound_readings.keys()):
+            compounds[kana] = sorted(loaded_data.compound_readings[kana])
+        json.dump(compounds, f, ensure_ascii=False)
+        f.write('}\n')
+
+def convert_to_ndjson(directory=outputdir):
+    """Export the data as newline-delimited JSON, joyodb.ndjson.
+
+    Each line is a complete JSON object for one kanji, as in kanji_to_dict(),
+    in table order.  Lines are generated and written one at a time.  Since
+    every record is self-contained, readers can split the file at any line
+    boundary, and process the parts in parallel, or resume from a known
+    offset.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    with open(directory + '/joyodb.ndjson', 'wt', buffering=1024*1024) as f:
+        f.writelines(ndjson_lines(loaded_data.kanjis))
+
+def convert_to_binary(directory=outputdir):
+    """Export the data as a memory-mappable binary file, joyodb.bin.
+
+    See joyodb/binary.py for the format, and for reading it.
+    """
+
+    from joyodb import binary
+    os.makedirs(directory, exist_ok=True)
+    binary.write(directory + '/joyodb.bin', loaded_data.kanjis,
+                 loaded_data.compound_readings)
+
+def convert_to_charclass(directory=outputdir):
+    """Export the Joyo, old and popular character classes.
+
+    Writes joyo_charclass.bin (bitmaps) and joyo_charclass.json (codepoint
+    ranges and regex classes); see joyodb/charclass.py.
+    """
+
+    from joyodb import charclass
+    os.makedirs(directory, exist_ok=True)
+    classes = charclass.codepoint_classes(loaded_data.kanjis)
+    charclass.write_bitmap(directory + '/joyo_charclass.bin', classes)
+    charclass.write_json(directory + '/joyo_charclass.json', classes)
+
+# How many kanji to show on each page of the HTML table.
+HTML_PAGE_SIZE = 100
+
+HTML_HEADER = """<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="utf-8">
+<title>%s</title>
+<style>
+table { border-collapse: collapse; }
+td, th { border: 1px solid #ccc; padding: 0.3em; vertical-align: top; }
+td.kanji { font-size: 300%%; text-align: center; }
+.uncommon { color: #777; }
+.romaji { font-size: 80%%; color: #555; }
+</style>
+</head>
+<body>
+"""
+
+HTML_FOOTER = """</body>
+</html>
+"""
+
+def html_page_name(page):
+    return('page-%03d.html' % page)
+
+def html_anchor(k):
+    "Id of the table row for Kanji k."
+    return('u' + codepoint_str(k.kanji))
+
+def html_kanji_row(k):
+    """Render a Kanji object as a row of the HTML table.
+
+    >>> k = Kanji('頼')
+    >>> k.add_reading('たよる')
+    >>> k.add_examples('頼る')
+    >>> print(html_kanji_row(k))
+    <tr id="u983c">
+    <td class="kanji"><a href="#u983c">頼</a></td>
+    <td></td>
+    <td></td>
+    <td><ul>
+    <li><span class="reading">たよ.る</span> <span class="romaji">tayo.ru</span> (Kun): 頼る</li>
+    </ul></td>
+    <td></td>
+    </tr>
+    <BLANKLINE>
+    """
+
+    anchor = html_anchor(k)
+    lines = ['<tr id="%s">' % anchor,
+             '<td class="kanji"><a href="#%s">%s</a></td>' % (anchor, escape(k.kanji))]
+
+    forms = []
+    if k.standard_character:
+        forms.append('MEXT: %s' % escape(k.standard_character))
+    for old in old_kanji_list(k):
+        forms.append('旧字体: %s' % escape(old))
+    lines.append('<td>%s</td>' % '<br>'.join(forms))
+
+    if k.standard_variant:
+        lines.append('<td><a href="variants_img/%s">標準字体</a><br>'
+                     '<a href="variants_img/%s">許容字体</a></td>'
+                     % (os.path.basename(variant_image_path(k.kanji, 'standard')),
+                        os.path.basename(variant_image_path(k.kanji, 'accepted'))))
+    else:
+        lines.append('<td></td>')
+
+    lines.append('<td><ul>')
+    for r in k.readings:
+        if r.uncommon:
+            item = '<li class="uncommon">'
+        else:
+            item = '<li>'
+        item += ('<span class="reading">%s</span> <span class="romaji">%s</span> (%s)'
+                 % (escape(r.reading), escape(r.romaji()), r.kind))
+        if r.variation_of:
+            item += ' ← %s' % escape(r.variation_of)
+        if r.examples:
+            item += ': ' + '、'.join([escape(e.example) for e in r.examples])
+        for n in r.notes:
+            item += '<br><small>%s</small>' % escape(n)
+        item += '</li>'
+        lines.append(item)
+    lines.append('</ul></td>')
+
+    lines.append('<td>%s</td>' % '<br>'.join([escape(n) for n in k.notes]))
+    lines.append('</tr>')
+    return("\n".join(lines) + "\n")
+
+def html_page(kanjis, page, pages):
+    """Generate the HTML for one page of the table, a piece at a time.
+
+    kanjis are the Kanji objects in this page; page is its number (from 1),
+    and pages the total number of pages.
+    """
+
+    yield(HTML_HEADER % ('常用漢字表 %d/%d' % (page, pages)))
+    yield(html_navigation(page, pages))
+    yield('<table>\n<tr><th>漢字</th><th>字体</th><th>許容字体</th>'
+          '<th>音訓・例</th><th>備考</th></tr>\n')
+    for k in kanjis:
+        yield(html_kanji_row(k))
+    yield('</table>\n')
+    yield(html_navigation(page, pages))
+    yield(HTML_FOOTER)
+
+def html_navigation(page, pages):
+    links = ['<a href="index.html">目次</a>']
+    if page > 1:
+        links.append('<a href="%s">前</a>' % html_page_name(page - 1))
+    if page < pages:
+        links.append('<a href="%s">次</a>' % html_page_name(page + 1))
+    return('<p>%s</p>\n' % ' | '.join(links))
+
+def html_index(pages_kanjis):
+    "Generate the HTML for the index page, linking to every kanji."
+
+    yield(HTML_HEADER % '常用漢字表')
+    yield('<h1>常用漢字表</h1>\n')
+    for page, kanjis in enumerate(pages_kanjis, 1):
+        name = html_page_name(page)
+        yield('<p><a href="%s">%d</a>: ' % (name, page))
+        yield(' '.join(['<a href="%s#%s">%s</a>' % (name, html_anchor(k), escape(k.kanji))
+                        for k in kanjis]))
+        yield('</p>\n')
+    yield(HTML_FOOTER)
+
+def write_with_gzip(path, chunks):
+    """Write an iterable of strings to path, and to path.gz compressed.
+
+    The .gz file has no timestamp or filename in its header, so that it only
+    changes when the content does.
+    """
+
+    with open(path, 'wb') as f, open(path + '.gz', 'wb') as raw:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0) as gz:
+            for chunk in chunks:
+                data = chunk.encode('utf-8')
+                f.write(data)
+                gz.write(data)
+
+def convert_to_html(directory=outputdir, page_size=HTML_PAGE_SIZE):
+    """Export the main table as a static HTML site, in directory/html.
+
+    The table is split into pages of page_size kanji, plus an index.html
+    linking to each kanji.  Every kanji row has an anchor named after its
+    codepoint (page-001.html#u4e9c).  The reference images for variant kanji
+    are copied to html/variants_img, and linked from the table.
+
+    Pages are generated and written piece by piece.  Each page also gets a
+    gzip-compressed copy (index.html.gz etc.), for web servers that can serve
+    precompressed files.  Pages left over from an earlier run (with a
+    smaller page_size) are removed first.
+    """
+
+    import glob
+    import shutil
+
+    html_dir = directory + '/html'
+    os.makedirs(html_dir + '/variants_img', exist_ok=True)
+    for stale in (glob.glob(html_dir + '/page-*.html')
+                  + glob.glob(html_dir + '/page-*.html.gz')):
+        os.unlink(stale)
+
+    kanjis = loaded_data.kanjis
+    pages_kanjis = [kanjis[i:i+page_size] for i in range(0, len(kanjis), page_size)]
+
+    write_with_gzip(html_dir + '/index.html', html_index(pages_kanjis))
+    for page, page_kanjis in enumerate(pages_kanjis, 1):
+        write_with_gzip(html_dir + '/' + html_page_name(page),
+                        html_page(page_kanjis, page, len(pages_kanjis)))
+
+        for k in page_kanjis:
+            if k.standard_variant:
+                for kind in ('standard', 'accepted'):
+                    image = variant_image_path(k.kanji, kind)
+                    shutil.copyfile(image, html_dir + '/variants_img/'
+                                    + os.path.basename(image))
 
 # With this, one can test with: env PYTHONPATH=. python3 convert.py
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+# How much of a text is Joyo, for readability scoring over large corpora.
+#
+# For each document, we count its characters by category:
+#
+#   - joyo: Joyo kanji (Kanji.kanji, and standard characters);
+#   - popular: the characters of data/popular_alternatives.tsv, either form
+#     (𠮟 and 叱);
+#   - old: old forms (Kanji.old_kanji) that aren't Joyo themselves;
+#   - non_joyo: any other kanji (see KANJI_RANGES);
+#   - other: everything else (kana, punctuation, Latin...).
+#
+# Doing that one character at a time in Python is far too slow for tens of
+# millions of documents.  Instead, Coverage keeps a table with the category of
+# every Unicode codepoint, as a NumPy array; a batch of documents is encoded
+# into one array of codepoints, looked up in the table all at once, and
+# counted per document with a single bincount().
+#
+# NumPy is optional: without it, Coverage can't be used, but
+# python_histogram() does the same thing the slow way.
+
+from joyodb import *
+
+try:
+    np = lazy_import('numpy')
+except ImportError:
+    np = None
+
+CATEGORIES = ('joyo', 'popular', 'old', 'non_joyo', 'other')
+JOYO, POPULAR, OLD, NON_JOYO, OTHER = range(len(CATEGORIES))
+
+# CJK Unified Ideographs (with extensions A to H) and compatibility ideographs.
+KANJI_RANGES = [
+    (0x3400, 0x4dbf),
+    (0x4e00, 0x9fff),
+    (0xf900, 0xfaff),
+    (0x20000, 0x2fa1f),
+    (0x30000, 0x323af),
+]
+
+# How many documents histograms() gets at a time, in batches().
+BATCH_SIZE = 10000
+
+def character_categories(kanjis):
+    """Map the characters of the table to their categories (see above).
+
+    >>> from joyodb.model import Kanji
+    >>> koku = Kanji('国')
+    >>> koku.add_old_kanji('國')
+    >>> c = character_categories([koku, Kanji('𠮟')])
+    >>> c['国'], c['國'], c['叱'], c['𠮟']
+    (0, 2, 1, 1)
+    """
+
+    categories = {}
+    for k in kanjis:
+        old_forms = k.old_kanji if type(k.old_kanji) is list else [k.old_kanji]
+        for old in old_forms:
+            if old and len(old) == 1:
+                categories[old] = OLD
+    for k in kanjis:
+        for ch in (k.kanji, k.standard_character):
+            if ch and len(ch) == 1:
+                categories[ch] = JOYO
+    for standard, popular in popular_alternatives.items():
+        categories[standard] = POPULAR
+        categories[popular] = POPULAR
+    return(categories)
+
+def is_kanji(c):
+    for first, last in KANJI_RANGES:
+        if first <= c <= last:
+            return(True)
+    return(False)
+
+def python_histogram(text, categories):
+    """Count the characters of text by category, one at a time.
+
+    categories is the result of character_categories().  Returns a list of
+    counts, in CATEGORIES order.  (This is what Coverage does, without NumPy.)
+
+    >>> python_histogram('国語と國', {'国': JOYO, '國': OLD})
+    [1, 0, 1, 1, 1]
+    """
+
+    counts = [0] * len(CATEGORIES)
+    for ch in text:
+        category = categories.get(ch)
+        if category is None:
+            category = NON_JOYO if is_kanji(ord(ch)) else OTHER
+        counts[category] += 1
+    return(counts)
+
+class Coverage:
+    """Counts characters by category, for many documents at once.
+
+    >>> from joyodb.model import Kanji
+    >>> koku = Kanji('国')
+    >>> koku.add_old_kanji('國')
+    >>> c = Coverage([koku])
+    >>> c.histogram('国語と國').tolist()
+    [1, 0, 1, 1, 1]
+    >>> h = c.histograms(['国語', '', '𠮟る'])
+    >>> h.tolist()
+    [[1, 0, 0, 1, 0], [0, 0, 0, 0, 0], [0, 1, 0, 0, 1]]
+    >>> c.shares(h).round(2).tolist()
+    [[0.5, 0.0, 0.0, 0.5, 0.0], [0.0, 0.0, 0.0, 0.0, 0.0], [0.0, 0.5, 0.0, 0.0, 0.5]]
+    """
+
+    def __init__(self, kanjis):
+        if np is None:
+            raise(ImportError("joyodb.coverage.Coverage needs NumPy"))
+        self.kanjis = kanjis
+
+        # codepoint -> category, for all of Unicode (1.1 MB).
+        table = np.full(0x110000, OTHER, dtype=np.uint8)
+        for first, last in KANJI_RANGES:
+            table[first:last + 1] = NON_JOYO
+        for ch, category in character_categories(kanjis).items():
+            table[ord(ch)] = category
+        self.table = table
+
+    def codepoints(self, text):
+        "text as an array of codepoints (without copying the encoded bytes)."
+        return(np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype='<u4'))
+
+    def histogram(self, text):
+        "Count the characters of text by category, in CATEGORIES order."
+        return(np.bincount(self.table[self.codepoints(text)],
+                           minlength=len(CATEGORIES)))
+
+    def histograms(self, texts):
+        """Count the characters of each text by category.
+
+        Returns an array with one row per text, and one column per category.
+        """
+
+        texts = list(texts)
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        categories = self.table[self.codepoints(''.join(texts))]
+
+        # (text number * number of categories + category) for each character
+        n = len(CATEGORIES)
+        keys = np.repeat(np.arange(len(texts), dtype=np.int64) * n, lengths)
+        keys += categories
+        return(np.bincount(keys, minlength=len(texts) * n).reshape(len(texts), n))
+
+    def shares(self, histograms):
+        "Turn counts from histograms() into fractions of each text (0 if empty)."
+        totals = histograms.sum(axis=-1, keepdims=True)
+        return(histograms / np.maximum(totals, 1))
+
+    def batches(self, texts, batch_size=BATCH_SIZE):
+        """Generate histograms() for batch_size texts at a time.
+
+        texts can be any iterable, like the lines of a file; it's only read
+        as far as needed.
+        """
+
+        batch = []
+        for text in texts:
+            batch.append(text)
+            if len(batch) == batch_size:
+                yield(self.histograms(batch))
+                batch = []
+        if batch:
+            yield(self.histograms(batch))
+
+current_coverage = None
+def coverage():
+    "Return the Coverage for loaded_data.kanjis, building it if needed."
+    global current_coverage
+    if current_coverage is None or current_coverage.kanjis is not loaded_data.kanjis:
+        current_coverage = Coverage(loaded_data.kanjis)
+    return(current_coverage)
+
+def histograms(texts):
+    "See Coverage.histograms()."
+    return(coverage().histograms(texts))
@@ -0,0 +1,41 @@
+# Reference images for kanji with variant glyphs.
+#
+# data/variants_img has two PNG files for each of the five kanji with accepted
+# variants (許容字体), named after the base codepoint: e.g. 9061-standard.png
+# and 9061-accepted.png for 遡.  The files are read only when some image is
+# first asked for, and their contents are kept in memory; so no file
+# descriptors stay open, and Kanji objects (which don't hold the images
+# themselves) are cheap to copy, pickle and send to other processes.
+
+from joyodb import *
+
+# (base character, kind) -> bytes
+image_cache = {}
+
+def variant_image_path(character, kind):
+    """Path of the reference image for a kanji; kind is standard or accepted.
+
+    >>> variant_image_path('遡', 'accepted').endswith('/variants_img/9061-accepted.png')
+    True
+    """
+    return(datadir + '/variants_img/%x-%s.png' % (ord(character[0]), kind))
+
+def variant_image(character, kind):
+    """Return the reference image for a kanji, as bytes.
+
+    kind is 'standard' or 'accepted'.  Variation sequences are accepted as
+    well as plain characters.
+
+    >>> variant_image('遡', 'standard')[:4]
+    b'\\x89PNG'
+    >>> variant_image('遡\\U000e0100', 'standard') is variant_image('遡', 'standard')
+    True
+    """
+
+    key = (character[0], kind)
+    image = image_cache.get(key)
+    if image is None:
+        with open(variant_image_path(character, kind), 'rb') as f:
+            image = f.read()
+        image_cache[key] = image
+    return(image)
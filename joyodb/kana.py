@@ -0,0 +1,169 @@
+# Table-driven conversions between hiragana, katakana and rōmaji.
+#
+# We used to go through romkan for these, which works by running a big regular
+# expression over the string, once for katakana and once for hiragana; and to
+# turn katakana into hiragana, it went through rōmaji and back.  That's a lot
+# of work for strings that are mostly two or three kana long, and that we
+# convert for every reading in every export.
+#
+# Here, katakana and hiragana are a fixed distance apart in Unicode, so
+# converting between them is a str.translate() call; and rōmaji come from a
+# dictionary of kana sequences, matched longest first.  The tables give exactly
+# the same (Hepburn) rōmaji as romkan.to_hepburn() does for kana, quirks
+# included: small kana on their own become 'x' + vowel, a final っ is 'xtsu',
+# and ー is '-'.  Anything that's not kana, like the okurigana dot, is left
+# alone.
+
+# Kana (hiragana) to Hepburn rōmaji, as in romkan, but without the doubled
+# consonants of っ, which we derive below.
+HIRAGANA_ROMAJI = dict([pair.split('=') for pair in """
+    あ=a い=i う=u え=e お=o ぁ=xa ぃ=xi ぅ=xu ぇ=xe ぉ=xo
+    か=ka き=ki く=ku け=ke こ=ko きゃ=kya きゅ=kyu きょ=kyo
+    が=ga ぎ=gi ぐ=gu げ=ge ご=go ぎゃ=gya ぎゅ=gyu ぎょ=gyo
+    さ=sa し=shi す=su せ=se そ=so しゃ=sha しゅ=shu しょ=sho
+    ざ=za じ=ji ず=zu ぜ=ze ぞ=zo じゃ=ja じゅ=ju じょ=jo じぇ=je
+    た=ta ち=chi つ=tsu て=te と=to ちゃ=cha ちゅ=chu ちょ=cho ちぇ=che
+    だ=da ぢ=di づ=du で=de ど=do ぢゃ=dya ぢゅ=dyu ぢょ=dyo でぃ=dyi
+    な=na に=ni ぬ=nu ね=ne の=no にゃ=nya にゅ=nyu にょ=nyo
+    は=ha ひ=hi ふ=fu へ=he ほ=ho ひゃ=hya ひゅ=hyu ひょ=hyo
+    ば=ba び=bi ぶ=bu べ=be ぼ=bo びゃ=bya びゅ=byu びょ=byo
+    ぱ=pa ぴ=pi ぷ=pu ぺ=pe ぽ=po ぴゃ=pya ぴゅ=pyu ぴょ=pyo
+    ふぁ=fa ふぃ=fi ふぇ=fe ふぉ=fo
+    ま=ma み=mi む=mu め=me も=mo みゃ=mya みゅ=myu みょ=myo
+    や=ya ゆ=yu よ=yo ゃ=xya ゅ=xyu ょ=xyo
+    ら=ra り=ri る=ru れ=re ろ=ro りゃ=rya りゅ=ryu りょ=ryo
+    わ=wa ゐ=wi ゑ=we を=wo ゎ=xwa ん=n' っ=xtsu ー=-
+    う゛=vu う゛ぁ=va う゛ぃ=vi う゛ぇ=ve う゛ぉ=vo
+""".split()])
+
+# Katakana and hiragana are 0x60 codepoints apart, from ァ/ぁ to ヶ/ゖ.
+KATAKANA_TO_HIRAGANA = {k: k - 0x60 for k in range(ord('ァ'), ord('ヶ') + 1)}
+HIRAGANA_TO_KATAKANA = {h: k for k, h in KATAKANA_TO_HIRAGANA.items()}
+
+# romkan has a few more combinations for katakana (loanwords).
+KATAKANA_ONLY_ROMAJI = {
+    'シェ': 'she',
+    'ティ': 'ti',
+    'ディ': 'di', # (hiragana でぃ is 'dyi')
+    'ドゥ': 'du',
+    'フュ': 'fu',
+    'ウィ': 'wi',
+    'ウェ': 'we',
+    'ウォ': 'wo',
+}
+
+# Before these, romkan has no doubled form for っ/ッ, so it's just 'xtsu'.
+NO_DOUBLE_CONSONANT = ('じぇ', 'でぃ', 'ジェ', 'ディ')
+
+def build_romaji_table():
+    "Return the table for to_romaji(), from the ones above."
+
+    table = {}
+    for hiragana, romaji in HIRAGANA_ROMAJI.items():
+        table[hiragana] = romaji
+        katakana = hiragana.translate(HIRAGANA_TO_KATAKANA).replace('ウ゛', 'ヴ')
+        table[katakana] = romaji
+    table.update(KATAKANA_ONLY_ROMAJI)
+
+    # っ doubles the consonant that follows: っか is 'kka', っち is 'cchi'.
+    for kana, romaji in list(table.items()):
+        if romaji[0] in 'bcdfghjkprstvyz' and kana not in NO_DOUBLE_CONSONANT:
+            if kana.translate(KATAKANA_TO_HIRAGANA) == kana:
+                table['っ' + kana] = romaji[0] + romaji
+            else:
+                table['ッ' + kana] = romaji[0] + romaji
+    return(table)
+
+KANA_ROMAJI = build_romaji_table()
+
+# first character -> length of the longest sequence starting with it
+KANA_MAX_LENGTH = {}
+for kana in KANA_ROMAJI:
+    KANA_MAX_LENGTH[kana[0]] = max(len(kana), KANA_MAX_LENGTH.get(kana[0], 1))
+
+def katakana_to_hiragana(string):
+    """Convert the katakana in string to hiragana.
+
+    >>> katakana_to_hiragana('ニュウ')
+    'にゅう'
+    >>> katakana_to_hiragana('もっと.も')
+    'もっと.も'
+    """
+    return(string.translate(KATAKANA_TO_HIRAGANA))
+
+def hiragana_to_katakana(string):
+    """Convert the hiragana in string to katakana.
+
+    >>> hiragana_to_katakana('たよ.る')
+    'タヨ.ル'
+    """
+    return(string.translate(HIRAGANA_TO_KATAKANA))
+
+def to_romaji(string):
+    """Convert the kana in string to (lowercase) Hepburn rōmaji.
+
+    >>> to_romaji('ケン')
+    'ken'
+    >>> to_romaji('たよ.る')
+    'tayo.ru'
+    >>> to_romaji('ニュウ'), to_romaji('みっつ')
+    ('nyuu', 'mittsu')
+
+    The dot is not kana, so like in romkan, a っ before it stays alone:
+
+    >>> to_romaji('みっ.つ')
+    'mixtsu.tsu'
+
+    ん is "n'" before vowels and y, like in romkan:
+
+    >>> to_romaji('ゲンイン'), to_romaji('コンヤ'), to_romaji('アンナイ')
+    ("gen'in", "kon'ya", "an'nai")
+    """
+
+    pieces = []
+    i = 0
+    end = len(string)
+    while i < end:
+        char = string[i]
+        for n in range(KANA_MAX_LENGTH.get(char, 1), 1, -1):
+            romaji = KANA_ROMAJI.get(string[i:i+n])
+            if romaji:
+                break
+        else:
+            n = 1
+            romaji = KANA_ROMAJI.get(char, char)
+        pieces.append(romaji)
+        i += n
+
+    # ん: keep the apostrophe only where it's needed.
+    for i, piece in enumerate(pieces):
+        if piece == "n'" and (i + 1 == len(pieces) or pieces[i+1][0] not in 'aeiouyn'):
+            pieces[i] = 'n'
+
+    return(''.join(pieces))
+
+def katakana_to_hiragana_many(strings):
+    """katakana_to_hiragana() over a list of strings; returns a list.
+
+    >>> katakana_to_hiragana_many(['ケン', 'ゲン', 'いや'])
+    ['けん', 'げん', 'いや']
+    """
+    return([s.translate(KATAKANA_TO_HIRAGANA) for s in strings])
+
+def to_romaji_many(strings):
+    """to_romaji() over a list of strings; returns a list.
+
+    Readings repeat a lot, so each distinct string is converted only once.
+
+    >>> to_romaji_many(['ケン', 'ゲン', 'ケン'])
+    ['ken', 'gen', 'ken']
+    """
+
+    memo = {}
+    results = []
+    for string in strings:
+        romaji = memo.get(string)
+        if romaji is None:
+            romaji = memo[string] = to_romaji(string)
+        results.append(romaji)
+    return(results)
@@ -0,0 +1,212 @@
+# Finding kanji by their readings, and completing readings.
+#
+# To answer "which kanji can be read こう…?" we'd have to go through every
+# Reading of every Kanji.  Instead, we keep all readings in a sorted array,
+# keyed on their hiragana without the okurigana dot (こう, ひかり, ひかる...).
+# A reading is then found by binary search, and all readings starting with a
+# prefix are a contiguous slice of the array, found by two binary searches.
+# This does the job of a trie, in two flat lists.
+#
+# For completion, we also want the "best" few readings for a prefix, which is
+# what top() returns.  We have no frequency data, so by default the best are the
+# common readings before the uncommon ones, the main readings before their
+# variations, the shorter ones before the longer, and then table order; another
+# ranking can be given as a function.
+#
+# As in lookup.py, the module-level functions work on loaded_data, building the
+# index on first use, and rebuilding it if loaded_data.kanjis gets replaced.
+
+from bisect import bisect_left, bisect_right
+import heapq
+
+from joyodb import *
+from joyodb import kana
+
+# Sorts after any kana; prefix + LAST_CHARACTER bounds the keys with prefix.
+LAST_CHARACTER = '\U0010ffff'
+
+# top() picks the best of a slice of up to this many readings directly;
+# above that, it goes through all readings by rank until it has enough.
+TOP_SLICE_LIMIT = 128
+
+def reading_key(string):
+    """The index key for a reading: hiragana, without the dot.
+
+    >>> reading_key('コウ'), reading_key('ひか.る')
+    ('こう', 'ひかる')
+    """
+    return(kana.katakana_to_hiragana(string).replace('.', ''))
+
+def default_rank(reading):
+    "See KanaIndex; ties are broken by table order."
+    return((reading.uncommon,
+            bool(reading.variation_of),
+            len(reading.reading.replace('.', ''))))
+
+class KanaIndex:
+    """A sorted index of readings, for exact and prefix search.
+
+    Queries can be in hiragana or katakana, with or without the okurigana dot.
+    All methods take the same filters, which default to None (anything goes):
+
+      - kind: 'On' or 'Kun'.
+      - uncommon: True or False.
+      - variation_of: True for variations only, False for no variations, or a
+        reading (like 'おそ.れる') for the variations of that reading only.
+
+    >>> from joyodb.model import Kanji
+    >>> ko = Kanji('光')
+    >>> ko.add_reading('コウ')
+    >>> ko.add_reading('ひかる')
+    >>> ko.add_examples('光る')
+    >>> ko.add_reading('ひかり')
+    >>> ko.add_examples('光')
+    >>> ki = Kanji('木')
+    >>> ki.add_reading('ボク')
+    >>> ki.add_reading('モク')
+    >>> ki.add_reading('き')
+    >>> ki.add_reading('　こ')
+    >>> i = KanaIndex([ko, ki])
+
+    >>> [(r.kanji.kanji, r.reading) for r in i.exact('こう')]
+    [('光', 'コウ')]
+    >>> [r.reading for r in i.prefix('ひか')]
+    ['ひかり', 'ひか.る']
+    >>> [r.reading for r in i.prefix('こ')]
+    ['こ', 'コウ']
+
+    top() returns the first readings by rank; here, the uncommon こ comes last:
+
+    >>> [r.reading for r in i.top('こ', 2)]
+    ['コウ', 'こ']
+    >>> [r.reading for r in i.top('', 3, kind='Kun')]
+    ['き', 'ひか.る', 'ひかり']
+    >>> [r.reading for r in i.prefix('', uncommon=True)]
+    ['こ']
+    """
+
+    def __init__(self, kanjis, rank=default_rank):
+        """Index the readings of kanjis.
+
+        rank is a function from Reading objects to something sortable; lower
+        ranks come first in top() and exact().
+        """
+
+        self.kanjis = kanjis
+
+        entries = []
+        position = 0
+        for k in kanjis:
+            for r in k.readings:
+                entries.append((reading_key(r.reading), rank(r), position, r))
+                position += 1
+        entries.sort(key=lambda e: e[:3])
+
+        # Parallel arrays, in key order.
+        self.keys = [e[0] for e in entries]
+        self.readings = [e[3] for e in entries]
+
+        # Position of each entry in rank order, and the reverse.
+        by_rank = sorted(range(len(entries)), key=lambda i: entries[i][1:3])
+        self.ranks = [0] * len(entries)
+        for n, i in enumerate(by_rank):
+            self.ranks[i] = n
+        self.by_rank = by_rank
+
+        # See ranked().
+        self.ranked_cache = {}
+
+    def slice(self, key):
+        "Return (start, end) of the entries whose keys start with key."
+        return(bisect_left(self.keys, key),
+               bisect_left(self.keys, key + LAST_CHARACTER))
+
+    def filtered(self, indexes, kind=None, uncommon=None, variation_of=None):
+        "Return the readings at indexes that pass the filters (see above)."
+
+        readings = self.readings
+        result = []
+        for i in indexes:
+            r = readings[i]
+            if kind is not None and r.kind != kind:
+                continue
+            if uncommon is not None and r.uncommon != uncommon:
+                continue
+            if variation_of is not None:
+                if variation_of is True or variation_of is False:
+                    if bool(r.variation_of) != variation_of:
+                        continue
+                elif r.variation_of != variation_of:
+                    continue
+            result.append(r)
+        return(result)
+
+    def ranked(self, filters):
+        """Return the indexes of the entries that pass filters, in rank order.
+
+        Computed once for each combination of filters.
+        """
+
+        key = tuple(sorted(filters.items()))
+        if key not in self.ranked_cache:
+            passing = set([id(r) for r in self.filtered(self.by_rank, **filters)])
+            self.ranked_cache[key] = [i for i in self.by_rank
+                                      if id(self.readings[i]) in passing]
+        return(self.ranked_cache[key])
+
+    def exact(self, reading, **filters):
+        "Return the readings that are read exactly as reading, by rank."
+
+        key = reading_key(reading)
+        start = bisect_left(self.keys, key)
+        end = bisect_right(self.keys, key, start)
+        indexes = sorted(range(start, end), key=self.ranks.__getitem__)
+        return(self.filtered(indexes, **filters))
+
+    def prefix(self, prefix, **filters):
+        "Return the readings starting with prefix, in kana order."
+        start, end = self.slice(reading_key(prefix))
+        return(self.filtered(range(start, end), **filters))
+
+    def top(self, prefix, k=10, **filters):
+        "Return the (up to) k best-ranked readings starting with prefix."
+
+        key = reading_key(prefix)
+        start, end = self.slice(key)
+        if end - start <= TOP_SLICE_LIMIT:
+            if not filters:
+                return([self.readings[i] for i in
+                        heapq.nsmallest(k, range(start, end),
+                                        key=self.ranks.__getitem__)])
+            indexes = sorted(range(start, end), key=self.ranks.__getitem__)
+            return(self.filtered(indexes, **filters)[:k])
+
+        # A short prefix, matching a good part of the index: its best readings
+        # will turn up early in rank order.
+        result = []
+        for i in self.ranked(filters):
+            if start <= i < end:
+                result.append(self.readings[i])
+                if len(result) == k:
+                    break
+        return(result)
+
+current_index = None
+def kana_index():
+    "Return the KanaIndex over loaded_data.kanjis, building it if needed."
+    global current_index
+    if current_index is None or current_index.kanjis is not loaded_data.kanjis:
+        current_index = KanaIndex(loaded_data.kanjis)
+    return(current_index)
+
+def exact(reading, **filters):
+    "See KanaIndex.exact()."
+    return(kana_index().exact(reading, **filters))
+
+def prefix(prefix, **filters):
+    "See KanaIndex.prefix()."
+    return(kana_index().prefix(prefix, **filters))
+
+def top(prefix, k=10, **filters):
+    "See KanaIndex.top()."
+    return(kana_index().top(prefix, k, **filters))
@@ -0,0 +1,279 @@
+# Checking text for compliance with the Joyo table.
+#
+# The Linter reports, for each line of text:
+#
+#   - 'non-joyo': kanji that are not in the table at all;
+#   - 'old form': old forms (旧字体) of Joyo kanji, like 國 for 国;
+#   - 'reading': Joyo words annotated with a reading (furigana) that can't be
+#     made out of the readings in the table.
+#
+# Without furigana, we can't tell how a kanji is read, so readings are only
+# checked where the text gives them: as Aozora Bunko ruby (｜漢字《かんじ》, or
+# 漢字《かんじ》 for a run of kanji), or as HTML <ruby>漢字<rt>かんじ</rt></ruby>.
+# A reading is fine if it's the reading of an appendix word, compound or
+# placename, or if it can be spelled out kanji by kanji from their readings,
+# allowing for the usual sound changes: rendaku (か→が), and a final つ, く,
+# ち or き becoming っ before another kanji.
+#
+# Linter.lint_lines() works on a stream of lines, keeping statistics as it goes;
+# bin/lint_joyo is the command-line interface, which can also lint many files
+# in parallel (see lint_file() and merge_stats()).
+
+from collections import Counter, namedtuple
+
+from joyodb import *
+from joyodb import kana
+from joyodb.lookup import is_variation_selector
+re = lazy_import('regex')
+
+# A problem found in the text.
+#  - line, column: where, counting from 1.
+#  - category: 'non-joyo', 'old form' or 'reading'.
+#  - text: the offending character, or annotated word.
+#  - detail: the Joyo form, for old forms; the reading, for readings.
+Finding = namedtuple('Finding', 'line column category text detail')
+
+# Not kanji proper, though Unicode says they're Han.
+NOT_KANJI = '々〆〇'
+
+# A kanji, with its variation selector if any; or a word with ruby, Aozora or
+# HTML style.
+VARIATION_SELECTOR = r'[\ufe00-\ufe0f\U000e0100-\U000e01ef]'
+TOKEN_REGEX = (r'(?P<ruby>'
+               r'(?:｜(?P<aozora_base>[^｜《》]+)|(?P<run>(?:\p{Han}%s?)++))'
+               r'《(?P<aozora_reading>[^《》]+)》'
+               r'|<ruby>(?P<html_base>[^<>]+)<rt>(?P<html_reading>[^<>]+)</rt></ruby>)'
+               r'|(?P<kanji>\p{Han}%s?)') % (VARIATION_SELECTOR, VARIATION_SELECTOR)
+
+# Voiced forms of kana (rendaku).
+RENDAKU = {}
+for pair in 'かが きぎ くぐ けげ こご さざ しじ すず せぜ そぞ ただ ちぢ つづ てで とど はばぱ ひびぴ ふぶぷ へべぺ ほぼぽ'.split():
+    RENDAKU[pair[0]] = pair[1:]
+
+# Kana that become っ at the end of a kanji's reading, before another kanji.
+GEMINATING = 'つくちき'
+
+def reading_variants(stem, first, last):
+    """The ways a kanji's reading (in hiragana) can sound inside a word.
+
+    >>> sorted(reading_variants('はつ', first=False, last=False))
+    ['はっ', 'はつ', 'ばっ', 'ばつ', 'ぱっ', 'ぱつ']
+    """
+
+    variants = set([stem])
+    if not first:
+        for voiced in RENDAKU.get(stem[0], ''):
+            variants.add(voiced + stem[1:])
+    if not last:
+        for variant in list(variants):
+            if variant[-1] in GEMINATING:
+                variants.add(variant[:-1] + 'っ')
+    return(variants)
+
+class Linter:
+    """Finds non-Joyo usage in text.
+
+    >>> from joyodb.model import Kanji
+    >>> koku = Kanji('国')
+    >>> koku.add_old_kanji('國')
+    >>> koku.add_reading('コク')
+    >>> koku.add_reading('くに')
+    >>> go = Kanji('語')
+    >>> go.add_reading('ゴ')
+    >>> l = Linter([koku, go], {})
+    >>> for finding in l.lint_lines(['國語と英語', '国語《こくご》と国《こく》語《ご》']):
+    ...     print(finding)
+    Finding(line=1, column=1, category='old form', text='國', detail='国')
+    Finding(line=1, column=4, category='non-joyo', text='英', detail=None)
+
+    Readings are checked where given, allowing for sound changes:
+
+    >>> list(l.lint_lines(['国々《くにぐに》、国語《こっご》、<ruby>国<rt>こに</rt></ruby>']))
+    [Finding(line=1, column=24, category='reading', text='国', detail='こに')]
+    >>> l.stats['non-joyo'], l.stats['kanji']
+    (1, 13)
+    """
+
+    def __init__(self, kanjis, compound_readings):
+        self.kanjis = kanjis
+
+        # character (or variation sequence) -> None if fine, or the Joyo form
+        # if it's an old form.
+        self.status = {}
+        for k in kanjis:
+            if type(k.old_kanji) is list:
+                old_forms = k.old_kanji
+            elif k.old_kanji:
+                old_forms = [k.old_kanji]
+            else:
+                old_forms = []
+            for old in old_forms:
+                self.status.setdefault(old, k.kanji)
+        for k in kanjis:
+            for ch in (k.kanji, k.standard_character, k.standard_variant, k.accepted_variant):
+                if ch:
+                    self.status[ch] = None
+        for standard, popular in popular_alternatives.items():
+            if popular in self.status:
+                self.status[standard] = None
+        for ch in NOT_KANJI:
+            self.status[ch] = None
+
+        # kanji -> readings of the part before okurigana, in hiragana
+        self.stems = {}
+        for k in kanjis:
+            self.stems[k.kanji] = set([kana.katakana_to_hiragana(r.reading).split('.')[0]
+                                       for r in k.readings])
+            if k.standard_character:
+                self.stems[k.standard_character] = self.stems[k.kanji]
+
+        # word -> its readings, as a whole
+        self.word_readings = {}
+        for gloss, orthographies in compound_readings.items():
+            for orthography in orthographies:
+                self.word_readings.setdefault(orthography, set()).add(gloss)
+        for k in kanjis:
+            for readings in (k.compound_readings, k.placename_readings):
+                for orthography, gloss in readings.items():
+                    self.word_readings.setdefault(orthography, set()).add(gloss)
+
+        self.token_regex = re.compile(TOKEN_REGEX)
+        self.kanji_regex = re.compile(r'\p{Han}%s?' % VARIATION_SELECTOR)
+
+        # Counts of lines, kanji and findings by category; and of findings by
+        # (category, text).
+        self.stats = Counter()
+        self.by_text = Counter()
+
+    def reset_stats(self):
+        "Start counting afresh; return the counts so far, as (stats, by_text)."
+        counts = (self.stats, self.by_text)
+        self.stats = Counter()
+        self.by_text = Counter()
+        return(counts)
+
+    def check_kanji(self, ch):
+        """Return (category, detail) if ch is not Joyo, else None."""
+
+        if ch in self.status:
+            old = self.status[ch]
+            if old:
+                return(('old form', old))
+            return(None)
+        if len(ch) > 1 and is_variation_selector(ch[-1]):
+            # an unlisted variation sequence of a Joyo kanji is still Joyo
+            return(self.check_kanji(ch[0]))
+        return(('non-joyo', None))
+
+    def is_valid_reading(self, word, reading):
+        """Whether the reading of word can be made from the Joyo table.
+
+        word may have kana (okurigana) in it; these must match the reading.
+        """
+
+        reading = kana.katakana_to_hiragana(reading)
+        if reading in self.word_readings.get(word, ()):
+            return(True)
+
+        word = [ch for ch in word if not is_variation_selector(ch)]
+
+        # positions[i]: the offsets in reading where word[:i] can end
+        positions = set([0])
+        for i, ch in enumerate(word):
+            if ch == '々' and i > 0:
+                ch = word[i-1]
+            next_positions = set()
+            if ch in self.stems:
+                variants = set()
+                for stem in self.stems[ch]:
+                    variants |= reading_variants(stem, i == 0, i == len(word) - 1)
+            else:
+                variants = set([kana.katakana_to_hiragana(ch)])
+            for position in positions:
+                for variant in variants:
+                    if reading.startswith(variant, position):
+                        next_positions.add(position + len(variant))
+            positions = next_positions
+            if not positions:
+                return(False)
+        return(len(reading) in positions)
+
+    def lint_line(self, line, number=1):
+        "Generate the Finding objects for one line of text."
+
+        stats = self.stats
+        by_text = self.by_text
+        stats['lines'] += 1
+        for m in self.token_regex.finditer(line):
+            if m.group('kanji'):
+                bases = [(m.start(), m.group('kanji'))]
+                reading = None
+            else:
+                base = m.group('aozora_base') or m.group('run') or m.group('html_base')
+                reading = m.group('aozora_reading') or m.group('html_reading')
+                start = m.start('aozora_base')
+                if start < 0:
+                    start = m.start('run')
+                if start < 0:
+                    start = m.start('html_base')
+                bases = [(start + k.start(), k.group())
+                         for k in self.kanji_regex.finditer(base)]
+
+            valid = True
+            for start, ch in bases:
+                stats['kanji'] += 1
+                problem = self.check_kanji(ch)
+                if problem:
+                    valid = False
+                    category, detail = problem
+                    stats[category] += 1
+                    by_text[(category, ch)] += 1
+                    yield(Finding(number, start + 1, category, ch, detail))
+
+            # (readings of non-Joyo kanji aren't our business)
+            if reading and valid and not self.is_valid_reading(base, reading):
+                stats['reading'] += 1
+                by_text[('reading', base)] += 1
+                start = bases[0][0] if bases else m.start()
+                yield(Finding(number, start + 1, 'reading', base, reading))
+
+    def lint_lines(self, lines):
+        "Generate the Finding objects for an iterable of lines (like a file)."
+        for number, line in enumerate(lines, 1):
+            yield from self.lint_line(line, number)
+
+current_linter = None
+def linter():
+    "Return the Linter over loaded_data, building it if needed."
+    global current_linter
+    if current_linter is None or current_linter.kanjis is not loaded_data.kanjis:
+        current_linter = Linter(loaded_data.kanjis, loaded_data.compound_readings)
+    return(current_linter)
+
+def lint_file(path):
+    """Lint a whole file, with the Linter over loaded_data.
+
+    Returns (path, findings, stats, by_text), with the counts for this file
+    only, all picklable, for use in worker processes; see merge_stats().
+    """
+
+    l = linter()
+    l.reset_stats()
+    with open(path, 'rt') as f:
+        findings = list(l.lint_lines(f))
+    stats, by_text = l.reset_stats()
+    return((path, findings, stats, by_text))
+
+def merge_stats(results):
+    """Add up the statistics of many lint_file() results.
+
+    Returns (stats, by_text).
+    """
+
+    stats = Counter()
+    by_text = Counter()
+    for path, findings, file_stats, file_by_text in results:
+        stats.update(file_stats)
+        by_text.update(file_by_text)
+    stats['files'] = len(results)
+    return(stats, by_text)
@@ -0,0 +1,174 @@
+# Constant-time lookups over the loaded data.
+#
+# loaded_data.kanjis is a plain list, in table order; finding something in it
+# means scanning the whole list.  Here we build hash indexes over the list,
+# once, and then answer queries with a single dictionary access.
+#
+# Module-level functions work on loaded_data; the indexes are built on first
+# use (joyodb.load() builds them right away), and rebuilt if loaded_data.kanjis
+# gets replaced.  The Index class can also be used directly over any list of
+# Kanji objects.
+
+from collections import defaultdict
+
+from joyodb import *
+
+class Index:
+    """Hash indexes over a list of Kanji objects.
+
+    >>> from joyodb.model import Kanji
+    >>> ben = Kanji('弁')
+    >>> ben.add_old_kanji('辨')
+    >>> ben.add_old_kanji('瓣')
+    >>> ben.add_reading('ベン')
+    >>> shikaru = Kanji('𠮟')
+    >>> shikaru.add_reading('しかる')
+    >>> shikaru.add_examples('𠮟る')
+    >>> i = Index([ben, shikaru, Kanji('遡')])
+
+    A kanji can be found by its character:
+
+    >>> i.kanji('弁') is ben
+    True
+
+    Or, with get(), also by old forms, by the Joyo standard character (for
+    popular alternatives), or by variation sequences:
+
+    >>> i.get('瓣') is ben
+    True
+    >>> i.get('𠮟') is shikaru
+    True
+    >>> i.get('遡\\U000E0100').kanji
+    '遡'
+    >>> i.get('漢') is None
+    True
+
+    Readings can be found with or without the okurigana dot:
+
+    >>> [str(r.kanji) for r in i.readings('しか.る')]
+    ['叱 [しか.る]']
+    >>> i.readings('しかる') == i.readings('しか.る')
+    True
+
+    """
+
+    def __init__(self, kanjis):
+        self.kanjis = kanjis
+
+        self.by_kanji = {}
+        self.by_standard_character = {}
+        self.by_old_kanji = {}
+        self.by_variant = {}
+        self.by_reading = defaultdict(list)
+
+        for k in kanjis:
+            self.by_kanji[k.kanji] = k
+
+            if k.standard_character:
+                self.by_standard_character[k.standard_character] = k
+
+            if type(k.old_kanji) is list:
+                for old in k.old_kanji:
+                    self.by_old_kanji.setdefault(old, k)
+            elif k.old_kanji:
+                self.by_old_kanji.setdefault(k.old_kanji, k)
+
+            if k.standard_variant:
+                self.by_variant[k.standard_variant] = k
+                self.by_variant[k.accepted_variant] = k
+
+            for r in k.readings:
+                self.by_reading[r.reading].append(r)
+                undotted = r.reading.replace('.', '')
+                if undotted != r.reading:
+                    self.by_reading[undotted].append(r)
+
+        # get() answers from all the indexes in one go; when the same string
+        # is in more than one, the earlier indexes in this list win.
+        self.by_any = {}
+        for index in (self.by_variant,
+                      self.by_old_kanji,
+                      self.by_standard_character,
+                      self.by_kanji):
+            self.by_any.update(index)
+
+        # Don't let readings() create entries.
+        self.by_reading = dict(self.by_reading)
+
+    def kanji(self, character):
+        "Return the Kanji whose self.kanji is character, or None."
+        return(self.by_kanji.get(character))
+
+    def get(self, string):
+        """Return the Kanji for string, or None.
+
+        string can be the kanji, its standard (MEXT) character, one of its
+        old forms, or one of its variation sequences.
+        """
+        return(self.by_any.get(string))
+
+    def get_many(self, strings):
+        """Like get(), for many strings at once; return a list.
+
+        If strings is a single string, look up each of its characters
+        (variation sequences are kept together):
+
+        >>> from joyodb.model import Kanji
+        >>> i = Index([Kanji('遡'), Kanji('漢')])
+        >>> [k and k.kanji for k in i.get_many('遡\\U000E0100字漢')]
+        ['遡', None, '漢']
+        """
+
+        if type(strings) is str:
+            strings = split_characters(strings)
+        by_any = self.by_any
+        return([by_any.get(s) for s in strings])
+
+    def readings(self, reading):
+        """Return the Reading objects for the given kana, as a list.
+
+        The reading may be given with or without okurigana dot.
+        """
+        return(self.by_reading.get(reading, []))
+
+def is_variation_selector(ch):
+    return('\ufe00' <= ch <= '\ufe0f' or '\U000e0100' <= ch <= '\U000e01ef')
+
+def split_characters(string):
+    """Split string into characters, keeping variation sequences together.
+
+    >>> split_characters('餌\\U000E0100を')
+    ['餌\\U000e0100', 'を']
+    """
+
+    characters = []
+    for ch in string:
+        if characters and is_variation_selector(ch):
+            characters[-1] += ch
+        else:
+            characters.append(ch)
+    return(characters)
+
+current_index = None
+def index():
+    "Return the Index over loaded_data.kanjis, building it if needed."
+    global current_index
+    if current_index is None or current_index.kanjis is not loaded_data.kanjis:
+        current_index = Index(loaded_data.kanjis)
+    return(current_index)
+
+def kanji(character):
+    "See Index.kanji()."
+    return(index().kanji(character))
+
+def get(string):
+    "See Index.get()."
+    return(index().get(string))
+
+def get_many(strings):
+    "See Index.get_many()."
+    return(index().get_many(strings))
+
+def readings(reading):
+    "See Index.readings()."
+    return(index().readings(reading))
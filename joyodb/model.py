@@ -2,11 +2,16 @@
 
 from collections import defaultdict
 import logging
+import sys
 logging.basicConfig(format='%(levelname)s: %(message)s')
 
-import romkan
-import regex as re
 from joyodb import *
+from joyodb import stats
+from joyodb import kana
+# Only needed once we start parsing.
+re = lazy_import('regex')
+from joyodb.images import variant_image
+from joyodb.okurigana import *
 
 class Kanji:
     """A kanji with its associated Jōyō information:
@@ -54,22 +59,40 @@ class Kanji:
           Unicode variation sequence to select the graphical variant listed as
           default (cf. self.accepted_variant).
 
-        - acceped_variant_image: If the character has variant glyphs, this is a
-          file object pointing to a reference png image of the "acceptable"
-          variant (see self.accepted_variant).
+        - accepted_variant_image: If the character has variant glyphs, this is
+          a reference png image of the "acceptable" variant (see
+          self.accepted_variant), as bytes.  The file is only read when this
+          attribute is first accessed.
 
-        - standard_variant_image: If the character has variant glyphs, this is a
-          file object pointing to a reference png image of the default variant
-          (see self.standard_variant).
+        - standard_variant_image: If the character has variant glyphs, this is
+          a reference png image of the default variant (see
+          self.standard_variant), as bytes.  The file is only read when this
+          attribute is first accessed.
 
         - joyo_documentation: This character has minor graphical variations,
           documented in the given section of the Joyo text.
 
     """
 
+    # We keep many of these in memory, so no __dict__; and the strings that
+    # repeat among objects are interned.
+    __slots__ = (
+        'kanji',
+        'standard_character',
+        'standard_variant',
+        'accepted_variant',
+        'old_kanji',
+        'readings',
+        'placename_readings',
+        'compound_readings',
+        'notes',
+        'joyo_documentation',
+    )
+
     def __init__(self, kanji):
+        kanji = sys.intern(kanji)
         if kanji in popular_alternatives.keys():
-            self.kanji = popular_alternatives[kanji]
+            self.kanji = sys.intern(popular_alternatives[kanji])
             self.standard_character = kanji
         else:
             self.kanji = kanji
@@ -77,17 +100,9 @@ class Kanji:
 
         if kanji in variants.keys():
             self.standard_variant, self.accepted_variant = variants[kanji]
-
-            codepoint = '%x' % ord(kanji)
-            file_prefix = datadir + '/variants_img/' + codepoint.lower()
-            self.standard_variant_image = open(file_prefix + '-standard.png', 'rb')
-            self.accepted_variant_image = open(file_prefix + '-accepted.png', 'rb')
-
         else:
             self.standard_variant = None
             self.accepted_variant = None
-            self.standard_variant_image = None
-            self.accepted_variant_image = None
 
         self.old_kanji = None
         self.readings = list()
@@ -96,8 +111,20 @@ class Kanji:
         self.notes = list()
         self.joyo_documentation = None
 
-        # if true, next note line should be appended to current note
-        self.pending_note = False
+    # The images are only read on demand; see joyodb.images.
+    @property
+    def standard_variant_image(self):
+        if self.standard_variant:
+            return(variant_image(self.standard_variant, 'standard'))
+        else:
+            return None
+
+    @property
+    def accepted_variant_image(self):
+        if self.accepted_variant:
+            return(variant_image(self.accepted_variant, 'accepted'))
+        else:
+            return None
 
     # prettier representations; useful when debugging
     def __str__(self):
@@ -137,12 +164,15 @@ class Kanji:
         else:
             self.old_kanji = string
 
-    def append_to_notes(self, string):
+    def append_to_notes(self, string, note_parser):
         """Intelligently add a line from the "notes" (参考) column.
 
         If the note is kanji-scoped, add it to self; otherwise call call
         Reading.append_to_notes() function for current reading.
 
+        note_parser is the parser's convert.NoteParserState, for notes split
+        among several lines.
+
         These functions also deal with notes fields split among several lines.
 
         Kanji-scoped notes can be:
@@ -166,8 +196,9 @@ class Kanji:
 
         m = re.match(r'［\p{Han}］＝許容字体，', string)
         if m:
+            stats.count('note pattern', 'kanji: accepted variant')
             self.notes.append(string)
-            self.pending_note = True
+            note_parser.pending_note = True
 
             # ignore this data; it's already availabe in
             # self.acceptable_variant.
@@ -175,9 +206,10 @@ class Kanji:
 
         m = re.match(r'＊［(（付）.*)参照］$', string)
         if m:
-            if self.pending_note:
+            stats.count('note pattern', 'kanji: documentation reference')
+            if note_parser.pending_note:
                 self.notes[-1] += m[1]
-                self.pending_note = False
+                note_parser.pending_note = False
             else:
                 self.notes.append(m[1])
             self.joyo_documentation = m[1]
@@ -187,6 +219,7 @@ class Kanji:
         # no $
         m = re.match(r'(お?)([\p{Han}・\p{Hiragana}]+)（(\p{Hiragana}+)）(.*)', string)
         if m:
+            stats.count('note pattern', 'kanji: compound or placename')
             self.notes.append(string)
             # cf. 茨城（いばらき）県
             parts = string.split('，')
@@ -207,7 +240,7 @@ class Kanji:
                 return
 
 
-        self.readings[-1].append_to_notes(string)
+        self.readings[-1].append_to_notes(string, note_parser)
 
     def add_placename_reading(self, orthography, gloss, kind):
         self.placename_readings[orthography] = gloss
@@ -216,152 +249,6 @@ class Kanji:
         self.compound_readings[orthography] = gloss
 
 
-def all_suffixes(string):
-    """Return a list of all possible suffixes, in decreasing order.
-
-    >>> all_suffixes('abcde')
-    ['abcde', 'bcde', 'cde', 'de', 'e']
-
-    >>> all_suffixes('a')
-    ['a']
-    """
-
-    suffixes = []
-    for suffix_length in range(len(string), 0, -1):
-        suffixes.append(string[-suffix_length:])
-    return(suffixes)
-
-# Used to lemmatize (de-inflect) verbs in okurigana processing.
-#
-# Luckly, no actual example uses a te-form or ta-form, so we don't need to
-# handle them.
-GODAN_INFLECTION = {
-    'う': '[わえいおう]',
-    'く': '[かけきこく]',
-    'ぐ': '[がげぎごぐ]',
-    'す': '[させしそす]',
-    'ず': '[ざぜじぞず]',
-    'つ': '[たてちとつ]',
-    'づ': '[だでぢどづ]',
-    'ぬ': '[なねにのぬ]',
-    'ふ': '[はへひほふ]',
-    'ぶ': '[ばべびぼぶ]',
-    'ぷ': '[ぱぺぴぽぷ]',
-    'む': '[まめみもむ]',
-    'る': '[られりろる]',
-}
-
-ICHIDAN_BASE_ENDING = '[えけげせぜてでねへべぺめれいきぎしじちぢにひびぴみり]'
-ICHIDAN_EXCEPTIONS = [
-    '昼',
-    '汁',
-]
-
-def is_ichidan_verb(kanji, canonical_reading):
-    """
-
-    >>> is_ichidan_verb('食', 'たべる')
-    True
-
-    >>> is_ichidan_verb('飲', 'のむ')
-    False
-
-    >>> is_ichidan_verb('干', 'ひる')
-    True
-
-    >>> is_ichidan_verb('昼', 'ひる')
-    False
-    """
-
-    if kanji in ICHIDAN_EXCEPTIONS:
-        return False
-    elif re.search(ICHIDAN_BASE_ENDING + 'る$', canonical_reading):
-        return True
-    else:
-        return False
-
-
-def delimit_okurigana(kanji, canonical_reading, example):
-    """Find where to delimit okurigana, based on the example.
-
-    >>> delimit_okurigana('頼', 'たよる', '頼る')
-    'たよ.る'
-
-    It can handle verbal inflections:
-    >>> delimit_okurigana('頼', 'たよる', '頼り')
-    'たよ.る'
-
-    >>> delimit_okurigana('初', 'そめる', '初める')
-    'そ.める'
-
-    >>> delimit_okurigana('干', 'ひる', '干物')
-    'ひ.る'
-
-    And intra-word okurigana:
-    >>> delimit_okurigana('八', 'やつ', '八つ当たり')
-    'や.つ'
-
-    And the two combined:
-    >>> delimit_okurigana('揺', 'ゆる', '揺り返し')
-    'ゆ.る'
-
-    >>> delimit_okurigana('初', 'そめる', '出初め式')
-    'そ.める'
-
-    >>> delimit_okurigana('干', 'ひる', '潮干狩り')
-    'ひ.る'
-
-
-    It ignores a trailing だ in the example, for na-adjectives:
-    >>> delimit_okurigana('静', 'しずか', '静かだ')
-    'しず.か'
-
-    It can find the kanji if it's in the middle:
-    >>> delimit_okurigana('古', 'ふるす', '使い古す')
-    'ふる.す'
-
-    It does nothing if the example isn't okurigana:
-    >>> delimit_okurigana('本', 'ほん', '本')
-    'ほん'
-
-    >>> delimit_okurigana('唇', 'くちびる', '唇')
-    'くちびる'
-
-    This is tricker, because it looks like an ichidan verb; it's
-    indistinguishable from 干=ひ.る except by explicit listing.
-
-    >>> delimit_okurigana('昼', 'ひる', '真昼')
-    'ひる'
-
-    """
-
-    if example == kanji:
-        return(canonical_reading)
-
-    for suffix in all_suffixes(canonical_reading):
-        prefix = canonical_reading[0:-len(suffix)]
-        ok_regex = kanji + suffix
-        match = re.search(ok_regex, example)
-        if match:
-            return(prefix + '.' + suffix)
-
-        if is_ichidan_verb(kanji, canonical_reading):
-            ok_regex = ok_regex[:-1] # lose the る
-            match = re.search(ok_regex, example)
-            if match:
-                return(prefix + '.' + suffix)
-
-        last = ok_regex[-1]
-        if last in GODAN_INFLECTION.keys():
-            ok_regex = re.sub('.$', GODAN_INFLECTION[last], ok_regex)
-            match = re.search(ok_regex, example)
-            if match:
-                return(prefix + '.' + suffix)
-
-        ok_regex += 'だ'
-
-    return(canonical_reading)
-
 class Reading:
     """A kanji reading.
 
@@ -409,26 +296,41 @@ class Reading:
           same sound, marked with a ⇔ on the document.
     """
 
+    # Cf. Kanji.__slots__.
+    __slots__ = (
+        'kanji',
+        'reading',
+        'uncommon',
+        'examples',
+        'kind',
+        'variation_of',
+        'notes',
+        'alternate_orthographies',
+    )
+
     def __init__(self, kanji, reading, variation_of=None, kind=None):
         self.kanji = kanji
         if reading[0] == "\u3000":
-            self.reading = reading[1:]
+            self.reading = sys.intern(reading[1:])
             self.uncommon = True
         else:
-            self.reading = reading
+            self.reading = sys.intern(reading)
             self.uncommon = False
 
         self.examples = list()
 
         if kind:
-            self.kind = kind
+            self.kind = sys.intern(kind)
         else:
             if re.match("\p{Katakana}", self.reading):
                 self.kind = 'On'
             else:
                 self.kind = 'Kun'
 
-        self.variation_of = variation_of
+        if variation_of:
+            self.variation_of = sys.intern(variation_of)
+        else:
+            self.variation_of = None
         self.notes = list()
         self.alternate_orthographies = list()
 
@@ -563,19 +465,20 @@ class Reading:
                 # normal example, without glosses
 
                 # creating Example objects also clean up part-of-speech markers
-                self.examples.append(Example(example))
+                self.examples.append(Example(example, reading=self))
 
         if self.kind == 'Kun':
             clean_reading = self.reading.replace('.', '')
 
             for example_obj in self.examples:
                 example = example_obj.example
-                new_reading = delimit_okurigana(self.kanji.kanji, clean_reading, example)
+                with stats.stage('parse: okurigana'):
+                    new_reading = delimit_okurigana(self.kanji.kanji, clean_reading, example)
 
                 if '.' in new_reading:
                     if clean_reading == self.reading:
                         # This is the first time we calculated a dotted reading.
-                        self.reading = new_reading
+                        self.reading = sys.intern(new_reading)
                     else:
                         # We already had a dotted reading calculated;
                         # let's check whether it's the same.
@@ -617,7 +520,7 @@ class Reading:
         'iya'
         """
 
-        hepburn = romkan.to_hepburn(self.reading)
+        hepburn = kana.to_romaji(self.reading)
         if self.kind == 'On':
             return(hepburn.upper())
         elif self.kind == 'Kun':
@@ -646,11 +549,11 @@ class Reading:
         """
 
         if self.kind == 'On':
-            return(romkan.to_hiragana(romkan.to_roma(self.reading)))
+            return(kana.katakana_to_hiragana(self.reading))
         else:
             return(self.reading)
 
-    def append_to_notes(self, string):
+    def append_to_notes(self, string, note_parser):
         """Intelligently add data from the "notes" column.
 
         Notes field can have two kinds of scope: per-reading, or whole-kanji.
@@ -677,6 +580,7 @@ class Reading:
 
         # test hardcoded notes first
         if string == '多く文語の「亡き」で使う。':
+            stats.count('note pattern', 'reading: hardcoded')
             self.add_examples('亡き')
             for e in self.examples:
                 if '亡き' in e.example:
@@ -685,12 +589,14 @@ class Reading:
             return
 
         if string == '「三位一体」，「従三位」は，「サン':
+            stats.count('note pattern', 'reading: hardcoded')
             self.notes.append(string)
-            self.kanji.pending_note = True
+            note_parser.pending_note = True
             return
         elif string == 'ミイッタイ」，「ジュサンミ」。':
+            stats.count('note pattern', 'reading: hardcoded')
             self.kanji.readings[-2].notes[-1] += string
-            self.kanji.pending_note = False
+            note_parser.pending_note = False
 
             self.kanji.add_reading("ミ")
             self.kanji.readings[-1].variation_of = 'イ'
@@ -698,12 +604,14 @@ class Reading:
             return
 
         if string == '「春雨」，「小雨」，「霧雨」などは，':
+            stats.count('note pattern', 'reading: hardcoded')
             self.notes.append(string)
-            self.kanji.pending_note = True
+            note_parser.pending_note = True
             return
         elif string == '「はるさめ」，「こさめ」，「きりさめ」。':
+            stats.count('note pattern', 'reading: hardcoded')
             self.notes[-1] += string
-            self.kanji.pending_note = False
+            note_parser.pending_note = False
 
             self.kanji.add_reading("さめ")
             self.kanji.readings[-1].variation_of = 'あめ'
@@ -717,6 +625,7 @@ class Reading:
 
         m = re.match(r'⇔ *(.+)', string)
         if m:
+            stats.count('note pattern', 'reading: ⇔ alternate orthography')
             self.notes.append(string)
             assert(re.match('[\p{Han}\p{Hiragana}，]+', m[1]))
             self.alternate_orthographies = m[1].split('，')
@@ -726,19 +635,22 @@ class Reading:
 
         m = re.match(r'(「.*」，?)+(など)?は，', string)
         if m:
+            stats.count('note pattern', 'reading: 「」は， exception')
             self.notes.append(string)
             if not re.search('。$', string):
-                self.kanji.pending_note = True
+                note_parser.pending_note = True
             return
 
         m = re.match(r'(「(.*)」，?)+などと使う。$', string)
         if m:
+            stats.count('note pattern', 'reading: などと使う usage')
             self.notes.append(string)
             return
 
-        if self.kanji.pending_note == True:
+        if note_parser.pending_note == True:
             m = re.search('。$', string)
             if m:
+                stats.count('note pattern', 'reading: continuation')
 
                 # previous half of note could have been in this reading...
                 if self.notes:
@@ -749,26 +661,30 @@ class Reading:
                 else:
                     raise(ValueError("BUG: can't find where to attach half-note."))
 
-                self.kanji.pending_note = False
+                note_parser.pending_note = False
                 return
 
         m = re.match(r'(「[\p{Han}\p{Hiragana}\p{Katakana}]+」,?)+とも(書く)?。', string)
         if m:
+            stats.count('note pattern', 'reading: とも alternative')
             self.notes.append(string)
             return
 
         m = re.match(r'「(\p{Han})」.*転用。', string)
         if m:
+            stats.count('note pattern', 'reading: 転用 diverted use')
             self.notes.append(string)
             return
 
         m = re.match(r'「(.*)」.*の意。', string)
         if m:
+            stats.count('note pattern', 'reading: の意 meaning')
             self.notes.append(string)
             return
 
         m = re.search(r'」になる。$', string)
         if m:
+            stats.count('note pattern', 'reading: になる')
             self.notes.append(string)
             return
 
@@ -785,7 +701,15 @@ class Reading:
         return(s)
 
 class Example:
-    def __init__(self, example):
+    # Cf. Kanji.__slots__.
+    __slots__ = (
+        'example',
+        'pos',
+        'literary',
+        'reading',
+    )
+
+    def __init__(self, example, reading=None):
         """Model for each item in a list of examples (例 column).
 
          - self.reading: The parent Reading object.
@@ -808,7 +732,9 @@ class Example:
         else:
             self.example = example
             self.pos = None
+        self.example = sys.intern(self.example)
         self.literary = False
+        self.reading = reading
 
     def __str__(self):
         return self.example
@@ -0,0 +1,285 @@
+# Okurigana delimitation.
+#
+# The Joyo table lists kun-readings as plain kana, without marking where the
+# kanji stem ends and the okurigana begins (as in たよる for 頼る).  We find the
+# boundary by matching the reading against the example words: if 頼る is an
+# example, the reading must be たよ.る.
+#
+# For each (kanji, reading) pair, OkuriganaMatcher precomputes, once, every
+# string that may follow the kanji in an example, in order of preference.
+# Delimiting an example is then just a few string comparisons.  Matchers are
+# cached, so that delimit_okurigana() can be called for many examples (or
+# dictionary entries) of the same reading cheaply.
+
+from functools import lru_cache
+
+from joyodb import lazy_import
+re = lazy_import('regex')
+
+def all_suffixes(string):
+    """Return a list of all possible suffixes, in decreasing order.
+
+    >>> all_suffixes('abcde')
+    ['abcde', 'bcde', 'cde', 'de', 'e']
+
+    >>> all_suffixes('a')
+    ['a']
+    """
+
+    suffixes = []
+    for suffix_length in range(len(string), 0, -1):
+        suffixes.append(string[-suffix_length:])
+    return(suffixes)
+
+# Used to lemmatize (de-inflect) verbs in okurigana processing.
+#
+# Luckly, no actual example uses a te-form or ta-form, so we don't need to
+# handle them.
+GODAN_INFLECTION = {
+    'う': '[わえいおう]',
+    'く': '[かけきこく]',
+    'ぐ': '[がげぎごぐ]',
+    'す': '[させしそす]',
+    'ず': '[ざぜじぞず]',
+    'つ': '[たてちとつ]',
+    'づ': '[だでぢどづ]',
+    'ぬ': '[なねにのぬ]',
+    'ふ': '[はへひほふ]',
+    'ぶ': '[ばべびぼぶ]',
+    'ぷ': '[ぱぺぴぽぷ]',
+    'む': '[まめみもむ]',
+    'る': '[られりろる]',
+}
+
+ICHIDAN_BASE_ENDING = '[えけげせぜてでねへべぺめれいきぎしじちぢにひびぴみり]'
+ICHIDAN_EXCEPTIONS = [
+    '昼',
+    '汁',
+]
+
+def is_ichidan_verb(kanji, canonical_reading):
+    """
+
+    >>> is_ichidan_verb('食', 'たべる')
+    True
+
+    >>> is_ichidan_verb('飲', 'のむ')
+    False
+
+    >>> is_ichidan_verb('干', 'ひる')
+    True
+
+    >>> is_ichidan_verb('昼', 'ひる')
+    False
+    """
+
+    if kanji in ICHIDAN_EXCEPTIONS:
+        return False
+    elif re.search(ICHIDAN_BASE_ENDING + 'る$', canonical_reading):
+        return True
+    else:
+        return False
+
+class OkuriganaMatcher:
+    """Delimits okurigana of a given kanji reading, for any example.
+
+    >>> m = OkuriganaMatcher('頼', 'たよる')
+    >>> m.delimit('頼る')
+    'たよ.る'
+    >>> m.delimit('頼り')
+    'たよ.る'
+    >>> m.delimit('信頼')
+    'たよる'
+
+    Internally, we keep a list of candidates (in order of preference) for the
+    text following the kanji in the example, each with the reading to return
+    when it matches.  A candidate is a literal string, plus optionally a set of
+    characters allowed right after it (for inflected godan verbs):
+
+    >>> m.candidates[-3:]
+    [('る', None, 'たよ.る'), ('', 'られりろる', 'たよ.る'), ('', None, 'たよる')]
+
+    The last candidate always delimits nothing.
+    """
+
+    def __init__(self, kanji, canonical_reading):
+        self.kanji = kanji
+        self.canonical_reading = canonical_reading
+        self.candidates = []
+
+        ichidan = is_ichidan_verb(kanji, canonical_reading)
+
+        # Longest suffixes first, i.e. the shortest possible stem.
+        for suffix in all_suffixes(canonical_reading):
+            prefix = canonical_reading[0:-len(suffix)]
+            delimited = prefix + '.' + suffix
+
+            # The example has the reading's suffix verbatim: 頼る
+            tail = suffix
+            self.candidates.append((tail, None, delimited))
+
+            # Ichidan verbs drop the final る when inflected: 初め
+            if ichidan:
+                tail = tail[:-1]
+                self.candidates.append((tail, None, delimited))
+
+            # Godan verbs inflect the final kana: 頼り
+            if tail and tail[-1] in GODAN_INFLECTION.keys():
+                self.candidates.append((tail[:-1],
+                                        GODAN_INFLECTION[tail[-1]][1:-1],
+                                        delimited))
+
+        self.candidates.append(('', None, canonical_reading))
+
+    def delimit(self, example):
+        """Return the reading, okurigana-delimited according to example.
+
+        If the example doesn't show okurigana for this kanji, return the
+        reading unchanged.
+        """
+
+        if example == self.kanji:
+            return(self.canonical_reading)
+
+        # What follows each occurrence of the kanji in the example (usually
+        # there's only one).
+        afters = []
+        start = example.find(self.kanji)
+        while start >= 0:
+            afters.append(example[start + len(self.kanji):])
+            start = example.find(self.kanji, start + 1)
+
+        if not afters:
+            return(self.canonical_reading)
+
+        for tail, charset, delimited in self.candidates:
+            for after in afters:
+                if after.startswith(tail):
+                    if not charset:
+                        return(delimited)
+                    elif len(after) > len(tail) and after[len(tail)] in charset:
+                        return(delimited)
+
+        return(self.canonical_reading)
+
+# For inflections(): what may follow the stem of an ichidan verb (食べない,
+# 食べます, 食べた, 食べて, 食べよう, 食べろ, 食べられる, 食べさせる, 食べれば),
+# and of an i-adjective (高く, 高かった, 高ければ, 高さ, 高そう, 高み).
+ICHIDAN_FOLLOWERS = 'なまたてよろられさ'
+ADJECTIVE_FOLLOWERS = 'くかけさそみ'
+
+# The te- and ta-forms of godan verbs (書いた, 読んだ...), which OkuriganaMatcher
+# doesn't need: what replaces the final kana, before た/て (or だ/で).
+GODAN_TE_FORM = {
+    'う': 'っ',
+    'く': 'い',
+    'ぐ': 'い',
+    'す': 'し',
+    'つ': 'っ',
+    'ぬ': 'ん',
+    'ぶ': 'ん',
+    'む': 'ん',
+    'る': 'っ',
+}
+
+# Inflections that don't follow the rules, by (kanji, delimited reading): more
+# (tail, charset, stem) for inflections().
+IRREGULAR_INFLECTION = {
+    ('来', 'く.る'): [('', 'まただて', 'き'), ('', 'なよさら', 'こ')],
+    ('行', 'い.く'): [('っ', 'たて', 'い')],
+    ('行', 'ゆ.く'): [('っ', 'たて', 'ゆ')],
+}
+
+def inflections(kanji, delimited_reading):
+    """What may follow the kanji of a kun-reading in running text.
+
+    Returns a list of (tail, charset, stem), as OkuriganaMatcher.candidates:
+    the kanji is followed by tail, and then by one of the characters in
+    charset (unless it's None); and it reads as stem.  The reading is
+    okurigana-delimited, in hiragana.
+
+    >>> inflections('行', 'い.く')
+    [('く', None, 'い'), ('', 'かけきこく', 'い'), ('い', 'たてだで', 'い'), ('っ', 'たて', 'い')]
+    >>> inflections('高', 'たか.い')
+    [('い', None, 'たか'), ('', 'くかけさそみ', 'たか')]
+    >>> inflections('食', 'た.べる')[:2]
+    [('べる', None, 'た'), ('べ', None, 'た')]
+    """
+
+    stem, ending = delimited_reading.split('.', 1)
+    found = [(ending, None, stem)]
+    rest, last = ending[:-1], ending[-1:]
+
+    # (as in OkuriganaMatcher, but with nothing but the kanji before them)
+    if is_ichidan_verb(kanji, stem + ending):
+        found.append((rest, None if rest else ICHIDAN_FOLLOWERS, stem))
+    if last in GODAN_INFLECTION:
+        found.append((rest, GODAN_INFLECTION[last][1:-1], stem))
+        if last in GODAN_TE_FORM:
+            found.append((rest + GODAN_TE_FORM[last], 'たてだで', stem))
+    elif last == 'い':
+        found.append((rest, ADJECTIVE_FOLLOWERS, stem))
+
+    found += IRREGULAR_INFLECTION.get((kanji, delimited_reading), [])
+    return(found)
+
+@lru_cache(maxsize=8192)
+def okurigana_matcher(kanji, canonical_reading):
+    "Return a (cached) OkuriganaMatcher for the kanji reading."
+    return(OkuriganaMatcher(kanji, canonical_reading))
+
+def delimit_okurigana(kanji, canonical_reading, example):
+    """Find where to delimit okurigana, based on the example.
+
+    >>> delimit_okurigana('頼', 'たよる', '頼る')
+    'たよ.る'
+
+    It can handle verbal inflections:
+    >>> delimit_okurigana('頼', 'たよる', '頼り')
+    'たよ.る'
+
+    >>> delimit_okurigana('初', 'そめる', '初める')
+    'そ.める'
+
+    >>> delimit_okurigana('干', 'ひる', '干物')
+    'ひ.る'
+
+    And intra-word okurigana:
+    >>> delimit_okurigana('八', 'やつ', '八つ当たり')
+    'や.つ'
+
+    And the two combined:
+    >>> delimit_okurigana('揺', 'ゆる', '揺り返し')
+    'ゆ.る'
+
+    >>> delimit_okurigana('初', 'そめる', '出初め式')
+    'そ.める'
+
+    >>> delimit_okurigana('干', 'ひる', '潮干狩り')
+    'ひ.る'
+
+
+    It ignores a trailing だ in the example, for na-adjectives:
+    >>> delimit_okurigana('静', 'しずか', '静かだ')
+    'しず.か'
+
+    It can find the kanji if it's in the middle:
+    >>> delimit_okurigana('古', 'ふるす', '使い古す')
+    'ふる.す'
+
+    It does nothing if the example isn't okurigana:
+    >>> delimit_okurigana('本', 'ほん', '本')
+    'ほん'
+
+    >>> delimit_okurigana('唇', 'くちびる', '唇')
+    'くちびる'
+
+    This is tricker, because it looks like an ichidan verb; it's
+    indistinguishable from 干=ひ.る except by explicit listing.
+
+    >>> delimit_okurigana('昼', 'ひる', '真昼')
+    'ひる'
+
+    """
+
+    return(okurigana_matcher(kanji, canonical_reading).delimit(example))
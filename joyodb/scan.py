@@ -0,0 +1,243 @@
+# Finding Joyo vocabulary in running text.
+#
+# We want every occurrence of the words listed in the Joyo table – appendix
+# compounds, compounds and placenames from the notes, and example words – in
+# texts of arbitrary size.  Testing each word separately is hopeless, so we
+# build an Aho-Corasick automaton over all of them, once, and then scan the
+# text a single time, character by character.
+#
+# The Scanner class works over any mapping from words to lists of "entries"
+# (whatever data we want to get back for each word).  scanner() returns a
+# Scanner built from loaded_data, whose entries are Entry tuples pointing back
+# to the Kanji and Example objects.
+
+from collections import defaultdict, namedtuple
+
+from joyodb import *
+
+# An occurrence of a word in the text.
+#  - start, end: offsets of the word in the text (as in text[start:end]); for
+#    streams, offsets are counted from the start of the stream.
+#  - word: the word found.
+#  - entries: the entries for the word (see Scanner).
+Match = namedtuple('Match', 'start end word entries')
+
+# A word from the Joyo data.
+#  - kind: 'appendix' (loaded_data.compound_readings), 'compound'
+#    (Kanji.compound_readings), 'placename' (Kanji.placename_readings) or
+#    'example' (Example.example).
+#  - owner: the Kanji object for compounds and placenames; the Example object
+#    for examples (and from there, Example.reading and Example.reading.kanji);
+#    None for the appendix.
+#  - gloss: the reading of the word in kana; None for examples.
+Entry = namedtuple('Entry', 'kind owner gloss')
+
+# Larger than any offset.
+NO_START = float('inf')
+
+class Scanner:
+    """An Aho-Corasick automaton for a set of words.
+
+    Words is a dictionary mapping each word to a list of entries, which will
+    be returned in Match objects.
+
+    >>> s = Scanner({'he': ['HE'], 'she': ['SHE'], 'hers': ['HERS'],
+    ...              'his': ['HIS']})
+    >>> [(m.start, m.word) for m in s.scan('ushers', longest=False)]
+    [(1, 'she'), (2, 'he'), (2, 'hers')]
+
+    By default, we return leftmost-longest matches: at each position, the
+    longest word starting there, then continue after it.
+
+    >>> [(m.start, m.word, m.entries) for m in s.scan('ushers his')]
+    [(1, 'she', ['SHE']), (7, 'his', ['HIS'])]
+
+    """
+
+    def __init__(self, words):
+        self.words = []
+        self.entries = []
+
+        # The automaton.  States are numbered, 0 being the root.  For each
+        # state we have:
+        #  - goto: a dictionary from characters to next states.
+        #  - fail: the state to fall back to when there's no goto.
+        #  - out: ids of the words that end on this state (including those
+        #    reachable through fail links).
+        #  - depth: length of the prefix that leads to this state.
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        self.depth = [0]
+
+        for word, entries in words.items():
+            if not word:
+                continue
+            word_id = len(self.words)
+            self.words.append(word)
+            self.entries.append(entries)
+
+            state = 0
+            for ch in word:
+                next_state = self.goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][ch] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                    self.depth.append(self.depth[state] + 1)
+                state = next_state
+            self.out[state] += (word_id,)
+
+        self.max_length = max([len(w) for w in self.words], default=0)
+
+        # Breadth-first, so that fail links always point to states already
+        # processed.
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(ch, 0)
+                self.out[next_state] += self.out[self.fail[next_state]]
+
+    def scan(self, text, longest=True):
+        """Return an iterator over the matches in text.
+
+        If longest is true, only return leftmost-longest matches (no
+        overlaps); otherwise return all matches, ordered by their ends.
+        """
+        return(self.scan_stream([text], longest=longest))
+
+    def scan_stream(self, source, longest=True, blocksize=1024*1024):
+        """Like scan(), for a text file object or an iterable of strings.
+
+        Words spanning chunk boundaries are found; offsets are counted from the
+        start of the stream.
+
+        >>> s = Scanner({'雨雲': [1], '雨': [2], '雲': [3]})
+        >>> [(m.start, m.word) for m in s.scan_stream(['雨', '雲と雨', '雲'])]
+        [(0, '雨雲'), (3, '雨雲')]
+        """
+
+        if hasattr(source, 'read'):
+            chunks = iter(lambda: source.read(blocksize), '')
+        else:
+            chunks = source
+
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+        depth = self.depth
+        words = self.words
+        entries = self.entries
+        root = goto[0]
+
+        lengths = [len(w) for w in words]
+
+        # For leftmost-longest matching: start offset -> (end, word id) of the
+        # longest match starting there.  Matches come ordered by their ends,
+        # so the latest one for each start is the longest.
+        longest_at = {}
+        # the smallest key in longest_at
+        first_start = NO_START
+        last_end = 0
+
+        state = 0
+        # end offset of the current character
+        end = 0
+        for chunk in chunks:
+            for ch in chunk:
+                end += 1
+                if state:
+                    next_state = goto[state].get(ch)
+                    while next_state is None:
+                        state = fail[state]
+                        if state:
+                            next_state = goto[state].get(ch)
+                        else:
+                            next_state = root.get(ch, 0)
+                    state = next_state
+                elif ch in root:
+                    state = root[ch]
+                elif first_start == NO_START:
+                    continue
+
+                ids = out[state]
+                if not longest:
+                    for word_id in ids:
+                        word = words[word_id]
+                        yield(Match(end - len(word), end, word, entries[word_id]))
+                    continue
+
+                for word_id in ids:
+                    start = end - lengths[word_id]
+                    longest_at[start] = (end, word_id)
+                    if start < first_start:
+                        first_start = start
+
+                # Future matches will all start within the prefix that got us
+                # to this state; anything starting before that is decided.
+                horizon = end - depth[state]
+                if first_start < horizon:
+                    for start in sorted(longest_at):
+                        if start >= horizon:
+                            break
+                        match_end, word_id = longest_at.pop(start)
+                        if start >= last_end:
+                            last_end = match_end
+                            yield(Match(start, match_end, words[word_id],
+                                        entries[word_id]))
+                    first_start = min(longest_at, default=NO_START)
+
+        for start in sorted(longest_at):
+            match_end, word_id = longest_at[start]
+            if start >= last_end:
+                last_end = match_end
+                yield(Match(start, match_end, words[word_id], entries[word_id]))
+
+def joyo_words(kanjis, compound_readings):
+    """Map each word in the Joyo data to a list of Entry objects.
+
+    See the definition of Entry for the kinds of words.
+    """
+
+    words = defaultdict(list)
+
+    for gloss, orthographies in compound_readings.items():
+        for orthography in orthographies:
+            words[orthography].append(Entry('appendix', None, gloss))
+
+    for k in kanjis:
+        for orthography, gloss in k.compound_readings.items():
+            words[orthography].append(Entry('compound', k, gloss))
+        for orthography, gloss in k.placename_readings.items():
+            words[orthography].append(Entry('placename', k, gloss))
+        for r in k.readings:
+            for e in r.examples:
+                words[e.example].append(Entry('example', e, None))
+
+    return(words)
+
+current_scanner = None
+current_scanner_kanjis = None
+def scanner():
+    "Return the Scanner over loaded_data, building it if needed."
+    global current_scanner, current_scanner_kanjis
+    if current_scanner is None or current_scanner_kanjis is not loaded_data.kanjis:
+        current_scanner = Scanner(joyo_words(loaded_data.kanjis,
+                                             loaded_data.compound_readings))
+        current_scanner_kanjis = loaded_data.kanjis
+    return(current_scanner)
+
+def scan(text, longest=True):
+    "See Scanner.scan()."
+    return(scanner().scan(text, longest=longest))
+
+def scan_stream(source, longest=True):
+    "See Scanner.scan_stream()."
+    return(scanner().scan_stream(source, longest=longest))
@@ -0,0 +1,348 @@
+# A lookup server, so that many local processes can share one copy of the data.
+#
+# The server loads the Joyo data once, and listens on a TCP port (on localhost,
+# by default) or a Unix socket.  The protocol is one JSON object per line, both
+# ways.  A request is:
+#
+#   {"id": 1, "op": "kanji", "query": "國"}
+#
+# and its response:
+#
+#   {"id": 1, "result": [...]}     or     {"id": 1, "error": "..."}
+#
+# id is optional, and copied as is to the response.  Responses come in the
+# order of the requests on each connection, so a client may send many requests
+# before reading the responses.  The operations are:
+#
+#   - kanji: the Kanji for each character of query (old forms, variation
+#     sequences etc. included; see lookup.get()), as in the JSON export, or
+#     null for characters not in the table.
+#   - reading: the readings read as query, in hiragana or katakana, with or
+#     without okurigana dot (see kanaindex.exact()).
+#   - example: what the table says about the word query: appendix words,
+#     compounds, placenames and examples (see scan.joyo_words()).
+#   - annotate: query with furigana, as a list of [text, reading] pairs (see
+#     furigana.annotate()).
+#
+# Requests aren't answered one at a time: they're queued, and every
+# BATCH_WINDOW seconds (or as soon as MAX_BATCH are waiting), the queue is
+# answered in batches, one per operation, over the distinct queries.  Lookups
+# take microseconds, so under load this spends less time in the event loop
+# than in the lookups themselves.
+#
+# See joyodb/client.py for a client, and bin/serve_joyodb to run a server.
+
+import asyncio
+from collections import Counter
+import json
+import os
+import stat
+
+from joyodb import *
+from joyodb import furigana, kanaindex, lookup
+from joyodb.convert import kanji_to_dict
+from joyodb.scan import joyo_words
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 2136
+
+# How long a request may wait for others to batch with, in seconds.
+BATCH_WINDOW = 0.002
+
+# Answer right away once this many requests are waiting.
+MAX_BATCH = 256
+
+# Longest request line, in bytes.
+MAX_LINE = 1 << 20
+
+class Lookups:
+    """The operations of the protocol, over a list of Kanji and the appendix.
+
+    Each method takes a list of distinct queries, and returns a list of
+    results (plain JSON types), in the same order.
+
+    >>> from joyodb.model import Kanji
+    >>> koku = Kanji('国')
+    >>> koku.add_old_kanji('國')
+    >>> koku.add_reading('コク')
+    >>> koku.add_examples('国語')
+    >>> koku.add_reading('くに')
+    >>> koku.add_examples('国')
+    >>> l = Lookups([koku], {})
+    >>> [[k and k['kanji'] for k in result] for result in l.kanji(['國', '国と'])]
+    [['国'], ['国', None]]
+    >>> l.reading(['こく'])
+    [[{'kanji': '国', 'reading': 'コク', 'kind': 'On', 'uncommon': False, 'variation_of': None}]]
+    >>> l.example(['国語'])
+    [[{'kind': 'example', 'kanji': '国', 'reading': 'コク', 'gloss': None}]]
+    >>> l.annotate(['国語'])
+    [[['国', 'こく'], ['語', None]]]
+    """
+
+    def __init__(self, kanjis, compound_readings):
+        self.kanjis = kanjis
+        self.index = lookup.Index(kanjis)
+        self.kana_index = kanaindex.KanaIndex(kanjis)
+        self.annotator = furigana.Annotator(kanjis, compound_readings)
+        self.words = joyo_words(kanjis, compound_readings)
+
+        # Kanji character -> kanji_to_dict(), as needed.
+        self.kanji_dicts = {}
+
+    def kanji_dict(self, k):
+        if k is None:
+            return(None)
+        d = self.kanji_dicts.get(k.kanji)
+        if d is None:
+            d = self.kanji_dicts[k.kanji] = kanji_to_dict(k)
+        return(d)
+
+    def kanji(self, queries):
+        # one get_many() over all characters of all queries
+        characters = []
+        for query in queries:
+            characters.append(lookup.split_characters(query))
+        found = iter(self.index.get_many([c for chars in characters for c in chars]))
+        return([[self.kanji_dict(next(found)) for c in chars] for chars in characters])
+
+    def reading(self, queries):
+        index = self.kana_index
+        return([[{'kanji': r.kanji.kanji,
+                  'reading': r.reading,
+                  'kind': r.kind,
+                  'uncommon': r.uncommon,
+                  'variation_of': r.variation_of}
+                 for r in index.exact(query)]
+                for query in queries])
+
+    def example(self, queries):
+        results = []
+        for query in queries:
+            entries = []
+            for e in self.words.get(query, []):
+                if e.kind == 'example':
+                    entries.append({'kind': e.kind,
+                                    'kanji': e.owner.reading.kanji.kanji,
+                                    'reading': e.owner.reading.reading,
+                                    'gloss': None})
+                else:
+                    entries.append({'kind': e.kind,
+                                    'kanji': e.owner and e.owner.kanji,
+                                    'reading': None,
+                                    'gloss': e.gloss})
+            results.append(entries)
+        return(results)
+
+    def annotate(self, queries):
+        a = self.annotator
+        return([[list(span) for span in a.annotate(query)] for query in queries])
+
+OPERATIONS = ('kanji', 'reading', 'example', 'annotate')
+
+def parse_request(line):
+    """Return (id, op, query) from a request line; raise ValueError if invalid.
+
+    >>> parse_request(b'{"id": 7, "op": "kanji", "query": "\\\\u570b"}')
+    (7, 'kanji', '國')
+    >>> parse_request(b'{"op": "define", "query": "x"}')
+    Traceback (most recent call last):
+      ...
+    ValueError: unknown op: 'define'
+    """
+
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        raise(ValueError("invalid JSON: %s" % e))
+    if type(request) is not dict:
+        raise(ValueError("request must be a JSON object"))
+    op = request.get('op')
+    query = request.get('query')
+    if op not in OPERATIONS:
+        raise(ValueError("unknown op: %r" % op))
+    if type(query) is not str:
+        raise(ValueError("query must be a string"))
+    return((request.get('id'), op, query))
+
+def request_id(line):
+    "The id of a request line, if we can make it out, or None."
+    try:
+        request = json.loads(line)
+    except ValueError:
+        return(None)
+    if type(request) is dict:
+        return(request.get('id'))
+    return(None)
+
+def response_line(id, result=None, error=None):
+    if error is not None:
+        response = {'id': id, 'error': error}
+    else:
+        response = {'id': id, 'result': result}
+    return(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+
+class Server:
+    """An asyncio lookup server over loaded_data; see above.
+
+    stats counts connections, requests, batches, and distinct queries
+    looked up.
+    """
+
+    def __init__(self, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self.lookups = None
+        self.server = None
+
+        # (op, query, future) waiting for the next flush()
+        self.pending = []
+        self.flush_handle = None
+
+        # task of handle() -> its writer, for each open connection
+        self.connections = {}
+
+        self.stats = Counter()
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        """Start listening on host and port, or on the Unix socket at path.
+
+        Port 0 picks a free port; see addresses().
+        """
+
+        if self.lookups is None or self.lookups.kanjis is not loaded_data.kanjis:
+            self.lookups = Lookups(loaded_data.kanjis, loaded_data.compound_readings)
+        if path:
+            # (a socket left over from an earlier run; but never anything else)
+            if os.path.exists(path):
+                if not stat.S_ISSOCK(os.stat(path).st_mode):
+                    raise(FileExistsError("%s exists, and is not a socket" % path))
+                os.unlink(path)
+            self.server = await asyncio.start_unix_server(self.handle, path,
+                                                          limit=MAX_LINE)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port,
+                                                     limit=MAX_LINE)
+        return(self.server)
+
+    def addresses(self):
+        "The addresses we're listening on."
+        return([s.getsockname() for s in self.server.sockets])
+
+    async def serve_forever(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        await self.start(host, port, path)
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        "Stop listening, and close the open connections."
+        self.server.close()
+        for writer in self.connections.values():
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        await self.server.wait_closed()
+
+    def submit(self, op, query):
+        "Queue a lookup; return a future for its result."
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((op, query, future))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.window, self.flush)
+        return(future)
+
+    def flush(self):
+        "Answer all pending requests."
+
+        if self.flush_handle:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        pending = self.pending
+        self.pending = []
+        if not pending:
+            return
+        self.stats['batches'] += 1
+
+        # op -> query -> futures
+        by_op = {}
+        for op, query, future in pending:
+            by_op.setdefault(op, {}).setdefault(query, []).append(future)
+
+        for op, by_query in by_op.items():
+            queries = list(by_query.keys())
+            self.stats['lookups'] += len(queries)
+            try:
+                results = getattr(self.lookups, op)(queries)
+            except Exception as e:
+                results = None
+                error = e
+            for i, query in enumerate(queries):
+                for future in by_query[query]:
+                    if future.done():
+                        continue # (the connection went away)
+                    if results is None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(results[i])
+
+    async def handle(self, reader, writer):
+        "Serve one connection."
+
+        self.stats['connections'] += 1
+        task = asyncio.current_task()
+        self.connections[task] = writer
+
+        # Futures of the responses, in request order, for write_responses().
+        responses = asyncio.Queue()
+        writing = asyncio.ensure_future(self.write_responses(responses, writer))
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # (too long; we can't tell where the next request starts)
+                    await responses.put(response_line(None, error="request too long"))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                self.stats['requests'] += 1
+                try:
+                    id, op, query = parse_request(line)
+                except ValueError as e:
+                    await responses.put(response_line(request_id(line), error=str(e)))
+                    continue
+                await responses.put((id, self.submit(op, query)))
+        except ConnectionError:
+            pass
+        finally:
+            await responses.put(None)
+            await writing
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+            del self.connections[task]
+
+    async def write_responses(self, responses, writer):
+        while True:
+            response = await responses.get()
+            if response is None:
+                break
+            if type(response) is bytes:
+                line = response
+            else:
+                id, future = response
+                try:
+                    line = response_line(id, await future)
+                except Exception as e:
+                    line = response_line(id, error="%s: %s" % (type(e).__name__, e))
+            try:
+                writer.write(line)
+                if responses.empty():
+                    await writer.drain()
+            except ConnectionError:
+                pass
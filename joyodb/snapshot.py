@@ -0,0 +1,117 @@
+# On-disk snapshots of the parsed Joyo data.
+#
+# Parsing the Joyo .txt file runs dozens of regular expressions over every line
+# of the table, which is wasteful when all we want are the resulting objects.
+# So after a successful parse, we pickle the contents of loaded_data into
+# cachedir.  The snapshot filename includes a hash of everything the parse
+# depends on: the Joyo text, the bundled data files, and the parser code
+# itself.  If any of these change, the hash changes, and the next load() will
+# parse the table again (and delete the stale snapshot).
+
+import glob
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+import joyodb
+from joyodb import *
+
+# Bump this if the snapshot format changes in a way that the hashed files don't
+# capture (e.g. a new version of Python's pickle).
+SNAPSHOT_VERSION = 1
+
+# The fields of loaded_data that get saved.  Readings and examples are
+# reachable from the Kanji objects, so they come along.
+SNAPSHOT_FIELDS = ('kanjis', 'compound_readings')
+
+def snapshot_key():
+    """Hash of the inputs to the parser, as an hexadecimal string.
+
+    Covers the Joyo text, every data/*.tsv file, and the source code of the
+    joyodb package.
+    """
+
+    h = hashlib.sha256()
+    h.update(b'%d' % SNAPSHOT_VERSION)
+
+    moduledir = os.path.dirname(os.path.realpath(__file__))
+    files = ([JOYOHYO_TXT]
+             + sorted(glob.glob(datadir + '/*.tsv'))
+             + sorted(glob.glob(moduledir + '/*.py')))
+    for path in files:
+        # Include the name, so that renaming a file also invalidates.
+        h.update(os.path.basename(path).encode('utf-8') + b'\0')
+        with open(path, 'rb') as f:
+            h.update(f.read())
+        h.update(b'\0')
+
+    return(h.hexdigest())
+
+def snapshot_path(key=None):
+    "Full path of the snapshot file for given key (default: current one)."
+    if not key:
+        key = snapshot_key()
+    return(cachedir + '/snapshot-%s.pickle' % key[:32])
+
+def load(rebuild=False):
+    """Fill loaded_data, from snapshot if possible, parsing otherwise.
+
+    If rebuild is true, always parse the Joyo text and overwrite the snapshot.
+    Returns loaded_data.
+    """
+
+    import joyodb.lookup
+
+    path = snapshot_path()
+    if rebuild or not load_snapshot(path):
+        import joyodb.convert
+        joyodb.convert.parse()
+        save_snapshot(path)
+
+    joyodb.lookup.index()
+    return(loaded_data)
+
+def load_snapshot(path):
+    """Restore loaded_data from the snapshot file in path.
+
+    Returns True on success, False if there's no usable snapshot.
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        # A corrupted or incompatible snapshot is not fatal; we just parse
+        # again and overwrite it.
+        logging.warning("Ignoring unreadable snapshot %s: %s" % (path, e))
+        return False
+
+    for field in SNAPSHOT_FIELDS:
+        setattr(loaded_data, field, data[field])
+    return True
+
+def save_snapshot(path):
+    """Save loaded_data into the snapshot file in path.
+
+    The file is written atomically, and snapshots for other keys are removed.
+    """
+
+    data = {field: getattr(loaded_data, field) for field in SNAPSHOT_FIELDS}
+
+    os.makedirs(cachedir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cachedir, prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+    for stale in glob.glob(cachedir + '/snapshot-*.pickle'):
+        if stale != path:
+            os.unlink(stale)
@@ -0,0 +1,167 @@
+# Instrumentation for the parser and the converters.
+#
+# To find out where a conversion spends its time, the code is sprinkled with
+# stage() timers (wall-clock and CPU time) and count() counters: which row
+# shapes main_table_row_fields() saw, which note patterns append_to_notes()
+# matched, and so on.  All of it is off by default, and costs next to nothing
+# then; enable() turns it on, optionally counting calls to the regex module
+# too, and report() formats the results.  See bin/convert_joyodb --profile.
+
+from collections import Counter
+from contextlib import nullcontext
+import importlib
+import sys
+import time
+
+enabled = False
+
+# (group, name) -> count
+counters = Counter()
+
+# stage name -> [calls, wall-clock seconds, CPU seconds]
+timers = {}
+
+# Modules whose regex calls are counted: module name -> {attribute: the
+# original module}, to restore in disable().
+regex_patched = {}
+
+def enable(count_regex=False, modules=('joyodb.convert', 'joyodb.model',
+                                       'joyodb.okurigana')):
+    """Start collecting statistics.
+
+    If count_regex is true, also count the calls that the given modules make to
+    the functions of the regex module (compiled patterns are passed to these
+    too, as in re.match(kanji_regexp, field)).
+    """
+
+    global enabled
+    enabled = True
+    if count_regex:
+        for name in modules:
+            if name not in regex_patched:
+                patch_regex(importlib.import_module(name))
+
+def disable():
+    "Stop collecting statistics, and undo any regex patching."
+    global enabled
+    enabled = False
+    for name, originals in list(regex_patched.items()):
+        module = sys.modules[name]
+        for attribute, value in originals.items():
+            setattr(module, attribute, value)
+        del regex_patched[name]
+
+def reset():
+    "Forget all statistics collected so far."
+    counters.clear()
+    timers.clear()
+
+def count(group, name, n=1):
+    """Add n to the counter for name, in group.
+
+    >>> reset(); enable()
+    >>> count('row shape', '2.a'); count('row shape', '2.a')
+    >>> counters[('row shape', '2.a')]
+    2
+    >>> disable()
+    >>> count('row shape', '2.a')
+    >>> counters[('row shape', '2.a')]
+    2
+    """
+    if enabled:
+        counters[(group, name)] += n
+
+class Stage:
+    "Context manager for stage(); adds its time to timers[name] on exit."
+
+    def __init__(self, name):
+        # (created on entry, so that outer stages are listed first)
+        self.timer = timers.setdefault(name, [0, 0.0, 0.0])
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def __exit__(self, *exc_info):
+        self.timer[0] += 1
+        self.timer[1] += time.perf_counter() - self.wall
+        self.timer[2] += time.process_time() - self.cpu
+
+# Returned by stage() when disabled; entering and leaving it does nothing.
+NO_STAGE = nullcontext()
+
+def stage(name):
+    """Time the code in a with block, as a stage of the given name.
+
+    The same stage can run several times; the times add up.  Stages can be
+    nested, in which case the outer one includes the inner ones.
+
+    >>> reset(); enable()
+    >>> with stage('sleep'):
+    ...     time.sleep(0.01)
+    >>> calls, wall, cpu = timers['sleep']
+    >>> calls, wall >= 0.01, cpu < 0.01
+    (1, True, True)
+    >>> disable()
+    """
+
+    if enabled:
+        return(Stage(name))
+    else:
+        return(NO_STAGE)
+
+# The functions of the regex module that we count.
+REGEX_FUNCTIONS = ('match', 'fullmatch', 'search', 'sub', 'subn', 'split',
+                   'findall', 'finditer')
+
+class CountingRegex:
+    """Stands for the regex module, counting calls to its functions."""
+
+    def __init__(self, module):
+        self.module = module
+
+    def __getattr__(self, name):
+        attribute = getattr(self.module, name)
+        if name not in REGEX_FUNCTIONS:
+            return(attribute)
+
+        def counted(*args, **kwargs):
+            count('regex call', name)
+            return(attribute(*args, **kwargs))
+        return(counted)
+
+def patch_regex(module):
+    "Make module's calls to the regex module go through CountingRegex."
+
+    import regex
+
+    originals = {}
+    for attribute, value in list(vars(module).items()):
+        # (lazy_import() puts the module itself in sys.modules, so this also
+        # catches modules that haven't loaded it yet)
+        if value is regex:
+            originals[attribute] = value
+            setattr(module, attribute, CountingRegex(regex))
+    regex_patched[module.__name__] = originals
+
+def report():
+    "Return the statistics as a printable string."
+
+    lines = []
+    if timers:
+        lines.append('%-32s %8s %12s %12s' % ('Stage', 'calls', 'wall (s)', 'CPU (s)'))
+        for name, (calls, wall, cpu) in timers.items():
+            lines.append('%-32s %8d %12.4f %12.4f' % (name, calls, wall, cpu))
+
+    groups = []
+    for group, name in counters:
+        if group not in groups:
+            groups.append(group)
+    for group in groups:
+        lines.append('')
+        lines.append('%-32s %8s' % (group.capitalize(), 'count'))
+        items = [(name, n) for (g, name), n in counters.items() if g == group]
+        for name, n in sorted(items, key=lambda item: (-item[1], item[0])):
+            lines.append('%-32s %8d' % (name, n))
+
+    return("\n".join(lines))
@@ -1,5 +1,6 @@
 import unittest
 import doctest
+import hashlib
 import os
 import sys
 import logging
@@ -24,8 +25,23 @@ jmdict_file = basedir + '/cache/JMdict'
 jmdict_missing_examples_file = basedir + '/data/examples_not_in_jmdict.tsv'
 
 import joyodb
+import joyodb.binary
+import joyodb.charclass
+import joyodb.client
+import joyodb.furigana
+import joyodb.images
+import joyodb.kana
+import joyodb.kanaindex
 import joyodb.model
+import joyodb.okurigana
 import joyodb.convert
+import joyodb.coverage
+import joyodb.lint
+import joyodb.lookup
+import joyodb.scan
+import joyodb.server
+import joyodb.snapshot
+import joyodb.stats
 import regex as re
 
 
@@ -79,42 +95,121 @@ with open(jmdict_missing_examples_file, 'rt') as f:
         kanji, reading, example, furigana = line.strip().split("\t")
         JMDICT_MISSING_EXAMPLES.append((kanji, reading, example))
 
-jmdict_index = defaultdict(list)
 class JMdictEntry():
+    """The parts of a JMdict <entry> that we use: kanji expressions (keb),
+    readings (reb), and part-of-speech entities."""
 
-    def __init__(self, entry):
-        self.kanji_expressions = []
-        for k_ele in entry.iter('k_ele'):
-            keb = k_ele.find('keb')
-            self.kanji_expressions.append(keb.text)
-            jmdict_index[keb.text].append(self)
+    __slots__ = ('kanji_expressions', 'readings', 'parts_of_speech')
 
-        self.readings = []
-        for r_ele in entry.iter('r_ele'):
-            reb = r_ele.find('reb')
-            self.readings.append(reb.text)
+    def __init__(self, entry):
+        self.kanji_expressions = [keb.text for keb in entry.iterfind('k_ele/keb')]
+        self.readings = [reb.text for reb in entry.iterfind('r_ele/reb')]
 
         self.parts_of_speech = []
         for pos in entry.iter('pos'):
             for entity in pos.iter(tag=etree.Entity):
                 self.parts_of_speech.append(str(entity))
 
-def jmdict_is_kanji_entry(entry):
-    if entry.find('k_ele') is not None:
-        return True
+def load_jmdict(path, wanted):
+    """Read JMdict entries for the kanji expressions in wanted.
+
+    Returns a dictionary from expression to list of JMdictEntry objects.
+
+    JMdict is hundreds of megabytes of XML, and we only need a few thousand
+    entries; so rather than parsing the whole tree, we go through it one
+    <entry> at a time, and free each element as soon as we're done with it.
+    """
+
+    index = defaultdict(list)
+
+    for event, entry in etree.iterparse(path, tag='entry',
+                                        resolve_entities=False):
+        kebs = [keb.text for keb in entry.iterfind('k_ele/keb')]
+        if any([keb in wanted for keb in kebs]):
+            jmdict_entry = JMdictEntry(entry)
+            for keb in kebs:
+                if keb in wanted:
+                    index[keb].append(jmdict_entry)
+
+        # Free the entry, and the (already cleared) ones before it.
+        entry.clear()
+        while entry.getprevious() is not None:
+            del entry.getparent()[0]
+
+    return(index)
 
 def lemmatize_with_mecab(expression, kanji):
     '''Find the first word containing kanji; return (lemma, reading).'''
     nodes = mecab_tagger.parseToNode(expression)
     while nodes:
         features = nodes.feature.split(',')
-        if kanji in features[10]:
+        # (unknown words have fewer features)
+        if len(features) > 10 and kanji in features[10]:
             lemma = features[10]
             reading = romkan.to_hiragana(romkan.to_roma(features[6]))
             return((lemma, reading))
         nodes = nodes.next
     raise(ValueError("Mecab failed: %s, %s" % (expression, kanji)))
 
+def mecab_dictionary_version():
+    "A string identifying the dictionaries used by mecab_tagger."
+    versions = []
+    info = mecab_tagger.dictionary_info()
+    while info:
+        versions.append('%s:%s:%s' % (info.filename, info.version, info.size))
+        info = info.next
+    return(';'.join(versions))
+
+class LemmaMemo():
+    """Persistent memo of lemmatize_with_mecab() results.
+
+    Results are saved in cache/, in a TSV file named after a hash of the MeCab
+    dictionary version, so a dictionary upgrade starts a fresh memo.  Each line
+    is: expression, kanji, lemma, reading; lemma and reading are empty where
+    MeCab couldn't find the kanji.
+
+    Concatenating many examples into a single MeCab input would change the
+    analysis at the seams, so examples are still parsed one by one; but all
+    the missing ones are done in one pass, and saved with a single write.
+    """
+
+    def __init__(self):
+        key = hashlib.sha1(mecab_dictionary_version().encode('utf-8')).hexdigest()
+        self.path = basedir + '/cache/mecab_lemmas-%s.tsv' % key[:16]
+
+        # (expression, kanji) -> (lemma, reading), or None
+        self.lemmas = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'rt') as f:
+                for line in f:
+                    expression, kanji, lemma, reading = line.rstrip("\n").split("\t")
+                    if lemma:
+                        self.lemmas[(expression, kanji)] = (lemma, reading)
+                    else:
+                        self.lemmas[(expression, kanji)] = None
+
+    def lemmatize_many(self, cases):
+        """Lemmatize many (expression, kanji) pairs; return a dictionary from
+        each pair to (lemma, reading), or None if MeCab couldn't find it."""
+
+        lines = []
+        for case in cases:
+            if case in self.lemmas:
+                continue
+            try:
+                result = lemmatize_with_mecab(*case)
+                lines.append("\t".join(case + result) + "\n")
+            except ValueError:
+                result = None
+                lines.append("\t".join(case + ('', '')) + "\n")
+            self.lemmas[case] = result
+
+        if lines:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'at') as f:
+                f.write(''.join(lines))
+
+        return({case: self.lemmas[case] for case in cases})
 
 class TestLoadedData(unittest.TestCase):
 
@@ -138,6 +233,437 @@ class TestLoadedData(unittest.TestCase):
                         self.assertIn('.', r.reading)
 
 
+    def test_lookup(self):
+        for k in joyodb.loaded_data.kanjis:
+            self.assertIs(joyodb.lookup.kanji(k.kanji), k)
+            self.assertIs(joyodb.lookup.get(k.kanji), k)
+            if k.standard_character:
+                self.assertIs(joyodb.lookup.get(k.standard_character), k)
+            if k.standard_variant:
+                self.assertIs(joyodb.lookup.get(k.standard_variant), k)
+                self.assertIs(joyodb.lookup.get(k.accepted_variant), k)
+            if type(k.old_kanji) is list:
+                for old in k.old_kanji:
+                    self.assertIs(joyodb.lookup.get(old), k)
+            for r in k.readings:
+                self.assertIn(r, joyodb.lookup.readings(r.reading))
+                self.assertIn(r, joyodb.lookup.readings(r.reading.replace('.', '')))
+
+        self.assertEqual(len(joyodb.lookup.get_many('弁辯瓣辨')), 4)
+        self.assertEqual(set(joyodb.lookup.get_many('弁辯瓣辨')),
+                         {joyodb.lookup.kanji('弁')})
+
+    def test_kana_index(self):
+        all_readings = [r for k in joyodb.loaded_data.kanjis for r in k.readings]
+        keys = [joyodb.kanaindex.reading_key(r.reading) for r in all_readings]
+        rank = lambda n: (joyodb.kanaindex.default_rank(all_readings[n]), n)
+
+        prefixes = set([''])
+        for key in keys:
+            prefixes.add(key[:1])
+            prefixes.add(key[:2])
+
+        for prefix in prefixes:
+            expected = [n for n in range(len(all_readings)) if keys[n].startswith(prefix)]
+            found = joyodb.kanaindex.prefix(prefix)
+            self.assertEqual(sorted([id(r) for r in found]),
+                             sorted([id(all_readings[n]) for n in expected]))
+
+            expected.sort(key=rank)
+            self.assertEqual(joyodb.kanaindex.top(prefix, 5),
+                             [all_readings[n] for n in expected[:5]])
+            self.assertEqual(joyodb.kanaindex.top(prefix, 5, kind='Kun', uncommon=False),
+                             [all_readings[n] for n in expected
+                              if all_readings[n].kind == 'Kun'
+                              and not all_readings[n].uncommon][:5])
+
+        for r in all_readings:
+            self.assertIn(r, joyodb.kanaindex.exact(r.reading))
+            if r.variation_of:
+                self.assertIn(r, joyodb.kanaindex.exact(r.reading, variation_of=r.variation_of))
+                self.assertNotIn(r, joyodb.kanaindex.exact(r.reading, variation_of=False))
+
+    def test_furigana(self):
+        glosses = defaultdict(list)
+        for gloss, orthographies in joyodb.loaded_data.compound_readings.items():
+            for orthography in orthographies:
+                glosses[orthography].append(gloss)
+        for orthography in glosses:
+            spans = joyodb.furigana.annotate(orthography)
+            self.assertEqual(''.join([s.text for s in spans]), orthography)
+            self.assertIn(''.join([s.reading or s.text for s in spans]), glosses[orthography])
+
+        whole_words = set([w for w, entries in joyodb.scan.joyo_words(
+            joyodb.loaded_data.kanjis, joyodb.loaded_data.compound_readings).items()
+                           if [e for e in entries if e.kind != 'example']])
+        for k in joyodb.loaded_data.kanjis:
+            for r in k.readings:
+                for e in r.examples:
+                    if e.example in whole_words:
+                        continue
+                    spans = joyodb.furigana.annotate(e.example)
+                    self.assertEqual(''.join([s.text for s in spans]), e.example)
+                    readings = set([joyodb.furigana.reading_stem(other)
+                                    for other in k.readings
+                                    if e.example in [x.example for x in other.examples]])
+                    for span in spans:
+                        if span.text == k.kanji:
+                            self.assertIn(span.reading, readings)
+
+        html = joyodb.furigana.annotate_html('<p>明日</p>')
+        self.assertEqual(html, '&lt;p&gt;<ruby>明日<rt>あす</rt></ruby>&lt;/p&gt;')
+
+    def test_lint(self):
+        linter = joyodb.lint.Linter(joyodb.loaded_data.kanjis,
+                                    joyodb.loaded_data.compound_readings)
+
+        examples = []
+        for k in joyodb.loaded_data.kanjis:
+            for r in k.readings:
+                examples += [e.example for e in r.examples]
+        # (the test fixtures don't have all the kanji in the examples)
+        self.assertEqual([f for f in linter.lint_lines(examples)
+                          if f.category != 'non-joyo' or f.text in self.kanjis], [])
+        self.assertEqual(linter.stats['lines'], len(examples))
+
+        for k in joyodb.loaded_data.kanjis:
+            old_forms = k.old_kanji if type(k.old_kanji) is list else [k.old_kanji]
+            for old in old_forms:
+                if old and old not in self.kanjis:
+                    self.assertEqual(linter.check_kanji(old), ('old form', k.kanji))
+            for r in k.readings:
+                stem = joyodb.furigana.reading_stem(r)
+                self.assertTrue(linter.is_valid_reading(k.kanji, stem))
+                self.assertTrue(linter.is_valid_reading(k.kanji + '々', stem * 2))
+
+        for gloss, orthographies in joyodb.loaded_data.compound_readings.items():
+            for orthography in orthographies:
+                self.assertTrue(linter.is_valid_reading(orthography, gloss))
+
+        k = [k for k in joyodb.loaded_data.kanjis if type(k.old_kanji) is str][0]
+        stem = joyodb.furigana.reading_stem(k.readings[0])
+        text = ['｜%s《%s》' % (k.kanji, stem),
+                '%s%s<ruby>%s<rt>ん</rt></ruby>' % (k.old_kanji, k.kanji, k.kanji),
+                '鷗']
+        findings = list(linter.lint_lines(text))
+        self.assertEqual([(f.line, f.column, f.category, f.text) for f in findings],
+                         [(2, 1, 'old form', k.old_kanji), (2, 9, 'reading', k.kanji),
+                          (3, 1, 'non-joyo', '鷗')])
+
+        results = [('a', findings, linter.stats, linter.by_text),
+                   ('b', [], linter.stats, linter.by_text)]
+        stats, by_text = joyodb.lint.merge_stats(results)
+        self.assertEqual(stats['files'], 2)
+        self.assertEqual(stats['kanji'], 2 * linter.stats['kanji'])
+        self.assertEqual(by_text[('old form', k.old_kanji)], 2)
+
+        # lint_file() reuses the linter, but counts each file on its own
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            path = directory + '/text.txt'
+            with open(path, 'wt') as f:
+                f.write('\n'.join(text) + '\n')
+            results = [joyodb.lint.lint_file(path) for i in range(2)]
+        self.assertIs(joyodb.lint.linter(), joyodb.lint.linter())
+        self.assertEqual(results[0][1], findings)
+        self.assertEqual(results[1][2], results[0][2])
+        self.assertEqual(results[1][2]['lines'], 3)
+
+    def test_binary(self):
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            joyodb.convert.convert_to_binary(directory)
+            db = joyodb.binary.Database(directory + '/joyodb.bin')
+            try:
+                self.assertEqual(len(db.kanjis), len(joyodb.loaded_data.kanjis))
+                for k, view in zip(joyodb.loaded_data.kanjis, db.kanjis):
+                    self.assertEqual(joyodb.convert.kanji_to_dict(view),
+                                     joyodb.convert.kanji_to_dict(k))
+
+                index = joyodb.lookup.Index(joyodb.loaded_data.kanjis)
+                for string, k in index.by_any.items():
+                    self.assertEqual(db.get(string).kanji, k.kanji)
+                self.assertIsNone(db.get('鷗'))
+
+                self.assertEqual(db.compound_readings,
+                                 {gloss: sorted(orthographies) for gloss, orthographies
+                                  in joyodb.loaded_data.compound_readings.items()})
+
+                r = db.kanjis[-1].readings[-1]
+                self.assertEqual(r.kanji, db.kanjis[-1])
+                if r.examples:
+                    self.assertEqual(r.examples[0].reading.reading, r.reading)
+            finally:
+                db.close()
+
+            # re-exporting replaces the file, and doesn't disturb readers of
+            # the old one
+            path = directory + '/joyodb.bin'
+            db = joyodb.binary.Database(path)
+            try:
+                first = db.kanjis[0].kanji
+                joyodb.binary.write(path, joyodb.loaded_data.kanjis[1:], {})
+                self.assertEqual(db.kanjis[0].kanji, first)
+                self.assertEqual(len(db.kanjis), len(joyodb.loaded_data.kanjis))
+                self.assertEqual(joyodb.convert.kanji_to_dict(db.kanjis[-1]),
+                                 joyodb.convert.kanji_to_dict(joyodb.loaded_data.kanjis[-1]))
+            finally:
+                db.close()
+            db = joyodb.binary.Database(path)
+            self.assertEqual(len(db.kanjis), len(joyodb.loaded_data.kanjis) - 1)
+            db.close()
+            self.assertEqual([name for name in os.listdir(directory) if name.startswith('.')], [])
+
+            # a file from another version says which
+            with open(directory + '/joyodb.bin', 'r+b') as f:
+                f.seek(len(joyodb.binary.MAGIC))
+                f.write((joyodb.binary.FORMAT_VERSION + 1).to_bytes(4, 'little'))
+            with self.assertRaisesRegex(ValueError, 'version %d'
+                                        % (joyodb.binary.FORMAT_VERSION + 1)):
+                joyodb.binary.Database(directory + '/joyodb.bin')
+
+    def test_charclass(self):
+        import json
+        import tempfile
+
+        joyo = set()
+        old = set()
+        for k in joyodb.loaded_data.kanjis:
+            joyo.add(k.kanji)
+            if k.standard_character:
+                joyo.add(k.standard_character)
+            old |= set(joyodb.convert.old_kanji_list(k))
+        popular = set(joyodb.popular_alternatives.values())
+
+        with tempfile.TemporaryDirectory() as directory:
+            joyodb.convert.convert_to_charclass(directory)
+            cc = joyodb.charclass.CharClass.read(directory + '/joyo_charclass.bin')
+            with open(directory + '/joyo_charclass.json', 'rt') as f:
+                document = json.load(f)
+
+        self.assertEqual(cc.table, joyodb.charclass.charclass().table)
+
+        # every CJK codepoint, and then some
+        characters = ''.join([chr(c) for c in range(0x3000, 0x10000)]
+                             + [chr(c) for c in range(0x20000, 0x2b000)])
+        flags = cc.flags(characters)
+        for name, members in (('joyo', joyo), ('old', old), ('popular', popular)):
+            members = set([ch for ch in members if len(ch) == 1])
+            flag = dict(joyodb.charclass.CLASSES)[name]
+            self.assertEqual(set([characters[i] for i, f in enumerate(flags) if f & flag]),
+                             members)
+
+            self.assertEqual(document[name]['count'], len(members))
+            self.assertEqual(set([chr(c) for first, last in document[name]['ranges']
+                                  for c in range(first, last + 1)]),
+                             members)
+            regex = re.compile(document[name]['regex'])
+            self.assertEqual(set(regex.findall(characters)), members)
+
+        self.assertTrue(cc.all_in(''.join(sorted(joyo))))
+        self.assertEqual(cc.first_outside('%sか' % ''.join(sorted(joyo))), len(joyo))
+
+    def test_coverage(self):
+        if joyodb.coverage.np is None:
+            self.skipTest('NumPy not installed')
+
+        cov = joyodb.coverage.coverage()
+        categories = joyodb.coverage.character_categories(joyodb.loaded_data.kanjis)
+
+        texts = [e.example for k in joyodb.loaded_data.kanjis
+                 for r in k.readings for e in r.examples]
+        texts += ['', 'abc', '國語と𠮟る、頰と頬、鬱𩸽。']
+        histograms = cov.histograms(texts)
+        self.assertEqual(histograms.tolist(),
+                         [joyodb.coverage.python_histogram(t, categories)
+                          for t in texts])
+        self.assertEqual(histograms.sum(axis=1).tolist(), [len(t) for t in texts])
+
+        shares = cov.shares(histograms)
+        for text, row in zip(texts, shares):
+            self.assertAlmostEqual(row.sum(), 1.0 if text else 0.0)
+
+        batches = list(cov.batches(iter(texts), batch_size=100))
+        self.assertEqual(len(batches), (len(texts) + 99) // 100)
+        self.assertEqual(joyodb.coverage.np.concatenate(batches).tolist(),
+                         histograms.tolist())
+
+    def test_server(self):
+        import asyncio
+        import tempfile
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        # A server in a thread of its own, on a Unix socket.
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        server = joyodb.server.Server()
+        with tempfile.TemporaryDirectory() as directory:
+            # (a file that isn't a socket is left alone)
+            path = directory + '/data.tsv'
+            with open(path, 'wt') as f:
+                f.write('data\n')
+            with self.assertRaises(FileExistsError):
+                asyncio.run_coroutine_threadsafe(server.start(path=path), loop).result()
+            self.assertTrue(os.path.isfile(path))
+
+            path = directory + '/joyodb.sock'
+            asyncio.run_coroutine_threadsafe(server.start(path=path), loop).result()
+            client = joyodb.client.Client(path=path, pool_size=3)
+            try:
+                characters = [k.kanji for k in joyodb.loaded_data.kanjis]
+                with ThreadPoolExecutor(6) as executor:
+                    results = list(executor.map(client.kanji, characters))
+                self.assertEqual([r[0]['kanji'] for r in results], characters)
+                self.assertEqual(results[0][0], joyodb.convert.kanji_to_dict(
+                    joyodb.loaded_data.kanjis[0]))
+
+                k = joyodb.loaded_data.kanjis[0]
+                r = k.readings[0]
+                self.assertIn(k.kanji, [found['kanji'] for found in client.reading(r.reading)])
+                self.assertIn({'kind': 'example', 'kanji': k.kanji, 'reading': r.reading, 'gloss': None},
+                              client.example(r.examples[0].example))
+                text = '明日は' + r.examples[0].example
+                self.assertEqual(client.annotate_many([text, '']),
+                                 [[list(span) for span in joyodb.furigana.annotate(text)], []])
+                self.assertEqual(client.kanji('鷗'), [None])
+
+                with self.assertRaises(ValueError):
+                    client.request('define', '鷗')
+                # (the connection is still usable after an error)
+                self.assertEqual(client.kanji_many(['', characters[1]])[1][0]['kanji'],
+                                 characters[1])
+
+                # many requests at once come in few batches
+                requests = server.stats['requests']
+                batches = server.stats['batches']
+                client.kanji_many(characters)
+                self.assertEqual(server.stats['requests'] - requests, len(characters))
+                self.assertLess(server.stats['batches'] - batches,
+                                len(characters) // joyodb.server.MAX_BATCH + 3)
+                self.assertLessEqual(server.stats['connections'], 3)
+            finally:
+                client.close()
+                asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+                loop.call_soon_threadsafe(loop.stop)
+                thread.join()
+                loop.close()
+
+    def test_sql(self):
+        import sqlite3
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            joyodb.convert.convert_to_sql(directory)
+            db = sqlite3.connect('file:%s/joyodb.sqlite3?mode=ro' % directory,
+                                 uri=True)
+
+            self.assertEqual(db.execute('SELECT COUNT(*) FROM kanji').fetchone()[0],
+                             len(joyodb.loaded_data.kanjis))
+            self.assertEqual(db.execute('PRAGMA foreign_key_check').fetchall(), [])
+
+            for k in joyodb.loaded_data.kanjis:
+                readings = db.execute('''SELECT r.reading FROM readings r
+                                         JOIN kanji k ON r.kanji_id = k.id
+                                         WHERE k.kanji = ? ORDER BY r.id''',
+                                      (k.kanji,)).fetchall()
+                self.assertEqual([r[0] for r in readings],
+                                 [r.reading for r in k.readings])
+
+            plan = db.execute('''EXPLAIN QUERY PLAN SELECT * FROM readings
+                                 WHERE reading_without_dot = ?''',
+                              ('あわれ',)).fetchall()
+            self.assertIn('USING INDEX', str(plan))
+            db.close()
+
+    def test_json(self):
+        import json
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            joyodb.convert.convert_to_json(directory)
+            joyodb.convert.convert_to_ndjson(directory)
+
+            with open(directory + '/joyodb.json') as f:
+                document = json.load(f)
+            with open(directory + '/joyodb.ndjson') as f:
+                records = [json.loads(line) for line in f]
+
+        self.assertEqual(records, document['kanjis'])
+        self.assertEqual([r['kanji'] for r in records],
+                         [k.kanji for k in joyodb.loaded_data.kanjis])
+        self.assertEqual(set(document['compound_readings']),
+                         set(joyodb.loaded_data.compound_readings))
+
+        for record, k in zip(records, joyodb.loaded_data.kanjis):
+            self.assertEqual([r['reading'] for r in record['readings']],
+                             [r.reading for r in k.readings])
+            self.assertEqual([len(r['examples']) for r in record['readings']],
+                             [len(r.examples) for r in k.readings])
+
+    def test_html(self):
+        import gzip
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as directory:
+            joyodb.convert.convert_to_html(directory, page_size=7)
+
+            html = ''
+            page = 1
+            while os.path.exists('%s/html/page-%03d.html' % (directory, page)):
+                path = '%s/html/page-%03d.html' % (directory, page)
+                with open(path) as f:
+                    content = f.read()
+                with gzip.open(path + '.gz', 'rt') as f:
+                    self.assertEqual(f.read(), content)
+                html += content
+                page += 1
+
+            kanjis = joyodb.loaded_data.kanjis
+            self.assertEqual(page - 1, (len(kanjis) + 6) // 7)
+            for k in kanjis:
+                self.assertIn('<tr id="%s">' % joyodb.convert.html_anchor(k), html)
+                if k.standard_variant:
+                    self.assertTrue(os.path.exists(
+                        '%s/html/variants_img/%x-accepted.png'
+                        % (directory, ord(k.kanji))))
+
+            # with bigger pages, the old ones go away
+            joyodb.convert.convert_to_html(directory, page_size=len(kanjis))
+            self.assertEqual(sorted([name for name in os.listdir(directory + '/html')
+                                     if name.startswith('page-')]),
+                             ['page-001.html', 'page-001.html.gz'])
+
+    def test_variant_images(self):
+        for k in joyodb.loaded_data.kanjis:
+            if k.standard_variant:
+                self.assertEqual(k.standard_variant_image[:4], b'\x89PNG')
+                self.assertEqual(k.accepted_variant_image[:4], b'\x89PNG')
+                self.assertNotEqual(k.standard_variant_image,
+                                    k.accepted_variant_image)
+            else:
+                self.assertIsNone(k.standard_variant_image)
+                self.assertIsNone(k.accepted_variant_image)
+
+    def test_scan(self):
+        for k in joyodb.loaded_data.kanjis:
+            for r in k.readings:
+                for e in r.examples:
+                    self.assertIs(e.reading, r)
+                    matches = list(joyodb.scan.scan(e.example, longest=False))
+                    found = [entry.owner for m in matches for entry in m.entries
+                             if m.word == e.example and entry.kind == 'example']
+                    self.assertIn(e, found)
+
+        for gloss, orthographies in joyodb.loaded_data.compound_readings.items():
+            for orthography in orthographies:
+                # a sentence with the compound split across chunks
+                chunks = ['「' + orthography[:1], orthography[1:] + '」']
+                matches = list(joyodb.scan.scan_stream(chunks))
+                self.assertIn((1, orthography), [(m.start, m.word) for m in matches])
+
     def test_against_wikipedia(self):
         with open(wikipedia_file, 'rt') as f:
             w = BeautifulSoup(f)
@@ -227,15 +753,20 @@ class TestLoadedData(unittest.TestCase):
                     self.assertIn(reading.reading, kanjidic_data[kanji.kanji])
 
     def test_against_edict(self):
-        # list of EdictEntry objects
-        jmdict_data = []
+        # We only need JMdict entries for the examples, and for their lemmas
+        # (for inflected examples).
+        cases = [(e.example, k.kanji)
+                 for k in joyodb.loaded_data.kanjis
+                 for r in k.readings
+                 for e in r.examples]
+        lemmas = LemmaMemo().lemmatize_many(cases)
+
+        wanted = set([expression for expression, kanji in cases])
+        for lemma in lemmas.values():
+            if lemma:
+                wanted.add(lemma[0])
 
-        parser = etree.XMLParser(resolve_entities=False)
-        tree = etree.parse(jmdict_file, parser)
-        for entry in  tree.getroot().iter('entry'):
-            if jmdict_is_kanji_entry(entry):
-                jmdict_entry = JMdictEntry(entry)
-                jmdict_data.append(jmdict_entry)
+        jmdict_index = load_jmdict(jmdict_file, wanted)
 
         for k in joyodb.loaded_data.kanjis:
             for r in k.readings:
@@ -248,7 +779,11 @@ class TestLoadedData(unittest.TestCase):
                     elif (k.kanji, r.reading, e.example) in JMDICT_MISSING_EXAMPLES:
                         continue
                     else:
-                        lemma, lemma_reading = lemmatize_with_mecab(e.example, k.kanji)
+                        if lemmas[(e.example, k.kanji)]:
+                            lemma, lemma_reading = lemmas[(e.example, k.kanji)]
+                        else:
+                            # raises the error again
+                            lemma, lemma_reading = lemmatize_with_mecab(e.example, k.kanji)
                         if lemma in jmdict_index.keys():
                             jmdict_entries = jmdict_index[lemma]
                             jmdict_entries = [je for je in jmdict_entries
@@ -274,10 +809,8 @@ class TestLoadedData(unittest.TestCase):
                     alt_kanji_ch = looks_like_alternate[1]
                     assert(alt_kanji_ch)
 
-                    alt_kanji_list = [obj for obj in joyodb.loaded_data.kanjis
-                                      if obj.kanji == alt_kanji_ch]
-                    assert(len(alt_kanji_list) == 1)
-                    alt_kanji = alt_kanji_list[0]
+                    alt_kanji = joyodb.lookup.kanji(alt_kanji_ch)
+                    assert(alt_kanji)
 
                     found=False
                     for their_readings in alt_kanji.readings:
@@ -306,8 +839,7 @@ class TestLoadedData(unittest.TestCase):
 
                 for ch in orthography:
                     if re.match(r'\p{Han}', ch):
-                        k = next(k for k in joyodb.loaded_data.kanjis
-                                 if k.kanji == ch)
+                        k = joyodb.lookup.kanji(ch)
                         all_glosses = list(k.compound_readings.values()) + list(k.placename_readings.values())
                         if gloss not in all_glosses:
                             found=False
@@ -327,13 +859,128 @@ class TestLoadedData(unittest.TestCase):
                                 raise(RuntimeError("Couldn't find compound %s in kanji %s" %
                                     (orthography, k.kanji)))
 
+class TestSnapshot(unittest.TestCase):
+
+    def test_snapshot_roundtrip(self):
+        '''A snapshot must restore exactly what the parser produced.'''
+
+        joyodb.convert.parse()
+        parsed = [str(k) for k in joyodb.loaded_data.kanjis]
+        parsed_compounds = dict(joyodb.loaded_data.compound_readings)
+
+        path = joyodb.snapshot.snapshot_path()
+        joyodb.snapshot.save_snapshot(path)
+        joyodb.loaded_data.kanjis = None
+        self.assertTrue(joyodb.snapshot.load_snapshot(path))
+
+        self.assertEqual(parsed, [str(k) for k in joyodb.loaded_data.kanjis])
+        self.assertEqual(parsed_compounds,
+                         dict(joyodb.loaded_data.compound_readings))
+        for k in joyodb.loaded_data.kanjis:
+            for r in k.readings:
+                self.assertIs(r.kanji, k)
+
+    def test_snapshot_key(self):
+        key = joyodb.snapshot.snapshot_key()
+        self.assertEqual(key, joyodb.snapshot.snapshot_key())
+        self.assertIn(key[:32], joyodb.snapshot.snapshot_path())
+
+class TestStats(unittest.TestCase):
+
+    def test_parse_stats(self):
+        import regex
+        import joyodb.stats
+
+        joyodb.stats.reset()
+        joyodb.stats.enable(count_regex=True)
+        try:
+            joyodb.convert.parse()
+        finally:
+            joyodb.stats.disable()
+
+        counters = joyodb.stats.counters
+        timers = joyodb.stats.timers
+        row_shapes = sum([n for (group, name), n in counters.items()
+                          if group == 'row shape'])
+        self.assertEqual(row_shapes, timers['parse: row classification'][0])
+        self.assertEqual(list(timers)[0], 'parse: read file')
+        self.assertGreater(counters[('regex call', 'match')], 0)
+        self.assertIn('Row shape', joyodb.stats.report())
+
+        # disable() puts the regex module back.
+        self.assertIs(joyodb.convert.re, regex)
+        self.assertIs(joyodb.model.re, regex)
+        joyodb.stats.reset()
+
+class TestImport(unittest.TestCase):
+
+    def test_import_has_no_side_effects(self):
+        """Importing the package must not touch data, cache or output."""
+
+        import subprocess
+
+        script = """
+import sys
+touched = []
+def hook(event, args):
+    if event in ('open', 'os.mkdir') and type(args[0]) is str:
+        if args[0].startswith(%r) and not args[0].endswith(('.py', '.pyc')):
+            touched.append((event, args[0]))
+sys.addaudithook(hook)
+
+sys.path.insert(0, %r)
+import joyodb, joyodb.model, joyodb.lookup, joyodb.scan, joyodb.images
+print(touched)
+print(type(sys.modules['regex']).__name__, 'romkan' in sys.modules)
+""" % (basedir, basedir)
+
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         universal_newlines=True)
+        touched, lazy = output.splitlines()
+        self.assertEqual(touched, '[]')
+        self.assertEqual(lazy, '_LazyModule False')
+
+class TestKana(unittest.TestCase):
+
+    def test_tables_match_romkan(self):
+        '''Our kana tables must be romkan's, katakana and hiragana together.'''
+
+        import romkan.common
+        romkan_table = dict(romkan.common.KANROM_H)
+        romkan_table.update(romkan.common.KANROM)
+        self.assertEqual(joyodb.kana.KANA_ROMAJI, romkan_table)
+
+    def test_conversions_match_romkan(self):
+        joyodb.convert.parse()
+        readings = [r.reading for k in joyodb.loaded_data.kanjis for r in k.readings]
+        readings += list(joyodb.loaded_data.compound_readings.keys())
+
+        self.assertEqual(joyodb.kana.to_romaji_many(readings),
+                         [romkan.to_hepburn(r) for r in readings])
+        self.assertEqual(joyodb.kana.katakana_to_hiragana_many(readings),
+                         [romkan.to_hiragana(romkan.to_roma(r)) for r in readings])
+
 def load_tests(loader, tests, ignore):
     """Load doctests into unit tests suite.
 
     See Python's doctest.html for detail."""
     tests.addTests(doctest.DocTestSuite(joyodb))
+    tests.addTests(doctest.DocTestSuite(joyodb.binary))
+    tests.addTests(doctest.DocTestSuite(joyodb.charclass))
+    tests.addTests(doctest.DocTestSuite(joyodb.furigana))
+    tests.addTests(doctest.DocTestSuite(joyodb.images))
+    tests.addTests(doctest.DocTestSuite(joyodb.kana))
+    tests.addTests(doctest.DocTestSuite(joyodb.lint))
+    tests.addTests(doctest.DocTestSuite(joyodb.kanaindex))
     tests.addTests(doctest.DocTestSuite(joyodb.model))
+    tests.addTests(doctest.DocTestSuite(joyodb.okurigana))
     tests.addTests(doctest.DocTestSuite(joyodb.convert))
+    if joyodb.coverage.np is not None:
+        tests.addTests(doctest.DocTestSuite(joyodb.coverage))
+    tests.addTests(doctest.DocTestSuite(joyodb.lookup))
+    tests.addTests(doctest.DocTestSuite(joyodb.scan))
+    tests.addTests(doctest.DocTestSuite(joyodb.server))
+    tests.addTests(doctest.DocTestSuite(joyodb.stats))
     return tests
 
 if __name__ == '__main__':
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Run the checks against external references in parallel.
+#
+# test_against_wikipedia, test_against_kanjidic, test_against_edict and
+# test_compound_readings each read a big file of their own (or, for the last
+# one, walk the whole table), and don't depend on each other.  Here we parse
+# the Joyo data once, save it as a snapshot (see joyodb/snapshot.py), and run
+# the checks in a pool of processes.  Each worker loads the snapshot from disk,
+# instead of parsing again or receiving the data through a pipe; then it runs
+# its checks, and sends back only the outcome and timings, which we merge into
+# a single report.
+#
+# A check whose reference file is missing from cache/ is skipped (`make test`
+# downloads them).  The exit status is 1 if any check failed.
+#
+# Usage: test/validate.py [--jobs N] [check...]
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import importlib.util
+import os
+import sys
+import time
+import unittest
+
+# "The parent dir of the directory of the full path of this file."
+basedir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, basedir)
+
+import joyodb
+import joyodb.snapshot
+
+# check name -> reference file it needs (or None)
+CHECKS = {
+    'test_against_wikipedia': 'wikipedia_file',
+    'test_against_kanjidic': 'kanjidic_file',
+    'test_against_edict': 'jmdict_file',
+    'test_compound_readings': None,
+}
+
+tests = None
+def tests_module():
+    """Return test/test.py as a module, loading it on first use.
+
+    It's loaded as joyodb_tests: imported as plain "test", it would hide the
+    standard library's test package.
+    """
+
+    global tests
+    if tests is None:
+        spec = importlib.util.spec_from_file_location('joyodb_tests',
+                                                      basedir + '/test/test.py')
+        tests = importlib.util.module_from_spec(spec)
+        sys.modules['joyodb_tests'] = tests
+        spec.loader.exec_module(tests)
+    return(tests)
+
+def init_worker(snapshot):
+    "Load the parsed data in a worker, and set up the test class with it."
+
+    if not joyodb.snapshot.load_snapshot(snapshot):
+        raise(RuntimeError("Could not load snapshot: %s" % snapshot))
+
+    test = tests_module()
+    test.TestLoadedData.kanjis = {}
+    for k in joyodb.loaded_data.kanjis:
+        test.TestLoadedData.kanjis[k.kanji] = k
+
+def run_check(name):
+    """Run one check of TestLoadedData, in a worker.
+
+    Returns (name, status, seconds, details), where status is one of 'ok',
+    'FAIL', 'ERROR' or 'skipped'; details are the traceback or skip reason.
+    """
+
+    test = tests_module()
+
+    reference = CHECKS.get(name)
+    if reference and not os.path.exists(getattr(test, reference)):
+        return((name, 'skipped', 0.0,
+                "missing %s" % os.path.relpath(getattr(test, reference), basedir)))
+
+    # Running the bare TestCase, rather than a suite, skips setUpClass() and
+    # its parse; init_worker() already did the equivalent.
+    result = unittest.TestResult()
+    start = time.perf_counter()
+    test.TestLoadedData(name).run(result)
+    elapsed = time.perf_counter() - start
+
+    if result.errors:
+        return((name, 'ERROR', elapsed, result.errors[0][1]))
+    elif result.failures:
+        return((name, 'FAIL', elapsed, result.failures[0][1]))
+    elif result.skipped:
+        return((name, 'skipped', elapsed, result.skipped[0][1]))
+    else:
+        return((name, 'ok', elapsed, ''))
+
+def validate(names, jobs=None):
+    """Run the given checks in parallel.
+
+    Returns the list of run_check() results, in the order of names, and the
+    time spent loading the data.
+    """
+
+    start = time.perf_counter()
+    joyodb.snapshot.load()
+    load_time = time.perf_counter() - start
+    snapshot = joyodb.snapshot.snapshot_path()
+
+    with ProcessPoolExecutor(max_workers=jobs or len(names),
+                             initializer=init_worker,
+                             initargs=(snapshot,)) as executor:
+        results = list(executor.map(run_check, names))
+    return(results, load_time)
+
+def report(results, load_time, wall_time):
+    "Return the results of validate() as a printable string."
+
+    lines = ['%-28s %-8s %10s' % ('check', 'result', 'time (s)')]
+    for name, status, seconds, details in results:
+        lines.append('%-28s %-8s %10.2f' % (name, status, seconds))
+    lines.append('')
+    lines.append('Loaded data in %.2f s; checks took %.2f s in total, %.2f s wall-clock.'
+                 % (load_time, sum([r[2] for r in results]), wall_time))
+
+    for name, status, seconds, details in results:
+        if status in ('FAIL', 'ERROR'):
+            lines.append('')
+            lines.append('%s: %s' % (status, name))
+            lines.append(details.rstrip())
+    return("\n".join(lines))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Validate the Joyo data against external references.')
+    parser.add_argument('--jobs', '-j', type=int,
+                        help='number of worker processes (default: one per check)')
+    parser.add_argument('checks', nargs='*',
+                        help='checks to run (default: all of %s)' % ', '.join(CHECKS.keys()))
+    args = parser.parse_args()
+    for name in args.checks:
+        if name not in CHECKS:
+            parser.error('unknown check: %s' % name)
+
+    names = args.checks or list(CHECKS.keys())
+    start = time.perf_counter()
+    results, load_time = validate(names, args.jobs)
+    print(report(results, load_time, time.perf_counter() - start))
+
+    if [r for r in results if r[1] in ('FAIL', 'ERROR')]:
+        sys.exit(1)